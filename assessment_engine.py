@@ -0,0 +1,495 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+
+EPOCH = datetime(1970, 1, 1)
+
+# Idle times of a full period are clamped to the period minus this, so the
+# expression never divides by zero
+IDLE_CLAMP_MARGIN = 1e-9
+
+
+def idle_clamp(period, idle_clamp_from, idle_clamp_to):
+    """
+    Get the idle time clamp bounds, defaulting to the full period and the
+    period minus IDLE_CLAMP_MARGIN.
+    """
+    if idle_clamp_from is None:
+        idle_clamp_from = period
+    if idle_clamp_to is None:
+        idle_clamp_to = period - IDLE_CLAMP_MARGIN
+    return idle_clamp_from, idle_clamp_to
+
+
+def expression_values(
+    first_values,
+    second_values,
+    idle_time_values,
+    period=300,
+    idle_clamp_from=None,
+    idle_clamp_to=None,
+):
+    """
+    Compute the (first + second) / (period - idle) expression for a page.
+
+    Args:
+    - first_values: Read ops or read bytes values.
+    - second_values: Write ops or write bytes values.
+    - idle_time_values: Volume idle time values.
+    - period: The metric period in seconds.
+    - idle_clamp_from: Idle times at or above this value are clamped. Defaults
+      to the period.
+    - idle_clamp_to: The value clamped idle times are replaced with. Defaults
+      to the period minus IDLE_CLAMP_MARGIN.
+
+    The three series must hold the values of the same datapoints in the
+    same order, such as the rows of a SeriesJoin block.
+
+    Returns:
+    - A float64 array with one expression value per complete datapoint.
+      Datapoints with a missing value are dropped.
+    """
+    idle_clamp_from, idle_clamp_to = idle_clamp(period, idle_clamp_from, idle_clamp_to)
+    count = min(len(first_values), len(second_values), len(idle_time_values))
+    first = np.asarray(first_values[:count], dtype=np.float64)
+    second = np.asarray(second_values[:count], dtype=np.float64)
+    idle_time = np.asarray(idle_time_values[:count], dtype=np.float64)
+
+    idle_time = np.where(idle_time >= idle_clamp_from, idle_clamp_to, idle_time)
+    complete = ~(np.isnan(first) | np.isnan(second) | np.isnan(idle_time))
+
+    return (first[complete] + second[complete]) / (period - idle_time[complete])
+
+
+def expression_math(
+    first_id,
+    second_id,
+    idle_time_id,
+    period=300,
+    idle_clamp_from=None,
+    idle_clamp_to=None,
+):
+    """
+    Build the CloudWatch metric math version of expression_values.
+
+    Args:
+    - first_id: The query Id of the read ops or read bytes metric.
+    - second_id: The query Id of the write ops or write bytes metric.
+    - idle_time_id: The query Id of the volume idle time metric.
+    - period: The metric period in seconds.
+    - idle_clamp_from: Idle times at or above this value are clamped. Defaults
+      to the period.
+    - idle_clamp_to: The value clamped idle times are replaced with. Defaults
+      to the period minus IDLE_CLAMP_MARGIN.
+
+    Returns:
+    - The metric math expression. CloudWatch only returns datapoints where
+      every metric has a value.
+    """
+    idle_clamp_from, idle_clamp_to = idle_clamp(period, idle_clamp_from, idle_clamp_to)
+    idle_time = (
+        f"IF({idle_time_id} >= {idle_clamp_from}, {idle_clamp_to}, {idle_time_id})"
+    )
+    return f"({first_id} + {second_id}) / ({period} - {idle_time})"
+
+
+def epoch_seconds(timestamps):
+    """
+    Convert timestamps to an int64 array of epoch seconds.
+
+    Args:
+    - timestamps: UTC datetimes, aware as botocore returns them or naive, or
+      epoch seconds already, as the metric cache returns them.
+    """
+    if not len(timestamps):
+        return np.empty(0, dtype=np.int64)
+    first = timestamps[0]
+    if not isinstance(first, datetime):
+        return np.asarray(timestamps, dtype=np.int64)
+
+    # Subtracting a datetime with the same tzinfo skips the UTC offset
+    # lookups, which dominate datetime.timestamp() with botocore's tzutc
+    epoch = EPOCH.replace(tzinfo=first.tzinfo)
+    return np.fromiter(
+        map(timedelta.total_seconds, map(epoch.__rsub__, timestamps)),
+        dtype=np.float64,
+        count=len(timestamps),
+    ).astype(np.int64)
+
+
+def sorted_contains(sorted_values, values):
+    """
+    Get a boolean array of which values are in the sorted array, with a
+    binary search per value.
+    """
+    if not len(sorted_values):
+        return np.zeros(len(values), dtype=bool)
+    positions = np.searchsorted(sorted_values, values)
+    positions[positions == len(sorted_values)] = 0
+    return sorted_values[positions] == values
+
+
+def same_timestamps(timestamps, other):
+    """
+    Check whether two timestamp lists or arrays are equal.
+    """
+    if timestamps is other:
+        return True
+    if len(timestamps) != len(other):
+        return False
+    if isinstance(timestamps, list) and isinstance(other, list):
+        return timestamps == other
+    return np.array_equal(timestamps, other)
+
+
+class SeriesJoin:
+    """
+    Align metric series on their timestamps, one page at a time.
+
+    CloudWatch does not guarantee that the series of a page have the same
+    length or order, so datapoints are matched by timestamp instead of by
+    position. Each series is converted to int64 epoch seconds and float64
+    values, sorted, and joined with binary searches over the sorted arrays.
+
+    A datapoint whose timestamp is not in every series yet is carried over
+    to the next page, since GetMetricData may return the datapoints of one
+    bucket in different pages for different series. It is dropped once a
+    series that lacks it is complete (its StatusCode is not "PartialData")
+    or has returned datapoints on both sides of it, since each series comes
+    back in timestamp order. Once no series is partial, the request is
+    over and the next page may start another time range, such as the next
+    sub-range of a split request. reset() drops what is still carried over,
+    at the end of a time range.
+    """
+
+    def __init__(self, metric_ids):
+        """
+        Args:
+        - metric_ids: The metric ids of the series, in the order of the rows
+          of the joined blocks.
+        """
+        self.metric_ids = tuple(metric_ids)
+        self.reset()
+
+    def add(self, page):
+        """
+        Args:
+        - page: MetricDataResults keyed by metric id. A metric id missing
+          from the page has no datapoints in it.
+
+        Returns:
+        - A tuple containing the sorted int64 timestamps that every series
+          has and a float64 block with one row of values per metric id.
+        """
+        if not any(self.partial):
+            # Nothing is carried over from a finished request, and the
+            # ranges it scanned do not bound the next one
+            self.reset()
+
+        series = []
+        # The series of a page usually share their timestamps, so equal
+        # timestamp lists are converted and sorted once
+        converted = None
+        for row, metric_id in enumerate(self.metric_ids):
+            pending_timestamps, pending_values = self.pending[row]
+            result = page.get(metric_id)
+            self.partial[row] = (
+                result is not None and result.get("StatusCode") == "PartialData"
+            )
+            if result is None or not len(result["Timestamps"]):
+                series.append((pending_timestamps, pending_values))
+                continue
+
+            if converted is None or not same_timestamps(
+                result["Timestamps"], converted[0]
+            ):
+                timestamps = epoch_seconds(result["Timestamps"])
+                # A stable sort is linear on the descending order CloudWatch
+                # returns by default
+                converted = (
+                    result["Timestamps"],
+                    timestamps,
+                    np.argsort(timestamps, kind="stable"),
+                )
+            _, timestamps, order = converted
+            values = np.asarray(result["Values"], dtype=np.float64)
+            scanned_from, scanned_to = self.scanned[row]
+            self.scanned[row] = (
+                min(scanned_from, int(timestamps[order[0]])),
+                max(scanned_to, int(timestamps[order[-1]])),
+            )
+
+            if len(pending_timestamps):
+                timestamps = np.concatenate((pending_timestamps, timestamps))
+                values = np.concatenate((pending_values, values))
+                order = np.argsort(timestamps, kind="stable")
+            timestamps = timestamps[order]
+            values = values[order]
+            # A bucket returned twice keeps its last value
+            last = np.ones(len(timestamps), dtype=bool)
+            last[:-1] = timestamps[1:] != timestamps[:-1]
+            if not last.all():
+                timestamps = timestamps[last]
+                values = values[last]
+            series.append((timestamps, values))
+
+        common = series[0][0]
+        if all(np.array_equal(timestamps, common) for timestamps, _ in series[1:]):
+            self.pending = [
+                (timestamps[:0], values[:0]) for timestamps, values in series
+            ]
+            return common, np.vstack([values for _, values in series])
+
+        for timestamps, _ in series[1:]:
+            common = common[sorted_contains(timestamps, common)]
+        block = np.empty((len(series), len(common)), dtype=np.float64)
+        unmatched_series = []
+        for row, (timestamps, values) in enumerate(series):
+            positions = np.searchsorted(timestamps, common)
+            block[row] = values[positions]
+            unmatched = np.ones(len(timestamps), dtype=bool)
+            unmatched[positions] = False
+            unmatched_series.append((timestamps[unmatched], values[unmatched]))
+
+        self.pending = []
+        for timestamps, values in unmatched_series:
+            alive = np.ones(len(timestamps), dtype=bool)
+            for (other_timestamps, _), partial, (scanned_from, scanned_to) in zip(
+                unmatched_series, self.partial, self.scanned
+            ):
+                alive &= sorted_contains(other_timestamps, timestamps) | (
+                    partial
+                    & ((timestamps <= scanned_from) | (timestamps >= scanned_to))
+                )
+            self.pending.append((timestamps[alive], values[alive]))
+        return common, block
+
+    def reset(self):
+        self.pending = [
+            (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64))
+            for _ in self.metric_ids
+        ]
+        self.scanned = [(np.iinfo(np.int64).max, np.iinfo(np.int64).min)] * len(
+            self.metric_ids
+        )
+        self.partial = [False] * len(self.metric_ids)
+
+
+def drop_missing(values):
+    """
+    Get the values of a server-side expression as a float64 array, without
+    the missing ones.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    return values[~np.isnan(values)]
+
+
+class ExpressionCheck:
+    """
+    Compare a server-side expression with the expression computed locally
+    from the raw series of the same volume, matching datapoints by timestamp.
+
+    The series are kept as arrays until compare() is called, so this is
+    meant for checking, not for every run.
+    """
+
+    def __init__(self, expression_id, metric_ids):
+        """
+        Args:
+        - expression_id: The metric id of the server-side expression.
+        - metric_ids: The metric ids of the first, second and idle time inputs.
+        """
+        self.expression_id = expression_id
+        self.metric_ids = tuple(metric_ids)
+        # Chunks of (timestamps, values, period) arrays per metric id
+        self.series = {query_id: [] for query_id in (expression_id,) + self.metric_ids}
+
+    def add(self, page, period=300):
+        for query_id, chunks in self.series.items():
+            result = page.get(query_id)
+            if result is not None and len(result["Timestamps"]):
+                chunks.append(
+                    (
+                        epoch_seconds(result["Timestamps"]),
+                        np.asarray(result["Values"], dtype=np.float64),
+                        period,
+                    )
+                )
+
+    def sorted_series(self, query_id):
+        """
+        Returns:
+        - A tuple containing the sorted unique timestamps of a series, their
+          values and their periods. A bucket added twice keeps its last value.
+        """
+        chunks = self.series[query_id]
+        if not chunks:
+            return (
+                np.empty(0, dtype=np.int64),
+                np.empty(0, dtype=np.float64),
+                np.empty(0, dtype=np.int64),
+            )
+        timestamps = np.concatenate([chunk[0] for chunk in chunks])
+        values = np.concatenate([chunk[1] for chunk in chunks])
+        periods = np.concatenate(
+            [np.full(len(chunk[0]), chunk[2], dtype=np.int64) for chunk in chunks]
+        )
+        order = np.argsort(timestamps, kind="stable")
+        timestamps = timestamps[order]
+        last = np.ones(len(timestamps), dtype=bool)
+        last[:-1] = timestamps[1:] != timestamps[:-1]
+        return timestamps[last], values[order][last], periods[order][last]
+
+    def compare(self, rtol=1e-9):
+        """
+        Returns:
+        - A dictionary with the number of datapoints "compared", the number
+          "mismatched" beyond rtol, the "max_difference" as a relative
+          difference, and the number of datapoints computed only on the
+          "local_only" or "server_only" side.
+        """
+        first, second, idle_time = (
+            self.sorted_series(metric_id) for metric_id in self.metric_ids
+        )
+        server_timestamps, server_values, _ = self.sorted_series(self.expression_id)
+
+        common = first[0][
+            sorted_contains(second[0], first[0])
+            & sorted_contains(idle_time[0], first[0])
+        ]
+        inputs = np.vstack(
+            [
+                values[np.searchsorted(timestamps, common)]
+                for timestamps, values, _ in (first, second, idle_time)
+            ]
+        )
+        periods = first[2][np.searchsorted(first[0], common)]
+        complete = ~np.isnan(inputs).any(axis=0)
+        local_timestamps = common[complete]
+        inputs = inputs[:, complete]
+        periods = periods[complete]
+        local_values = np.empty(len(local_timestamps), dtype=np.float64)
+        for period in np.unique(periods).tolist():
+            in_period = periods == period
+            local_values[in_period] = expression_values(
+                *inputs[:, in_period], period=period
+            )
+
+        in_server = sorted_contains(server_timestamps, local_timestamps)
+        compared_local = local_values[in_server]
+        compared_server = server_values[
+            np.searchsorted(server_timestamps, local_timestamps[in_server])
+        ]
+        difference = np.abs(compared_local - compared_server) / np.maximum(
+            np.abs(compared_local), 1
+        )
+        return {
+            "compared": len(compared_local),
+            "mismatched": int(np.count_nonzero(difference > rtol)),
+            "max_difference": float(difference.max()) if len(compared_local) else 0.0,
+            "local_only": int(np.count_nonzero(~in_server)),
+            "server_only": int(
+                np.count_nonzero(~sorted_contains(local_timestamps, server_timestamps))
+            ),
+        }
+
+
+class QuantileSketch:
+    """
+    Fixed-memory quantile sketch of non-negative values, with logarithmic
+    buckets as in DDSketch.
+
+    Every quantile of a value between min_value and max_value is within
+    relative_accuracy of the exact one. Smaller values count as 0 and larger
+    ones fall in the last bucket. The memory used depends on these bounds
+    only, not on the number of values added. The maximum is exact.
+    """
+
+    def __init__(self, relative_accuracy=0.01, min_value=0.01, max_value=1e20):
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = np.log(self.gamma)
+        self.min_value = min_value
+        self.offset = int(np.floor(np.log(min_value) / self.log_gamma))
+        buckets = int(np.ceil(np.log(max_value) / self.log_gamma)) - self.offset
+        # Bucket 0 holds the values below min_value
+        self.counts = np.zeros(buckets + 1, dtype=np.int64)
+        self.count = 0
+        self.max = 0.0
+
+    def add(self, values, weight=1):
+        """
+        Add values that each count weight times.
+        """
+        values = np.asarray(values, dtype=np.float64)
+        if not len(values):
+            return
+        indices = np.zeros(len(values), dtype=np.int64)
+        large = values >= self.min_value
+        indices[large] = np.clip(
+            np.ceil(np.log(values[large]) / self.log_gamma) - self.offset,
+            1,
+            len(self.counts) - 1,
+        )
+        self.counts += np.bincount(indices, minlength=len(self.counts)) * weight
+        self.count += len(values) * weight
+        self.max = max(self.max, float(values.max()))
+
+    def quantile(self, q):
+        """
+        Args:
+        - q: The quantile, between 0 and 1.
+
+        Returns:
+        - The estimated value at the quantile, or None when no value was
+          added.
+        """
+        if not self.count:
+            return None
+        if q >= 1:
+            return self.max
+        rank = q * (self.count - 1)
+        index = int(np.searchsorted(np.cumsum(self.counts), rank, side="right"))
+        if index == 0:
+            return 0.0
+        value = 2 * self.gamma ** (index + self.offset) / (self.gamma + 1)
+        return min(value, self.max)
+
+    def reset(self):
+        self.counts[:] = 0
+        self.count = 0
+        self.max = 0.0
+
+
+class ThresholdSweep:
+    """
+    Count how many expression values are greater than or equal to each limit.
+
+    Every page is sorted once and all limits are answered together with
+    searchsorted, so adding thresholds does not add passes over the data.
+    """
+
+    def __init__(self, limits):
+        self.limits = np.asarray(limits, dtype=np.float64)
+        self.counts = np.zeros(len(self.limits), dtype=np.int64)
+        self.datapoints = 0
+
+    def add(self, values, weight=1):
+        """
+        Add values that each count weight times.
+        """
+        values = np.sort(values)
+        self.counts += (
+            len(values) - np.searchsorted(values, self.limits, side="left")
+        ) * weight
+        self.datapoints += len(values) * weight
+
+    def reset(self):
+        self.counts[:] = 0
+        self.datapoints = 0
+
+    def matches(self):
+        """
+        Returns:
+        - The per-limit counts as a list of ints, in the order of the limits.
+        """
+        return self.counts.tolist()
@@ -0,0 +1,119 @@
+import csv
+import json
+import os
+import threading
+
+# Columns of the assessment result table, one row per volume, metric and
+# threshold
+RESULT_COLUMNS = [
+    "instance",
+    "instance_id",
+    "region",
+    "volume_id",
+    "volume_label",
+    "volume_type",
+    "metric",
+    "unit",
+    "allocated",
+    "change",
+    "threshold",
+    "datapoints",
+    "matches",
+    "percent_over",
+    "within_limits",
+]
+
+RESULT_FORMATS = (".csv", ".json", ".parquet")
+
+
+class AssessmentResults:
+    """
+    Collect the per-threshold assessment results of every volume of a run and
+    write them as one table.
+
+    Every method is thread safe.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.rows = []
+
+    def add_rows(self, rows):
+        """
+        Add result rows, dictionaries keyed by RESULT_COLUMNS.
+        """
+        with self.lock:
+            self.rows.extend(rows)
+
+    def write(self, path):
+        """
+        Write every row in one go, as CSV, JSON or Parquet depending on the
+        extension of path. Parquet needs pandas and pyarrow.
+        """
+        extension = os.path.splitext(path)[1].lower()
+        if extension not in RESULT_FORMATS:
+            raise ValueError(
+                f"Unknown result format '{extension}', expected one of {', '.join(RESULT_FORMATS)}"
+            )
+
+        with self.lock:
+            rows = list(self.rows)
+
+        if extension == ".parquet":
+            import pandas as pd
+
+            pd.DataFrame.from_records(rows, columns=RESULT_COLUMNS).to_parquet(
+                path, index=False
+            )
+        elif extension == ".json":
+            with open(path, "w") as results_file:
+                json.dump(rows, results_file, indent=2)
+        else:
+            with open(path, "w", newline="") as results_file:
+                writer = csv.DictWriter(results_file, fieldnames=RESULT_COLUMNS)
+                writer.writeheader()
+                writer.writerows(rows)
+        print(f"Assessment results ({len(rows)} row(s)) written to '{path}'.")
+
+
+def threshold_results(allocated, matches, datapoints, thresholds, minimum, maximum):
+    """
+    Build the per-threshold results of a sweep created by create_iops_sweep or
+    create_throughput_sweep.
+
+    Args:
+    - allocated: The allocated IOPS or MiB/s of the volume.
+    - matches: The sweep's matches, for the allocated, "add N" and
+      "decrease N" limits in that order.
+    - datapoints: The sweep's datapoints.
+    - thresholds: List of amounts added to and decreased from the allocation.
+    - minimum: The minimum recommended allocation.
+    - maximum: The maximum recommended allocation.
+
+    Returns:
+    - A list of dictionaries with the "change" to the allocation, the
+      resulting "threshold", the "matches" at or above it, their
+      "percent_over" and whether the threshold is "within_limits". The
+      allocation itself comes first, with a change of 0.
+    """
+
+    def result(change, threshold_matches, within_limits):
+        return {
+            "change": change,
+            "threshold": allocated + change,
+            "matches": threshold_matches,
+            "percent_over": threshold_matches / datapoints * 100,
+            "within_limits": within_limits,
+        }
+
+    results = [result(0, matches[0], True)]
+    added = matches[1 : len(thresholds) + 1]
+    decreased = matches[len(thresholds) + 1 :]
+    for i, threshold in enumerate(thresholds):
+        if threshold == 0:
+            continue
+        results.append(result(threshold, added[i], allocated + threshold < maximum))
+        results.append(
+            result(-threshold, decreased[i], allocated - threshold > minimum)
+        )
+    return results
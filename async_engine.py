@@ -0,0 +1,974 @@
+import asyncio
+import contextlib
+import io
+import json
+import time
+
+from botocore.exceptions import ClientError
+
+from aws_clients import ClientRegistry
+from dashboard import (
+    dashboard_status_message,
+    dropped_rows_message,
+    get_dashboard_body,
+    layout_dashboards,
+    pushed_body_hashes,
+    qcd_dashboard_name,
+    shard_dashboard_name,
+    stale_shard_names,
+    stale_shards_warning,
+    updated_dashboard_body,
+)
+from infrasre_batch_assessment import (
+    get_servers_by_region,
+    batch_servers,
+    print_discovered_instances,
+    unique_instance_ids,
+)
+from infrasre_create_dashboard_fullassessment import (
+    METRIC_MATH_ERROR_CODES,
+    RANGE_WORKERS,
+    TARGET_PERCENTILE,
+    VOLUME_WORKERS,
+    add_volume_page,
+    compute_locally,
+    end_volume_pages,
+    get_date_range,
+    plan_resolutions,
+    prepare_volume_assessments,
+    print_volume_assessments,
+)
+from metric_cache import fetched_ranges
+from metric_fetch import (
+    RANGE_BUFFER_PAGES,
+    compact_results,
+    plan_volume_metric_queries,
+    range_parts,
+    split_time_range,
+    split_volume_metric_ids,
+)
+from run_report import report_phase
+from volume_inventory import (
+    DESCRIBE_INSTANCES_PAGE_SIZE,
+    MAX_FILTER_VALUES,
+    VolumeRecord,
+    add_attached_volumes,
+    add_discovered_instances,
+    add_named_instances,
+    cache_instance_ids,
+    cache_volumes,
+    cached_instance_ids,
+    cached_volumes,
+    instance_name_filters,
+    single_instance_id,
+    tag_filter_list,
+    volume_record,
+)
+
+# Requests per second allowed for each API in each region. These stay below
+# the default CloudWatch and EC2 throttling limits.
+API_RATE_LIMITS = {
+    "DeleteDashboards": 10,
+    "DescribeInstances": 20,
+    "DescribeVolumes": 20,
+    "GetDashboard": 10,
+    "GetMetricData": 50,
+    "PutDashboard": 10,
+}
+
+
+class TokenBucket:
+    """
+    Allow up to rate requests per second, with bursts of up to capacity.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.capacity, self.tokens + (now - self.updated) * self.rate
+                )
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class RateLimiter:
+    """
+    One token bucket per API and region, created on first use.
+    """
+
+    def __init__(self, rates=None):
+        self.rates = dict(API_RATE_LIMITS, **(rates or {}))
+        self.buckets = {}
+
+    async def acquire(self, api_name, region):
+        key = (api_name, region)
+        if key not in self.buckets:
+            self.buckets[key] = TokenBucket(self.rates[api_name])
+        await self.buckets[key].acquire()
+
+
+async def call_api(rate_limiter, api_name, region, function, *args, **kwargs):
+    """
+    Run a blocking boto3 call in a worker thread once the rate limit allows it.
+
+    Throttled and failed requests are retried by the client itself, with
+    botocore's adaptive retries (see aws_clients.client_config), so the
+    call is not retried here.
+
+    Args:
+    - rate_limiter: The RateLimiter shared by the run.
+    - api_name: The API name the limit applies to, such as "GetMetricData".
+    - region: The region the limit applies to.
+    - function: The blocking function to call.
+
+    Returns:
+    - The function's return value.
+    """
+    await rate_limiter.acquire(api_name, region)
+    return await asyncio.to_thread(function, *args, **kwargs)
+
+
+async def iter_api_pages(rate_limiter, api_name, region, function, **request):
+    """
+    Follow the NextToken of a paginated boto3 call, rate limiting every page
+    with call_api.
+
+    Yields:
+    - Every response page.
+    """
+    while True:
+        response = await call_api(rate_limiter, api_name, region, function, **request)
+        yield response
+
+        next_token = response.get("NextToken")
+        if not next_token:
+            break
+        request["NextToken"] = next_token
+
+
+async def get_instance_id_from_name(
+    ec2, instance_name, rate_limiter, lookup_cache=None
+):
+    """
+    Asynchronous version of volume_inventory.get_instance_id_from_name,
+    through the rate-limited resolve_instance_names.
+    """
+    instance_ids = await resolve_instance_names(
+        ec2, [instance_name], rate_limiter, lookup_cache
+    )
+    return single_instance_id(instance_name, instance_ids[instance_name])
+
+
+async def get_volume_info(ec2, instance_id, rate_limiter, lookup_cache=None):
+    """
+    Get every EBS volume attached to an instance.
+
+    Each describe_volumes page is rate limited on its own.
+
+    Returns:
+    - A list of VolumeRecord tuples, in the order EC2 returns them.
+    """
+    if lookup_cache:
+        key = [ec2.meta.region_name, instance_id]
+        volumes = await asyncio.to_thread(lookup_cache.get, "volumes", key)
+        if volumes is not None:
+            return [VolumeRecord(*volume) for volume in volumes]
+
+        attached_volumes = await get_volume_info(ec2, instance_id, rate_limiter)
+        await asyncio.to_thread(lookup_cache.put, "volumes", key, attached_volumes)
+        return attached_volumes
+
+    attached_volumes = []
+    async for response in iter_api_pages(
+        rate_limiter,
+        "DescribeVolumes",
+        ec2.meta.region_name,
+        ec2.describe_volumes,
+        Filters=[{"Name": "attachment.instance-id", "Values": [instance_id]}],
+    ):
+        attached_volumes.extend(volume_record(volume) for volume in response["Volumes"])
+    return attached_volumes
+
+
+async def resolve_instance_names(ec2, instance_names, rate_limiter, lookup_cache=None):
+    """
+    Asynchronous version of volume_inventory.resolve_instance_names where
+    every describe_instances page is rate limited.
+    """
+    instance_ids, unresolved = await asyncio.to_thread(
+        cached_instance_ids, ec2, instance_names, lookup_cache
+    )
+    for start in range(0, len(unresolved), MAX_FILTER_VALUES):
+        async for page in iter_api_pages(
+            rate_limiter,
+            "DescribeInstances",
+            ec2.meta.region_name,
+            ec2.describe_instances,
+            Filters=instance_name_filters(
+                unresolved[start : start + MAX_FILTER_VALUES]
+            ),
+            MaxResults=DESCRIBE_INSTANCES_PAGE_SIZE,
+        ):
+            add_named_instances(instance_ids, page)
+
+    await asyncio.to_thread(
+        cache_instance_ids, ec2, instance_ids, unresolved, lookup_cache
+    )
+    return instance_ids
+
+
+async def discover_instances(ec2, tag_filters, rate_limiter):
+    """
+    Asynchronous version of volume_inventory.discover_instances where every
+    describe_instances page is rate limited.
+    """
+    instance_ids = {}
+    async for page in iter_api_pages(
+        rate_limiter,
+        "DescribeInstances",
+        ec2.meta.region_name,
+        ec2.describe_instances,
+        Filters=tag_filter_list(tag_filters),
+        MaxResults=DESCRIBE_INSTANCES_PAGE_SIZE,
+    ):
+        add_discovered_instances(instance_ids, page)
+    return instance_ids
+
+
+async def get_volumes_by_instance(ec2, instance_ids, rate_limiter, lookup_cache=None):
+    """
+    Asynchronous version of volume_inventory.get_volumes_by_instance where
+    every describe_volumes page is rate limited.
+    """
+    volumes, uncached = await asyncio.to_thread(
+        cached_volumes, ec2, instance_ids, lookup_cache
+    )
+    for start in range(0, len(uncached), MAX_FILTER_VALUES):
+        async for page in iter_api_pages(
+            rate_limiter,
+            "DescribeVolumes",
+            ec2.meta.region_name,
+            ec2.describe_volumes,
+            Filters=[
+                {
+                    "Name": "attachment.instance-id",
+                    "Values": uncached[start : start + MAX_FILTER_VALUES],
+                }
+            ],
+        ):
+            add_attached_volumes(volumes, page)
+
+    await asyncio.to_thread(cache_volumes, ec2, volumes, uncached, lookup_cache)
+    return volumes
+
+
+async def look_up_region(
+    ec2, region_servers, rate_limiter, tag_filters=None, lookup_cache=None
+):
+    """
+    Asynchronous version of infrasre_batch_assessment.look_up_region where
+    every describe_instances and describe_volumes page is rate limited.
+    """
+    if tag_filters:
+        instance_ids = await discover_instances(ec2, tag_filters, rate_limiter)
+    else:
+        instance_ids = await resolve_instance_names(
+            ec2, region_servers, rate_limiter, lookup_cache
+        )
+    volumes = await get_volumes_by_instance(
+        ec2, unique_instance_ids(instance_ids), rate_limiter, lookup_cache
+    )
+    return instance_ids, volumes
+
+
+async def iter_request_volume_pages(
+    cloudwatch_data,
+    metric_queries,
+    query_targets,
+    start_time,
+    end_time,
+    rate_limiter,
+    fetch_stats=None,
+):
+    """
+    Follow the NextToken of one GetMetricData request, rate limiting every
+    page.
+
+    Yields:
+    - (volume_id, page) tuples, where page is keyed by metric id.
+    """
+    request = {
+        "MetricDataQueries": metric_queries,
+        "StartTime": start_time,
+        "EndTime": end_time,
+    }
+    while True:
+        response = await call_api(
+            rate_limiter,
+            "GetMetricData",
+            cloudwatch_data.meta.region_name,
+            cloudwatch_data.get_metric_data,
+            **request,
+        )
+
+        volume_pages = {}
+        for result in compact_results(response["MetricDataResults"]):
+            volume_id, metric_id = query_targets[result["Id"]]
+            volume_pages.setdefault(volume_id, {})[metric_id] = result
+
+        if fetch_stats is not None:
+            fetch_stats["pages"] = fetch_stats.get("pages", 0) + 1
+            fetch_stats["datapoints"] = fetch_stats.get("datapoints", 0) + sum(
+                len(result["Values"]) for result in response["MetricDataResults"]
+            )
+        next_token = response.get("NextToken")
+        del response
+
+        for volume_id, page in volume_pages.items():
+            yield volume_id, page
+
+        if not next_token:
+            break
+        request["NextToken"] = next_token
+
+
+async def iter_volume_metric_pages(
+    cloudwatch_data,
+    volume_metric_ids,
+    start_time,
+    end_time,
+    rate_limiter,
+    fetch_stats=None,
+    period=300,
+    range_workers=1,
+):
+    """
+    Asynchronous version of metric_fetch.iter_volume_metric_pages where every
+    GetMetricData page is rate limited.
+
+    The sub-ranges of a split request are fetched concurrently and yielded
+    in chronological order. The later sub-ranges read at most
+    metric_fetch.RANGE_BUFFER_PAGES responses ahead of the one being yielded.
+
+    Yields:
+    - (volume_id, page) tuples, where page is keyed by metric id.
+    """
+    for metric_queries, query_targets in plan_volume_metric_queries(
+        volume_metric_ids, period
+    ):
+        if fetch_stats is not None:
+            fetch_stats["batches"] = fetch_stats.get("batches", 0) + 1
+
+        time_ranges = split_time_range(
+            start_time,
+            end_time,
+            period,
+            range_parts(
+                len(query_targets), start_time, end_time, period, range_workers
+            ),
+        )
+        if len(time_ranges) == 1:
+            async for volume_id, page in iter_request_volume_pages(
+                cloudwatch_data,
+                metric_queries,
+                query_targets,
+                start_time,
+                end_time,
+                rate_limiter,
+                fetch_stats,
+            ):
+                yield volume_id, page
+            continue
+
+        async def fetch_range(range_start, range_end, buffer):
+            try:
+                async for volume_page in iter_request_volume_pages(
+                    cloudwatch_data,
+                    metric_queries,
+                    query_targets,
+                    range_start,
+                    range_end,
+                    rate_limiter,
+                    fetch_stats,
+                ):
+                    await buffer.put(volume_page)
+            except Exception as error:
+                await buffer.put(error)
+            else:
+                await buffer.put(None)
+
+        # One response yields a page per volume, so a buffer holds the
+        # volume pages of RANGE_BUFFER_PAGES responses
+        volume_count = len({volume_id for volume_id, _ in query_targets.values()})
+        buffers = [
+            asyncio.Queue(maxsize=RANGE_BUFFER_PAGES * volume_count)
+            for _ in time_ranges
+        ]
+        tasks = [
+            asyncio.ensure_future(fetch_range(*time_range, buffer))
+            for time_range, buffer in zip(time_ranges, buffers)
+        ]
+        try:
+            for buffer in buffers:
+                while True:
+                    volume_page = await buffer.get()
+                    if volume_page is None:
+                        break
+                    if isinstance(volume_page, Exception):
+                        raise volume_page
+                    yield volume_page
+        finally:
+            for task in tasks:
+                task.cancel()
+
+
+async def fetch_cached_group(
+    cloudwatch_data,
+    assessment,
+    group_metric_ids,
+    start_time,
+    end_time,
+    rate_limiter,
+    metric_cache,
+    group_stats,
+    period=300,
+    weight=1,
+    range_workers=1,
+):
+    """
+    Fetch the time ranges of a volume group that are not cached yet, then feed
+    the group's cached series to the volumes' sweeps.
+
+    The SQLite reads and writes run in worker threads.
+    """
+    missing_ranges = await asyncio.to_thread(
+        metric_cache.plan_missing, group_metric_ids, start_time, end_time, period
+    )
+    for range_start, range_end, range_volume_metric_ids in missing_ranges:
+        async for volume_id, page in iter_volume_metric_pages(
+            cloudwatch_data,
+            range_volume_metric_ids,
+            range_start,
+            range_end,
+            rate_limiter,
+            group_stats,
+            period,
+            range_workers,
+        ):
+            await asyncio.to_thread(metric_cache.store_page, volume_id, page, period)
+        await asyncio.to_thread(
+            metric_cache.mark_fetched,
+            range_volume_metric_ids,
+            range_start,
+            range_end,
+            period,
+        )
+
+    def add_cached_pages():
+        for volume_id, page in metric_cache.iter_volume_pages(
+            group_metric_ids,
+            start_time,
+            end_time,
+            period,
+            group_stats,
+            fetched_ranges(missing_ranges),
+        ):
+            add_volume_page(assessment, volume_id, page, period, weight)
+
+    await asyncio.to_thread(add_cached_pages)
+
+
+async def fetch_volume_sweeps(
+    cloudwatch_data,
+    assessment,
+    start_time,
+    end_time,
+    rate_limiter,
+    volume_workers,
+    metric_cache=None,
+    adaptive_period=False,
+    range_workers=RANGE_WORKERS,
+):
+    """
+    Fetch the volumes' metrics in up to volume_workers concurrent groups and
+    feed every page to the volume's sweeps.
+
+    A group whose metric math CloudWatch rejects is fetched again with the
+    raw series, adaptive_period picks the period of every part of the time
+    range, and long requests are split into up to range_workers concurrent
+    sub-ranges, as in the synchronous version.
+
+    Returns:
+    - A dictionary with the number of query "batches", "pages" and
+      "datapoints" read, plus the number of "cached" datapoints served when a
+      metric_cache is used, and the number of "math_fallbacks" volumes when
+      server-side metric math is used.
+    """
+    fetch_stats = {"batches": 0, "pages": 0, "datapoints": 0}
+    if metric_cache:
+        fetch_stats["cached"] = 0
+    if assessment["server_math"]:
+        fetch_stats["math_fallbacks"] = 0
+    resolutions, weight_period = plan_resolutions(
+        assessment, start_time, end_time, adaptive_period
+    )
+
+    async def add_group_pages(group_metric_ids, group_stats):
+        for range_start, range_end, period in resolutions:
+            if not period:
+                continue
+            weight = period // weight_period
+            if metric_cache:
+                await fetch_cached_group(
+                    cloudwatch_data,
+                    assessment,
+                    group_metric_ids,
+                    range_start,
+                    range_end,
+                    rate_limiter,
+                    metric_cache,
+                    group_stats,
+                    period,
+                    weight,
+                    range_workers,
+                )
+                end_volume_pages(assessment, group_metric_ids)
+                continue
+
+            async for volume_id, page in iter_volume_metric_pages(
+                cloudwatch_data,
+                group_metric_ids,
+                range_start,
+                range_end,
+                rate_limiter,
+                group_stats,
+                period,
+                range_workers,
+            ):
+                add_volume_page(assessment, volume_id, page, period, weight)
+            end_volume_pages(assessment, group_metric_ids)
+
+    async def fetch_group(group_metric_ids):
+        group_stats = dict.fromkeys(fetch_stats, 0)
+        if "math_fallbacks" not in fetch_stats:
+            await add_group_pages(group_metric_ids, group_stats)
+            return group_stats
+
+        try:
+            await add_group_pages(group_metric_ids, group_stats)
+        except ClientError as e:
+            error_code = e.response.get("Error", {}).get("Code")
+            if error_code not in METRIC_MATH_ERROR_CODES:
+                raise
+            group_stats["math_fallbacks"] += sum(
+                volume_id in assessment["server_math"]
+                for volume_id, _ in group_metric_ids
+            )
+            await add_group_pages(
+                compute_locally(assessment, group_metric_ids), group_stats
+            )
+        return group_stats
+
+    groups = split_volume_metric_ids(assessment["volume_metric_ids"], volume_workers)
+    for group_stats in await asyncio.gather(*map(fetch_group, groups)):
+        for key in fetch_stats:
+            fetch_stats[key] += group_stats[key]
+
+    return fetch_stats
+
+
+async def create_dashboard(
+    cloudwatch,
+    dashboard_name,
+    widgets,
+    rate_limiter,
+    update_mode="replace",
+    lookup_cache=None,
+):
+    """
+    Asynchronous version of dashboard.create_dashboard, without the printing.
+
+    Returns:
+    - A tuple containing "created", "updated" or "unchanged", and the list of
+      rows that did not fit when merging.
+    """
+    dashboard_body = {"widgets": widgets}
+    dashboard_body_json = json.dumps(dashboard_body)
+    region = cloudwatch.meta.region_name
+
+    if update_mode == "replace":
+        await call_api(
+            rate_limiter,
+            "PutDashboard",
+            region,
+            cloudwatch.put_dashboard,
+            DashboardName=dashboard_name,
+            DashboardBody=dashboard_body_json,
+        )
+        return "created", []
+
+    key = [region, dashboard_name]
+    existing_body_json = await call_api(
+        rate_limiter,
+        "GetDashboard",
+        region,
+        get_dashboard_body,
+        cloudwatch,
+        dashboard_name,
+    )
+    if lookup_cache and existing_body_json is not None:
+        recorded_hashes = await asyncio.to_thread(
+            lookup_cache.get, "dashboard_body", key
+        )
+        if recorded_hashes == pushed_body_hashes(
+            dashboard_body_json, existing_body_json
+        ):
+            return "unchanged", []
+
+    body_json, dropped_rows = updated_dashboard_body(
+        existing_body_json, dashboard_body_json, update_mode
+    )
+    if body_json is None:
+        status = "unchanged"
+    else:
+        await call_api(
+            rate_limiter,
+            "PutDashboard",
+            region,
+            cloudwatch.put_dashboard,
+            DashboardName=dashboard_name,
+            DashboardBody=body_json,
+        )
+        status = "created" if existing_body_json is None else "updated"
+    if lookup_cache and not dropped_rows:
+        await asyncio.to_thread(
+            lookup_cache.put,
+            "dashboard_body",
+            key,
+            pushed_body_hashes(dashboard_body_json, body_json or existing_body_json),
+        )
+    return status, dropped_rows
+
+
+async def delete_stale_shards(
+    cloudwatch, dashboard_name, shard_count, rate_limiter, lookup_cache
+):
+    """
+    Asynchronous version of dashboard.delete_stale_shards, without the
+    printing.
+
+    Returns:
+    - A tuple containing the names of the deleted dashboards and the warning
+      printed when they could not be deleted, or None.
+    """
+    region = cloudwatch.meta.region_name
+    key = [region, dashboard_name]
+    recorded_count = (
+        await asyncio.to_thread(lookup_cache.get, "dashboard_shards", key) or 1
+    )
+    stale_names = stale_shard_names(dashboard_name, shard_count, recorded_count)
+    if stale_names:
+        try:
+            await call_api(
+                rate_limiter,
+                "DeleteDashboards",
+                region,
+                cloudwatch.delete_dashboards,
+                DashboardNames=stale_names,
+            )
+        except ClientError as e:
+            return [], stale_shards_warning(stale_names, e)
+        for stale_name in stale_names:
+            await asyncio.to_thread(
+                lookup_cache.invalidate, "dashboard_body", [region, stale_name]
+            )
+    await asyncio.to_thread(lookup_cache.put, "dashboard_shards", key, shard_count)
+    return stale_names, None
+
+
+async def create_dashboards(
+    cloudwatch,
+    dashboard_name,
+    widget_rows,
+    rate_limiter,
+    update_mode="replace",
+    lookup_cache=None,
+):
+    """
+    Asynchronous version of dashboard.create_dashboards, without the printing.
+    The dashboards are put one after the other.
+
+    Returns:
+    - The list of messages dashboard.create_dashboards prints.
+    """
+    messages = []
+    shard_count = 0
+    for index, widgets in enumerate(layout_dashboards(widget_rows)):
+        shard_name = shard_dashboard_name(dashboard_name, index)
+        status, dropped_rows = await create_dashboard(
+            cloudwatch, shard_name, widgets, rate_limiter, update_mode, lookup_cache
+        )
+        if dropped_rows:
+            messages.append(dropped_rows_message(shard_name, dropped_rows))
+        messages.append(dashboard_status_message(shard_name, status))
+        shard_count += 1
+    if lookup_cache and update_mode != "merge":
+        stale_names, warning = await delete_stale_shards(
+            cloudwatch, dashboard_name, shard_count, rate_limiter, lookup_cache
+        )
+        messages.extend(
+            dashboard_status_message(stale_name, "deleted")
+            for stale_name in stale_names
+        )
+        if warning:
+            messages.append(warning)
+    return messages
+
+
+async def run_full_assessment(
+    instance_name,
+    target_region,
+    ec2,
+    cloudwatch_data,
+    ticketnumber,
+    start_time,
+    end_time,
+    day_range,
+    rate_limiter,
+    volume_workers=VOLUME_WORKERS,
+    metric_cache=None,
+    lookup_cache=None,
+    run_report=None,
+    metric_math="local",
+    target_percentile=TARGET_PERCENTILE,
+    adaptive_period=False,
+    assessment_results=None,
+    dashboard_update="replace",
+    widget_templates=(),
+    instance_id=None,
+    attached_volumes=None,
+    range_workers=RANGE_WORKERS,
+):
+    """
+    Asynchronous version of the full assessment of one instance.
+
+    The instance's output is collected while it runs and printed as one block
+    at the end, so concurrent instances do not interleave. Phase timings
+    include the time spent waiting for the rate limiter.
+
+    Returns:
+    - The instance ID, or None when no instance has the given name.
+    """
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        print(f"'{instance_name}'")
+        print(f"aws region '{target_region}'")
+
+    started = time.perf_counter()
+    try:
+        if not instance_id:
+            with report_phase(run_report, "lookup"):
+                instance_id = await get_instance_id_from_name(
+                    ec2, instance_name, rate_limiter, lookup_cache
+                )
+        if not instance_id:
+            with contextlib.redirect_stdout(output):
+                print(f"No instance found with the name '{instance_name}'.")
+            return None
+
+        if attached_volumes is None:
+            with report_phase(run_report, "lookup"):
+                attached_volumes = await get_volume_info(
+                    ec2, instance_id, rate_limiter, lookup_cache
+                )
+        with contextlib.redirect_stdout(output):
+            print(f"Instance ID of '{instance_name}' is: {instance_id}")
+            print("Attached volumes:")
+            for volume in attached_volumes:
+                print(volume.volume_id)
+
+            with report_phase(run_report, "prepare"):
+                assessment = prepare_volume_assessments(
+                    instance_name,
+                    instance_id,
+                    target_region,
+                    attached_volumes,
+                    metric_math,
+                    widget_templates,
+                )
+
+        with report_phase(run_report, "fetch"):
+            fetch_stats = await fetch_volume_sweeps(
+                cloudwatch_data,
+                assessment,
+                start_time,
+                end_time,
+                rate_limiter,
+                volume_workers,
+                metric_cache,
+                adaptive_period,
+                range_workers,
+            )
+        with contextlib.redirect_stdout(output), report_phase(run_report, "report"):
+            rows = print_volume_assessments(
+                assessment, fetch_stats, day_range, target_percentile
+            )
+        if assessment_results:
+            assessment_results.add_rows(rows)
+
+        with report_phase(run_report, "dashboard"):
+            messages = await create_dashboards(
+                cloudwatch_data,
+                qcd_dashboard_name(ticketnumber, instance_name),
+                assessment["widget_rows"],
+                rate_limiter,
+                dashboard_update,
+                lookup_cache,
+            )
+        with contextlib.redirect_stdout(output):
+            for message in messages:
+                print(message)
+
+        if run_report:
+            run_report.add_volume_datapoints(instance_name, assessment["datapoints"])
+            run_report.add_instance(
+                instance_name, instance_id, time.perf_counter() - started
+            )
+
+        return instance_id
+    except Exception as e:
+        with contextlib.redirect_stdout(output):
+            print(f"Error: {e}")
+        return None
+    finally:
+        print(output.getvalue(), end="")
+
+
+async def run_batch_assessment(
+    server_names,
+    ticketnumber,
+    start_date,
+    end_date,
+    rate_limiter=None,
+    volume_workers=VOLUME_WORKERS,
+    metric_cache=None,
+    lookup_cache=None,
+    run_report=None,
+    metric_math="local",
+    target_percentile=TARGET_PERCENTILE,
+    adaptive_period=False,
+    assessment_results=None,
+    dashboard_update="replace",
+    widget_templates=(),
+    tag_filters=None,
+    regions=None,
+    range_workers=RANGE_WORKERS,
+):
+    """
+    Assess a list of servers concurrently on one event loop.
+
+    API calls are rate limited per API and region instead of bounding the
+    number of servers in flight. Every region is looked up concurrently
+    first, from its server names or from tag_filters, as in the synchronous
+    version.
+
+    Returns:
+    - A dictionary of (region, server name) to instance ID (None when not
+      assessed). The region is None for an unknown region code.
+    """
+    rate_limiter = rate_limiter or RateLimiter()
+    start_time, end_time, day_range = get_date_range(start_date, end_date)
+    print(f"{start_time} to {end_time}")
+
+    servers_by_region, unknown_servers = get_servers_by_region(
+        server_names, tag_filters, regions
+    )
+    results = {}
+    for server_name in unknown_servers:
+        print(f"Unknown region code for server '{server_name}'. Skipping.")
+        results[(None, server_name)] = None
+
+    clients = ClientRegistry(run_report=run_report)
+    region_clients = {
+        region: (
+            clients.client("ec2", region),
+            clients.client("cloudwatch", region),
+        )
+        for region in servers_by_region
+    }
+
+    async def look_up(region, region_servers):
+        try:
+            with report_phase(run_report, "lookup"):
+                return await look_up_region(
+                    region_clients[region][0],
+                    region_servers,
+                    rate_limiter,
+                    tag_filters,
+                    lookup_cache,
+                )
+        except Exception as e:
+            print(f"Error looking up the instances in {region}: {e}")
+            return None
+
+    lookups = await asyncio.gather(
+        *(
+            look_up(region, region_servers)
+            for region, region_servers in servers_by_region.items()
+        )
+    )
+    if tag_filters:
+        print_discovered_instances(lookups)
+
+    servers = batch_servers(
+        servers_by_region, dict(zip(servers_by_region, lookups)), results
+    )
+
+    instance_ids = await asyncio.gather(
+        *(
+            run_full_assessment(
+                server_name,
+                region,
+                *region_clients[region],
+                ticketnumber,
+                start_time,
+                end_time,
+                day_range,
+                rate_limiter,
+                volume_workers,
+                metric_cache,
+                lookup_cache,
+                run_report,
+                metric_math,
+                target_percentile,
+                adaptive_period,
+                assessment_results,
+                dashboard_update,
+                widget_templates,
+                instance_id,
+                attached_volumes,
+                range_workers,
+            )
+            for server_name, region, instance_id, attached_volumes in servers
+        )
+    )
+    for (server_name, region, _, _), instance_id in zip(servers, instance_ids):
+        results[(region, server_name)] = instance_id
+
+    assessed = [name for name, instance_id in results.items() if instance_id]
+    print(
+        f"Assessed {len(assessed)} of {len(results)} server(s) in {len(servers_by_region)} region(s)."
+    )
+    return results
@@ -0,0 +1,119 @@
+import os
+import threading
+
+# Connections kept open per client. Every worker thread that shares a client
+# needs its own connection, or requests wait for a free one.
+DEFAULT_MAX_POOL_CONNECTIONS = int(os.environ.get("AWS_MAX_POOL_CONNECTIONS", "32"))
+
+# Most connections kept open per client however many workers share it.
+# Requests past it open a short-lived connection each instead of a pooled one.
+MAX_POOL_CONNECTIONS = int(os.environ.get("AWS_MAX_POOL_CONNECTIONS_LIMIT", "64"))
+
+# Attempts per request, including the first one
+DEFAULT_MAX_ATTEMPTS = int(os.environ.get("AWS_MAX_ATTEMPTS", "10"))
+
+
+def pool_connections(requests_in_flight):
+    """
+    Size the connection pool of a client shared by concurrent workers.
+
+    Args:
+    - requests_in_flight: Most requests the workers can have in flight on
+      one client at the same time.
+
+    Returns:
+    - requests_in_flight, at least DEFAULT_MAX_POOL_CONNECTIONS and at most
+      MAX_POOL_CONNECTIONS.
+    """
+    return min(
+        max(DEFAULT_MAX_POOL_CONNECTIONS, requests_in_flight), MAX_POOL_CONNECTIONS
+    )
+
+
+def client_config(
+    max_pool_connections=DEFAULT_MAX_POOL_CONNECTIONS,
+    max_attempts=DEFAULT_MAX_ATTEMPTS,
+):
+    """
+    Build the botocore configuration shared by every client.
+
+    Adaptive retries slow the client down when AWS throttles it, and TCP
+    keep-alive keeps the pooled TLS connections open between calls.
+    """
+    from botocore.config import Config
+
+    return Config(
+        max_pool_connections=max_pool_connections,
+        retries={"mode": "adaptive", "total_max_attempts": max_attempts},
+        tcp_keepalive=True,
+    )
+
+
+class ClientRegistry:
+    """
+    One boto3 client per (service, region), created on first use and then
+    shared, so endpoint resolution and the HTTP connection pool are only set
+    up once.
+
+    Clients are thread safe, but sessions are not, so clients are created
+    under a lock. boto3 is only imported when a registry is created, so
+    importing this module stays fast.
+
+    With a run_report, every client is instrumented when it is created.
+    """
+
+    def __init__(
+        self,
+        session=None,
+        region_name=None,
+        max_pool_connections=DEFAULT_MAX_POOL_CONNECTIONS,
+        max_attempts=DEFAULT_MAX_ATTEMPTS,
+        run_report=None,
+    ):
+        if session is None:
+            import boto3
+
+            session = boto3.Session(region_name=region_name)
+        self.session = session
+        self.config = client_config(max_pool_connections, max_attempts)
+        self.run_report = run_report
+        self.clients = {}
+        self.lock = threading.Lock()
+
+    def client(self, service, region=None):
+        """
+        Get the shared client of a service in a region.
+
+        Args:
+        - service: The service name, such as "ec2" or "cloudwatch".
+        - region: The region name. The session's region is used when None.
+
+        Returns:
+        - The boto3 client.
+        """
+        region = region or self.session.region_name
+        key = (service, region)
+        with self.lock:
+            if key not in self.clients:
+                client = self.session.client(
+                    service, region_name=region, config=self.config
+                )
+                if self.run_report:
+                    self.run_report.instrument(client)
+                self.clients[key] = client
+            return self.clients[key]
+
+
+def get_account_id(clients=None):
+    """
+    Get the ID of the AWS account of the credentials in use, with one
+    sts:GetCallerIdentity call.
+
+    Args:
+    - clients: Optional ClientRegistry the STS client is taken from.
+
+    Returns:
+    - The 12-digit account ID.
+    """
+    clients = clients or ClientRegistry()
+    return clients.client("sts").get_caller_identity()["Account"]
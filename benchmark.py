@@ -0,0 +1,671 @@
+# Offline benchmark of the dashboard, assessment and full-assessment flows.
+#
+# Every EC2 and CloudWatch call is answered by a synthetic fleet in this
+# process, the same way botocore's Stubber answers calls, so no AWS account
+# or network access is needed. Each scenario runs in its own process, with
+# the local metric and lookup caches off.
+#
+# "stub s" is the time spent generating the synthetic responses, added up
+# across worker threads. Full-assessment phases are added up the same way.
+#
+# Usage:
+#   python3 benchmark.py [--instances 1,10,100] [--days 30,60,90]
+#                        [--flows dashboard,assessment,full-assessment]
+#                        [--metric-math local,server] [--max-volumes 20]
+#                        [--seed 7] [--output report.json]
+#   python3 benchmark.py --datapoint-memory [--days 30,60,90]
+
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+import argparse
+import contextlib
+import json
+import os
+import random
+import re
+import resource
+import subprocess
+import sys
+import threading
+import time
+import zlib
+
+import boto3
+from botocore.awsrequest import AWSResponse
+import numpy as np
+
+FLOWS = ["dashboard", "assessment", "full-assessment"]
+
+# The flows that read their time window from the command line. The other
+# flows use a fixed window, so they run once per fleet size.
+WINDOWED_FLOWS = {"full-assessment"}
+
+# Datapoints returned by one GetMetricData call, across all of its queries
+MAX_DATAPOINTS_PER_CALL = 100800
+
+REGION = "us-east-1"
+TICKET_NUMBER = "BENCH"
+
+VOLUME_TYPES = ["gp3", "gp3", "gp2", "io2"]
+
+# Phases of the full assessment, timed by wrapping the module functions
+FULL_ASSESSMENT_PHASES = {
+    "get_instance_id_from_name": "lookup",
+    "get_instance_volumes": "lookup",
+    "prepare_volume_assessments": "prepare",
+    "fetch_volume_sweeps": "fetch",
+    "print_volume_assessments": "report",
+    "create_dashboards": "dashboard",
+}
+
+
+def idle_time_choices(period):
+    """
+    VolumeIdleTime sums of one datapoint, from busy to fully idle. The sum
+    can't exceed the period, so the choices scale with it.
+
+    Args:
+    - period: The Period of the metric query in seconds.
+
+    Returns:
+    - An array of idle seconds.
+    """
+    return np.array([0.0, period / 30, period / 2, period - 0.5, float(period)])
+
+
+class SyntheticFleet:
+    """
+    In-memory EC2 and CloudWatch backend for a generated fleet.
+
+    Instances are named USEABENCH0000, USEABENCH0001, ... so the batch runner
+    maps them to us-east-1. Each one has between 1 and max_volumes volumes.
+    Metric values are generated from a seed, so every run of a scenario reads
+    the same data.
+    """
+
+    def __init__(self, instances, max_volumes=20, seed=7):
+        self.seed = seed
+        self.instances = {}
+        self.volumes = {}
+        self.dashboards = {}
+        self.calls = Counter()
+        self.datapoints = 0
+        self.stub_seconds = 0.0
+        self.lock = threading.Lock()
+        self.timestamp_grids = {}
+
+        rng = random.Random(seed)
+        for instance_index in range(instances):
+            instance_name = f"USEABENCH{instance_index:04d}"
+            instance_id = f"i-{instance_index:017x}"
+            volume_ids = []
+            for volume_index in range(rng.randint(1, max_volumes)):
+                volume_id = f"vol-{instance_index:08x}{volume_index:09x}"
+                volume_type = rng.choice(VOLUME_TYPES)
+                volume = {
+                    "VolumeId": volume_id,
+                    "VolumeType": volume_type,
+                    "Size": rng.choice([100, 500, 1000, 4000]),
+                    "Iops": rng.choice([3000, 4000, 6000, 10000, 16000]),
+                    "Tags": [
+                        {"Key": "Name", "Value": f"{instance_name}-disk{volume_index}"}
+                    ],
+                    "Attachments": [
+                        {
+                            "InstanceId": instance_id,
+                            "VolumeId": volume_id,
+                            "Device": f"/dev/xvd{volume_index:02d}",
+                            "State": "attached",
+                        }
+                    ],
+                }
+                if volume_type == "gp3":
+                    volume["Throughput"] = rng.choice([125, 250, 500, 1000])
+                self.volumes[volume_id] = volume
+                volume_ids.append(volume_id)
+
+            self.instances[instance_name] = {
+                "InstanceId": instance_id,
+                "Tags": [{"Key": "Name", "Value": instance_name}],
+                "VolumeIds": volume_ids,
+            }
+
+    def instance_names(self):
+        return list(self.instances)
+
+    def register(self, session):
+        """
+        Answer every call of the clients created from a boto3 session.
+        """
+        session.events.register_first("before-parameter-build.*.*", self.capture_params)
+        session.events.register_first("before-call.*.*", self.respond)
+
+    def capture_params(self, params, context, **kwargs):
+        # before-call only sees the serialized request, so keep the API
+        # parameters for it
+        context["synthetic_params"] = dict(params)
+
+    def respond(self, model, context, **kwargs):
+        started = time.perf_counter()
+        params = context.get("synthetic_params", {})
+        handler = getattr(self, f"handle_{model.name}", None)
+        if handler is None:
+            raise NotImplementedError(f"{model.name} is not simulated")
+
+        status_code, parsed = handler(params)
+        parsed.setdefault("ResponseMetadata", {})
+        parsed["ResponseMetadata"].update(
+            {"HTTPStatusCode": status_code, "RetryAttempts": 0}
+        )
+        with self.lock:
+            self.calls[model.name] += 1
+            self.stub_seconds += time.perf_counter() - started
+        return AWSResponse(None, status_code, {}, None), parsed
+
+    def handle_DescribeInstances(self, params):
+        matches = []
+        for instance_name, instance in self.instances.items():
+            tags = {tag["Key"]: tag["Value"] for tag in instance["Tags"]}
+            matched = True
+            for instance_filter in params.get("Filters", []):
+                name = instance_filter["Name"]
+                if name.startswith("tag:"):
+                    matched = (
+                        matched and tags.get(name[4:]) in instance_filter["Values"]
+                    )
+                elif name == "instance-id":
+                    matched = matched and (
+                        instance["InstanceId"] in instance_filter["Values"]
+                    )
+            instance_ids = params.get("InstanceIds")
+            if instance_ids and instance["InstanceId"] not in instance_ids:
+                matched = False
+            if matched:
+                matches.append(
+                    {
+                        "InstanceId": instance["InstanceId"],
+                        "State": {"Name": "running"},
+                        "Tags": instance["Tags"],
+                    }
+                )
+
+        page, next_token = self.paginate(matches, params)
+        response = {"Reservations": [{"Instances": [instance]} for instance in page]}
+        if next_token:
+            response["NextToken"] = next_token
+        return 200, response
+
+    def handle_DescribeVolumes(self, params):
+        volume_ids = params.get("VolumeIds")
+        for volume_filter in params.get("Filters", []):
+            if volume_filter["Name"] == "attachment.instance-id":
+                volume_ids = [
+                    volume_id
+                    for instance in self.instances.values()
+                    if instance["InstanceId"] in volume_filter["Values"]
+                    for volume_id in instance["VolumeIds"]
+                ]
+            elif volume_filter["Name"] == "volume-id":
+                volume_ids = volume_filter["Values"]
+        if volume_ids is None:
+            volume_ids = list(self.volumes)
+
+        volumes = [self.volumes[volume_id] for volume_id in volume_ids]
+        page, next_token = self.paginate(volumes, params)
+        response = {"Volumes": page}
+        if next_token:
+            response["NextToken"] = next_token
+        return 200, response
+
+    def paginate(self, items, params):
+        offset = int(params.get("NextToken") or 0)
+        limit = params.get("MaxResults") or len(items)
+        end = offset + limit
+        return items[offset:end], str(end) if end < len(items) else None
+
+    def timestamp_grid(self, start_time, end_time, period):
+        """
+        Get the bucket timestamps between two times. Grids are cached, so every
+        query over the same window shares the same datetime objects.
+        """
+        start = -(-int(start_time.timestamp()) // period) * period
+        end = int(end_time.timestamp())
+        key = (start, end, period)
+        with self.lock:
+            if key not in self.timestamp_grids:
+                self.timestamp_grids[key] = [
+                    datetime.fromtimestamp(seconds, tz=timezone.utc)
+                    for seconds in range(start, end, period)
+                ]
+            return self.timestamp_grids[key]
+
+    def metric_values(self, volume_id, metric_name, period, offset, count):
+        volume = self.volumes.get(volume_id)
+        if volume is None:
+            return []
+        seed = zlib.crc32(f"{volume_id}/{metric_name}/{offset}".encode())
+        rng = np.random.default_rng([self.seed, seed])
+        if metric_name == "VolumeIdleTime":
+            return rng.choice(idle_time_choices(period), count).tolist()
+        if metric_name.endswith("Ops"):
+            limit = volume.get("Iops", 3000) * period
+        else:
+            limit = volume.get("Throughput", 250) * 1000000 * period
+        return (rng.beta(2, 5, count) * limit * 0.6).tolist()
+
+    def handle_GetMetricData(self, params):
+        queries = params["MetricDataQueries"]
+        stat_queries = [query for query in queries if "MetricStat" in query]
+        per_query = max(1, MAX_DATAPOINTS_PER_CALL // max(1, len(stat_queries)))
+        offset = int(params.get("NextToken") or 0)
+
+        more = False
+        series = {}
+        for query in stat_queries:
+            metric_stat = query["MetricStat"]
+            metric = metric_stat["Metric"]
+            period = metric_stat["Period"]
+            grid = self.timestamp_grid(params["StartTime"], params["EndTime"], period)
+            page_grid = grid[offset : offset + per_query]
+            more = more or offset + per_query < len(grid)
+            volume_id = metric["Dimensions"][0]["Value"]
+            values = self.metric_values(
+                volume_id, metric["MetricName"], period, offset, len(page_grid)
+            )
+            series[query["Id"]] = (metric["MetricName"], page_grid, values)
+
+        results = []
+        datapoints = 0
+        for query in queries:
+            if "Expression" in query:
+                label = query["Id"]
+                page_grid, values = self.evaluate_expression(
+                    query["Expression"], series
+                )
+            else:
+                label, page_grid, values = series[query["Id"]]
+            if not query.get("ReturnData", True):
+                continue
+
+            datapoints += len(values)
+            results.append(
+                {
+                    "Id": query["Id"],
+                    "Label": label,
+                    "Timestamps": page_grid[: len(values)],
+                    "Values": values,
+                    "StatusCode": "PartialData" if more else "Complete",
+                }
+            )
+
+        with self.lock:
+            self.datapoints += datapoints
+        response = {"MetricDataResults": results, "Messages": []}
+        if more:
+            response["NextToken"] = str(offset + per_query)
+        return 200, response
+
+    def evaluate_expression(self, expression, series):
+        """
+        Evaluate the arithmetic, comparison and IF() metric math the
+        assessment uses, over the page's metric series.
+
+        Returns:
+        - A tuple containing the timestamps and values lists.
+        """
+        page_grid = []
+        namespace = {"IF": np.where}
+        for query_id in re.findall(r"[a-z]\w*", expression):
+            if query_id in series:
+                _, grid, values = series[query_id]
+                page_grid = grid[: len(values)]
+                namespace[query_id] = np.array(values, dtype=np.float64)
+        values = eval(expression, {"__builtins__": {}}, namespace)
+        return page_grid, np.broadcast_to(values, len(page_grid)).tolist()
+
+    def handle_GetCallerIdentity(self, params):
+        return 200, {
+            "Account": "000000000000",
+            "Arn": "arn:aws:iam::000000000000:user/benchmark",
+        }
+
+    def handle_PutDashboard(self, params):
+        self.dashboards[params["DashboardName"]] = params["DashboardBody"]
+        return 200, {"DashboardValidationMessages": []}
+
+    def handle_DeleteDashboards(self, params):
+        for dashboard_name in params["DashboardNames"]:
+            self.dashboards.pop(dashboard_name, None)
+        return 200, {}
+
+    def handle_GetDashboard(self, params):
+        dashboard_name = params["DashboardName"]
+        if dashboard_name not in self.dashboards:
+            return 404, {
+                "Error": {
+                    "Code": "ResourceNotFound",
+                    "Message": "Dashboard does not exist",
+                }
+            }
+        return 200, {
+            "DashboardName": dashboard_name,
+            "DashboardArn": f"arn:aws:cloudwatch::000000000000:dashboard/{dashboard_name}",
+            "DashboardBody": self.dashboards[dashboard_name],
+        }
+
+
+@contextlib.contextmanager
+def synthetic_aws(fleet):
+    """
+    Make every boto3.Session created inside the block use the synthetic fleet.
+    """
+    real_session = boto3.Session
+
+    def session_factory(*args, **kwargs):
+        kwargs.setdefault("region_name", REGION)
+        kwargs.setdefault("aws_access_key_id", "benchmark")
+        kwargs.setdefault("aws_secret_access_key", "benchmark")
+        session = real_session(*args, **kwargs)
+        fleet.register(session)
+        return session
+
+    boto3.Session = session_factory
+    try:
+        yield
+    finally:
+        boto3.Session = real_session
+
+
+@contextlib.contextmanager
+def timed_phases(module, phases, phase_seconds):
+    """
+    Add the time spent in each of a module's phase functions to phase_seconds.
+    Time spent in concurrent workers is added up.
+    """
+    originals = {name: getattr(module, name) for name in phases}
+    lock = threading.Lock()
+
+    def timed(name, function):
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                with lock:
+                    phase = phases[name]
+                    phase_seconds[phase] = phase_seconds.get(phase, 0.0) + (
+                        time.perf_counter() - started
+                    )
+
+        return wrapper
+
+    for name, function in originals.items():
+        setattr(module, name, timed(name, function))
+    try:
+        yield
+    finally:
+        for name, function in originals.items():
+            setattr(module, name, function)
+
+
+def run_flow(flow, fleet, days, phase_seconds, metric_math="local"):
+    instance_names = fleet.instance_names()
+
+    # Each instance goes through the script's main(), like one Jenkins call
+    if flow == "dashboard":
+        import infrasre_create_dashboard
+
+        for instance_name in instance_names:
+            infrasre_create_dashboard.main([instance_name, REGION])
+    elif flow == "assessment":
+        import infrasre_create_dashboard_assessment
+
+        for instance_name in instance_names:
+            infrasre_create_dashboard_assessment.main([instance_name, REGION])
+    elif flow == "full-assessment":
+        import infrasre_batch_assessment
+        import infrasre_create_dashboard_fullassessment
+
+        end_date = datetime.utcnow()
+        start_date = end_date - timedelta(days=days)
+        with timed_phases(
+            infrasre_create_dashboard_fullassessment,
+            FULL_ASSESSMENT_PHASES,
+            phase_seconds,
+        ):
+            infrasre_batch_assessment.run_batch_assessment(
+                instance_names,
+                TICKET_NUMBER,
+                start_date.strftime("%m/%d/%Y"),
+                end_date.strftime("%m/%d/%Y"),
+                metric_math=metric_math,
+            )
+    else:
+        raise ValueError(f"Unknown flow '{flow}'")
+
+
+def run_scenario(scenario):
+    """
+    Run one scenario in this process and measure it.
+
+    Args:
+    - scenario: Dictionary with the "flow", "instances", "days",
+      "metric_math", "max_volumes" and "seed" to run.
+
+    Returns:
+    - A dictionary with the scenario, its wall time, API call counts, peak
+      memory and phase timings.
+    """
+    os.environ["ticketnumber"] = TICKET_NUMBER
+    fleet = SyntheticFleet(
+        scenario["instances"], scenario["max_volumes"], scenario["seed"]
+    )
+    phase_seconds = {}
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        with synthetic_aws(fleet):
+            started = time.perf_counter()
+            run_flow(
+                scenario["flow"],
+                fleet,
+                scenario["days"],
+                phase_seconds,
+                scenario["metric_math"],
+            )
+            wall_seconds = time.perf_counter() - started
+
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return dict(
+        scenario,
+        volumes=len(fleet.volumes),
+        wall_seconds=round(wall_seconds, 4),
+        stub_seconds=round(fleet.stub_seconds, 4),
+        api_calls=dict(fleet.calls),
+        datapoints=fleet.datapoints,
+        dashboards=len(fleet.dashboards),
+        peak_rss_mb=round(rss_after / 1024, 1),
+        peak_rss_growth_mb=round((rss_after - rss_before) / 1024, 1),
+        phase_seconds={
+            phase: round(seconds, 4) for phase, seconds in phase_seconds.items()
+        },
+    )
+
+
+def datapoint_memory(days, period=300, seed=7):
+    """
+    Measure the memory one GetMetricData series takes per datapoint, as
+    botocore parses it and once compacted by metric_fetch.compact_results.
+
+    botocore parses every timestamp into its own timezone-aware datetime,
+    so the series is built the same way.
+
+    Returns:
+    - A dictionary with the number of "datapoints" and the "parsed" and
+      "compact" bytes per datapoint.
+    """
+    import tracemalloc
+
+    from dateutil.tz import tzutc
+
+    from metric_fetch import compact_results
+
+    rng = random.Random(seed)
+    count = days * 86400 // period
+    start = datetime(2026, 1, 1, tzinfo=tzutc())
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = {
+        "Id": "m",
+        "Timestamps": [start + timedelta(seconds=period * i) for i in range(count)],
+        "Values": [rng.uniform(0, 1e6) for _ in range(count)],
+    }
+    parsed_bytes = tracemalloc.get_traced_memory()[0] - before
+    compact_results([result])
+    compact_bytes = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+
+    return {
+        "days": days,
+        "datapoints": count,
+        "parsed": round(parsed_bytes / count, 1),
+        "compact": round(compact_bytes / count, 1),
+    }
+
+
+def scenario_matrix(
+    flows, instance_counts, day_windows, metric_math_modes, max_volumes, seed
+):
+    scenarios = []
+    for flow in flows:
+        for instances in instance_counts:
+            windows = day_windows if flow in WINDOWED_FLOWS else [None]
+            modes = metric_math_modes if flow in WINDOWED_FLOWS else ["local"]
+            for days in windows:
+                for metric_math in modes:
+                    scenarios.append(
+                        {
+                            "flow": flow,
+                            "instances": instances,
+                            "days": days,
+                            "metric_math": metric_math,
+                            "max_volumes": max_volumes,
+                            "seed": seed,
+                        }
+                    )
+    return scenarios
+
+
+def run_in_subprocess(scenario):
+    """
+    Run a scenario in a fresh interpreter, so module state, caches and peak
+    memory do not carry over from the previous scenario.
+    """
+    environment = dict(
+        os.environ,
+        AWS_ACCESS_KEY_ID="benchmark",
+        AWS_SECRET_ACCESS_KEY="benchmark",
+        AWS_DEFAULT_REGION=REGION,
+        AWS_EC2_METADATA_DISABLED="true",
+    )
+    completed = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--scenario", json.dumps(scenario)],
+        capture_output=True,
+        text=True,
+        env=environment,
+        check=True,
+    )
+    return json.loads(completed.stdout.splitlines()[-1])
+
+
+def print_header():
+    print(
+        f"{'flow':<16} {'inst':>5} {'vols':>5} {'days':>5} {'math':>6} {'wall s':>9} "
+        f"{'stub s':>8} {'calls':>7} {'datapoints':>11} {'peak MB':>8}  phases"
+    )
+
+
+def print_result(result):
+    days = result["days"] if result["days"] is not None else "-"
+    phases = " ".join(
+        f"{phase}={seconds:.3f}" for phase, seconds in result["phase_seconds"].items()
+    )
+    print(
+        f"{result['flow']:<16} {result['instances']:>5} {result['volumes']:>5} "
+        f"{days:>5} {result['metric_math']:>6} {result['wall_seconds']:>9.3f} "
+        f"{result['stub_seconds']:>8.3f} "
+        f"{sum(result['api_calls'].values()):>7} {result['datapoints']:>11} "
+        f"{result['peak_rss_mb']:>8.1f}  {phases}",
+        flush=True,
+    )
+
+
+def parse_list(value, item_type=int):
+    return [item_type(item) for item in value.split(",") if item]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark the dashboard and assessment flows against a synthetic fleet."
+    )
+    parser.add_argument("--instances", default="1,10,100", type=parse_list)
+    parser.add_argument("--days", default="30,60,90", type=parse_list)
+    parser.add_argument(
+        "--flows",
+        default=",".join(FLOWS),
+        type=lambda value: parse_list(value, str),
+    )
+    parser.add_argument(
+        "--metric-math",
+        default="local",
+        type=lambda value: parse_list(value, str),
+        help="Where the full assessment computes its expressions: local, server and/or check.",
+    )
+    parser.add_argument("--max-volumes", default=20, type=int)
+    parser.add_argument("--seed", default=7, type=int)
+    parser.add_argument("--output", help="Write the results to this JSON file.")
+    parser.add_argument(
+        "--datapoint-memory",
+        action="store_true",
+        help="Only measure the bytes per datapoint of a 300-second series over each of --days.",
+    )
+    parser.add_argument("--scenario", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.datapoint_memory:
+        print(
+            f"{'days':>5} {'datapoints':>11} {'parsed B/dp':>12} {'compact B/dp':>13}"
+        )
+        for days in args.days:
+            memory = datapoint_memory(days, seed=args.seed)
+            print(
+                f"{days:>5} {memory['datapoints']:>11} {memory['parsed']:>12.1f} "
+                f"{memory['compact']:>13.1f}"
+            )
+        return
+
+    if args.scenario:
+        print(json.dumps(run_scenario(json.loads(args.scenario))))
+        return
+
+    print_header()
+    results = []
+    for scenario in scenario_matrix(
+        args.flows,
+        args.instances,
+        args.days,
+        args.metric_math,
+        args.max_volumes,
+        args.seed,
+    ):
+        results.append(run_in_subprocess(scenario))
+        print_result(results[-1])
+
+    if args.output:
+        with open(args.output, "w") as report_file:
+            json.dump(results, report_file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
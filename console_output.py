@@ -0,0 +1,57 @@
+import contextlib
+import io
+import sys
+import threading
+
+_output_lock = threading.Lock()
+
+
+class _ThreadBufferedStdout:
+    """
+    Stand-in for sys.stdout that sends each thread's output to its own buffer
+    while that thread is inside buffered_output().
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.local = threading.local()
+
+    def write(self, text):
+        buffer = getattr(self.local, "buffer", None)
+        if buffer is not None:
+            return buffer.write(text)
+        with _output_lock:
+            return self.stream.write(text)
+
+    def flush(self):
+        if getattr(self.local, "buffer", None) is None:
+            self.stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+@contextlib.contextmanager
+def buffered_output():
+    """
+    Collect everything the current thread prints and write it out as one block
+    on exit, so the output of concurrent workers does not interleave.
+    """
+    with _output_lock:
+        if not isinstance(sys.stdout, _ThreadBufferedStdout):
+            sys.stdout = _ThreadBufferedStdout(sys.stdout)
+        stdout = sys.stdout
+
+    previous = getattr(stdout.local, "buffer", None)
+    stdout.local.buffer = io.StringIO()
+    try:
+        yield
+    finally:
+        text = stdout.local.buffer.getvalue()
+        stdout.local.buffer = previous
+        if previous is not None:
+            previous.write(text)
+        else:
+            with _output_lock:
+                stdout.stream.write(text)
+                stdout.stream.flush()
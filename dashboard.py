@@ -0,0 +1,645 @@
+import hashlib
+import json
+
+from widget_templates import WidgetTemplate
+
+# How an existing dashboard is updated:
+# - "replace": always put the whole body.
+# - "update": put the body only when its widgets differ from the dashboard's.
+# - "merge": keep the dashboard's widgets and add the missing ones below them.
+DASHBOARD_UPDATE_MODES = ("replace", "update", "merge")
+
+DASHBOARD_NOT_FOUND_ERROR_CODES = {"ResourceNotFound", "ResourceNotFoundException"}
+
+# Separates a split dashboard's name from its shard number. Dashboard names
+# end in an instance Name tag, which may end in "-<digits>" but never holds a
+# double underscore, so a shard never takes another instance's name.
+SHARD_SUFFIX = "__part"
+
+# CloudWatch dashboards are laid out on a grid 24 columns wide
+GRID_COLUMNS = 24
+
+# CloudWatch dashboard quotas. The body size stays well below the 1 MB
+# PutDashboard request limit.
+MAX_DASHBOARD_WIDGETS = 500
+MAX_DASHBOARD_METRICS = 2500
+MAX_WIDGET_METRICS = 500
+MAX_DASHBOARD_BODY_BYTES = 900000
+
+
+def qcd_dashboard_name(ticketnumber, instance_name):
+    return f"infrasre_qcd_{ticketnumber}-{instance_name}"
+
+
+def volume_label(instance_name, volume_id, vol_name_tag):
+    """
+    Get the label used in a volume's widget titles and assessment output.
+
+    Args:
+    - instance_name: The Name tag of the instance.
+    - volume_id: The ID of the volume.
+    - vol_name_tag: The Name tag of the volume, or None.
+
+    Returns:
+    - "<volume Name tag>_<volume ID>", or "<instance name>_<volume ID>" when
+      the volume has no Name tag.
+    """
+    if vol_name_tag:
+        return f"{vol_name_tag}_{volume_id}"
+    return f"{instance_name}_{volume_id}"
+
+
+def shard_dashboard_name(dashboard_name, index):
+    """
+    Get the name of the index-th dashboard of a split dashboard: the first
+    keeps the name, the next ones get a SHARD_SUFFIX of "__part2",
+    "__part3"...
+    """
+    if index == 0:
+        return dashboard_name
+    return f"{dashboard_name}{SHARD_SUFFIX}{index + 1}"
+
+
+def stale_shard_names(dashboard_name, shard_count, recorded_count):
+    """
+    Get the names of the shards an earlier run created past this run's last
+    one.
+
+    Args:
+    - dashboard_name: The name of the first dashboard.
+    - shard_count: Number of dashboards this run created.
+    - recorded_count: Number of dashboards recorded by an earlier run.
+
+    Returns:
+    - The names of the stale shards.
+    """
+    return [
+        shard_dashboard_name(dashboard_name, index)
+        for index in range(shard_count, recorded_count)
+    ]
+
+
+def widget_metric_count(widget):
+    return len(widget.get("properties", {}).get("metrics", []))
+
+
+class DashboardLayout:
+    """
+    Place widgets on the dashboard grid, row by row, and start a new
+    dashboard before one would go over the widget, metric or body size
+    limits.
+
+    The widgets of a row are placed left to right and wrap at GRID_COLUMNS.
+    A row always stays on one dashboard. With a body, the first dashboard
+    continues below the body's widgets.
+    """
+
+    def __init__(
+        self,
+        max_widgets=MAX_DASHBOARD_WIDGETS,
+        max_metrics=MAX_DASHBOARD_METRICS,
+        max_body_bytes=MAX_DASHBOARD_BODY_BYTES,
+        body=None,
+    ):
+        self.max_widgets = max_widgets
+        self.max_metrics = max_metrics
+        self.max_body_bytes = max_body_bytes
+        self.dashboards = []
+        self.new_dashboard(body)
+
+    def new_dashboard(self, body=None):
+        # Starts a dashboard, or continues the widgets of an existing body
+        body = body or {}
+        self.widgets = list(body.get("widgets", []))
+        self.dashboards.append(self.widgets)
+        self.y = max(
+            (widget.get("y", 0) + widget.get("height", 6) for widget in self.widgets),
+            default=0,
+        )
+        self.metrics = sum(widget_metric_count(widget) for widget in self.widgets)
+        self.body_bytes = len(json.dumps(dict(body, widgets=[]))) + sum(
+            len(json.dumps(widget)) + 2 for widget in self.widgets
+        )
+
+    def place_row(self, widgets):
+        # Returns copies of the widgets with their position set, and the
+        # height of the row
+        placed = []
+        x = 0
+        y = self.y
+        row_height = 0
+        for widget in widgets:
+            width = widget.get("width", GRID_COLUMNS)
+            if x and x + width > GRID_COLUMNS:
+                x = 0
+                y += row_height
+                row_height = 0
+            placed.append(dict(widget, x=x, y=y))
+            x += width
+            row_height = max(row_height, widget.get("height", 6))
+        return placed, y + row_height - self.y
+
+    def add_row(self, widgets):
+        """
+        Add a row of widget dictionaries, on a new dashboard when the current
+        one has no room left for it.
+        """
+        for widget in widgets:
+            if widget_metric_count(widget) > MAX_WIDGET_METRICS:
+                raise ValueError(
+                    f"Widget '{widget.get('properties', {}).get('title')}' has more than {MAX_WIDGET_METRICS} metrics"
+                )
+
+        placed, height = self.place_row(widgets)
+        row_metrics = sum(widget_metric_count(widget) for widget in placed)
+        # Each widget also adds a ", " separator to the body
+        row_bytes = sum(len(json.dumps(widget)) + 2 for widget in placed)
+        if self.widgets and (
+            len(self.widgets) + len(placed) > self.max_widgets
+            or self.metrics + row_metrics > self.max_metrics
+            or self.body_bytes + row_bytes > self.max_body_bytes
+        ):
+            self.new_dashboard()
+            placed, height = self.place_row(widgets)
+            row_bytes = sum(len(json.dumps(widget)) + 2 for widget in placed)
+
+        self.widgets.extend(placed)
+        self.y += height
+        self.metrics += row_metrics
+        self.body_bytes += row_bytes
+
+
+def layout_dashboards(widget_rows):
+    """
+    Lay out rows of widgets on as many dashboards as the limits require.
+
+    Args:
+    - widget_rows: List of rows, each a list of widget dictionaries.
+
+    Returns:
+    - A list of dashboards, each a list of positioned widget dictionaries.
+    """
+    layout = DashboardLayout()
+    for widgets in widget_rows:
+        layout.add_row(widgets)
+    return layout.dashboards
+
+
+def widget_rows_by_y(widgets):
+    # Group positioned widgets back into rows, top to bottom
+    rows = {}
+    for widget in widgets:
+        rows.setdefault(widget.get("y", 0), []).append(widget)
+    return [rows[y] for y in sorted(rows)]
+
+
+def merged_widgets(existing_body, widgets):
+    """
+    Add widgets below the widgets of an existing dashboard.
+
+    The rows of the added widgets are laid out again from the bottom of the
+    existing widgets. From the first row that would take the dashboard over
+    the widget, metric or body size limits on, the rows are left out.
+
+    Args:
+    - existing_body: The existing dashboard body dictionary.
+    - widgets: List of positioned widget dictionaries to add.
+
+    Returns:
+    - A tuple containing the existing widgets followed by the added widgets
+      that fit, and the list of rows left out.
+    """
+    layout = DashboardLayout(body=existing_body)
+    rows = widget_rows_by_y(widgets)
+    for index, row in enumerate(rows):
+        layout.add_row(row)
+        if len(layout.dashboards) > 1:
+            return layout.dashboards[0], rows[index:]
+    return layout.dashboards[0], []
+
+
+def dropped_rows_message(dashboard_name, dropped_rows):
+    """
+    Get the message printed for the rows that did not fit on a merged
+    dashboard.
+    """
+    titles = [
+        widget.get("properties", {}).get("title") or widget.get("type")
+        for row in dropped_rows
+        for widget in row
+    ]
+    return (
+        f"Dashboard '{dashboard_name}' is full, {len(titles)} widget(s) were "
+        f"not merged: {', '.join(map(str, titles))}"
+    )
+
+
+def widget_key(widget):
+    """
+    Identify a widget by its type and metrics, so a widget whose title
+    changed is still recognized when merging.
+    """
+    properties = widget.get("properties", {})
+    return json.dumps([widget.get("type"), properties.get("metrics")], sort_keys=True)
+
+
+def dashboard_body_hash(dashboard_body_json):
+    return hashlib.sha256(dashboard_body_json.encode()).hexdigest()
+
+
+def get_dashboard_body(cloudwatch, dashboard_name):
+    """
+    Get the body of an existing dashboard.
+
+    Returns:
+    - The dashboard body JSON, or None when the dashboard does not exist.
+    """
+    from botocore.exceptions import ClientError
+
+    try:
+        response = cloudwatch.get_dashboard(DashboardName=dashboard_name)
+    except ClientError as e:
+        error_code = e.response.get("Error", {}).get("Code")
+        if error_code not in DASHBOARD_NOT_FOUND_ERROR_CODES:
+            raise
+        return None
+    return response["DashboardBody"]
+
+
+def updated_dashboard_body(existing_body_json, dashboard_body_json, update_mode):
+    """
+    Compare a dashboard's body with the one built by this run.
+
+    Args:
+    - existing_body_json: The dashboard's current body JSON, or None when it
+      does not exist.
+    - dashboard_body_json: The body JSON built by this run.
+    - update_mode: "update" or "merge", see DASHBOARD_UPDATE_MODES.
+
+    Returns:
+    - A tuple containing the body JSON to put, or None when the dashboard is
+      up to date, and the list of rows that did not fit when merging.
+    """
+    if existing_body_json is None:
+        return dashboard_body_json, []
+
+    existing_body = json.loads(existing_body_json)
+    existing_widgets = existing_body.get("widgets", [])
+    widgets = json.loads(dashboard_body_json)["widgets"]
+
+    if update_mode == "merge":
+        existing_keys = {widget_key(widget) for widget in existing_widgets}
+        new_widgets = [
+            widget for widget in widgets if widget_key(widget) not in existing_keys
+        ]
+        widgets, dropped_rows = merged_widgets(existing_body, new_widgets)
+        if len(widgets) == len(existing_widgets):
+            return None, dropped_rows
+        existing_body["widgets"] = widgets
+        return json.dumps(existing_body), dropped_rows
+
+    if existing_widgets == widgets:
+        return None, []
+    return dashboard_body_json, []
+
+
+def pushed_body_hashes(dashboard_body_json, pushed_body_json):
+    # What the lookup cache records about a dashboard: the hash of the body
+    # this run built, and the hash of the body the dashboard was left with
+    return [
+        dashboard_body_hash(dashboard_body_json),
+        dashboard_body_hash(pushed_body_json),
+    ]
+
+
+def dashboard_status_message(dashboard_name, status):
+    """
+    Get the message printed for a dashboard that was "created", "updated",
+    "deleted" or left "unchanged".
+    """
+    if status == "unchanged":
+        return f"Dashboard '{dashboard_name}' is up to date, it was not updated."
+    return f"Dashboard '{dashboard_name}' {status} successfully!"
+
+
+def create_dashboard(
+    cloudwatch, dashboard_name, widgets, update_mode="replace", lookup_cache=None
+):
+    """
+    Create a new CloudWatch dashboard with given widgets.
+
+    Args:
+    - cloudwatch: CloudWatch client used to put the dashboard.
+    - dashboard_name: The name of the dashboard.
+    - widgets: List of widget dictionaries.
+    - update_mode: How an existing dashboard is updated, one of
+      DASHBOARD_UPDATE_MODES.
+    - lookup_cache: Optional LookupCache holding the hashes of the body the
+      last run built and of the body it left on the dashboard, see
+      pushed_body_hashes. When this run builds the same body and the
+      dashboard still has the one left, it is not compared nor put. Only
+      used by "update" and "merge".
+
+    Returns:
+    - "created", "updated" or "unchanged".
+    """
+    # Define the dashboard body
+    dashboard_body = {"widgets": widgets}
+    dashboard_body_json = json.dumps(dashboard_body)
+
+    if update_mode == "replace":
+        # Create the dashboard
+        response = cloudwatch.put_dashboard(
+            DashboardName=dashboard_name, DashboardBody=dashboard_body_json
+        )
+        print(dashboard_status_message(dashboard_name, "created"))
+        return "created"
+
+    # The dashboard is always read, so one deleted or edited in the console
+    # since the last run is put again
+    key = [cloudwatch.meta.region_name, dashboard_name]
+    existing_body_json = get_dashboard_body(cloudwatch, dashboard_name)
+    if (
+        lookup_cache
+        and existing_body_json is not None
+        and lookup_cache.get("dashboard_body", key)
+        == pushed_body_hashes(dashboard_body_json, existing_body_json)
+    ):
+        print(dashboard_status_message(dashboard_name, "unchanged"))
+        return "unchanged"
+
+    body_json, dropped_rows = updated_dashboard_body(
+        existing_body_json, dashboard_body_json, update_mode
+    )
+    if body_json is None:
+        status = "unchanged"
+    else:
+        cloudwatch.put_dashboard(DashboardName=dashboard_name, DashboardBody=body_json)
+        status = "created" if existing_body_json is None else "updated"
+    if dropped_rows:
+        # Not recorded, so the next run tries to merge them again
+        print(dropped_rows_message(dashboard_name, dropped_rows))
+    elif lookup_cache:
+        lookup_cache.put(
+            "dashboard_body",
+            key,
+            pushed_body_hashes(dashboard_body_json, body_json or existing_body_json),
+        )
+
+    print(dashboard_status_message(dashboard_name, status))
+    return status
+
+
+def stale_shards_warning(stale_names, error):
+    return f"Warning: Could not delete the stale dashboard(s) {', '.join(stale_names)}: {error}"
+
+
+def delete_stale_shards(cloudwatch, dashboard_name, shard_count, lookup_cache):
+    """
+    Delete the shards an earlier run recorded past this run's last one, see
+    stale_shard_names, and record this run's number of shards.
+
+    Only shards recorded in the lookup cache are deleted, and nothing is
+    called while neither run split the dashboard. When the shards cannot be
+    deleted, such as without the cloudwatch:DeleteDashboards permission, a
+    warning is printed and the earlier count stays recorded.
+
+    Args:
+    - cloudwatch: CloudWatch client used to delete the dashboards.
+    - dashboard_name: The name of the first dashboard.
+    - shard_count: Number of dashboards this run created.
+    - lookup_cache: LookupCache the number of shards is recorded in.
+
+    Returns:
+    - The names of the deleted dashboards.
+    """
+    from botocore.exceptions import ClientError
+
+    key = [cloudwatch.meta.region_name, dashboard_name]
+    recorded_count = lookup_cache.get("dashboard_shards", key) or 1
+    stale_names = stale_shard_names(dashboard_name, shard_count, recorded_count)
+    if stale_names:
+        try:
+            cloudwatch.delete_dashboards(DashboardNames=stale_names)
+        except ClientError as e:
+            print(stale_shards_warning(stale_names, e))
+            return []
+        for stale_name in stale_names:
+            lookup_cache.invalidate(
+                "dashboard_body", [cloudwatch.meta.region_name, stale_name]
+            )
+            print(dashboard_status_message(stale_name, "deleted"))
+    lookup_cache.put("dashboard_shards", key, shard_count)
+    return stale_names
+
+
+def create_dashboards(
+    cloudwatch, dashboard_name, widget_rows, update_mode="replace", lookup_cache=None
+):
+    """
+    Lay out rows of widgets and create as many dashboards as the CloudWatch
+    limits require, named as shard_dashboard_name.
+
+    With a lookup_cache and unless update_mode is "merge", the shards an
+    earlier run recorded past this run's last one are deleted, see
+    delete_stale_shards.
+
+    Args:
+    - cloudwatch: CloudWatch client used to put the dashboards.
+    - dashboard_name: The name of the first dashboard.
+    - widget_rows: List of rows, each a list of widget dictionaries.
+    - update_mode: How existing dashboards are updated, one of
+      DASHBOARD_UPDATE_MODES.
+    - lookup_cache: Optional LookupCache, see create_dashboard.
+
+    Returns:
+    - The list of dashboard names.
+    """
+    dashboard_names = []
+    for index, widgets in enumerate(layout_dashboards(widget_rows)):
+        dashboard_names.append(shard_dashboard_name(dashboard_name, index))
+        create_dashboard(
+            cloudwatch, dashboard_names[-1], widgets, update_mode, lookup_cache
+        )
+    if lookup_cache and update_mode != "merge":
+        delete_stale_shards(
+            cloudwatch, dashboard_name, len(dashboard_names), lookup_cache
+        )
+    return dashboard_names
+
+
+CPU_WIDGET_TEMPLATE = WidgetTemplate(
+    {
+        "type": "metric",
+        "x": 0,
+        "y": 0,
+        "width": 12,
+        "height": 6,
+        "properties": {
+            "metrics": [["AWS/EC2", "CPUUtilization", "InstanceId", "{instance_id}"]],
+            "view": "timeSeries",
+            "stacked": False,
+            "region": "{region}",
+            "stat": "Maximum",
+            "period": 300,
+            "title": "{instance_name}_{instance_id}_CPU",
+        },
+    }
+)
+
+IOPS_WIDGET_TEMPLATE = WidgetTemplate(
+    {
+        "type": "metric",
+        "x": 0,
+        "y": 0,
+        "width": 12,
+        "height": 6,
+        "properties": {
+            "metrics": [
+                [{"expression": "(m1+m2)/({period}-m3)", "label": "IOPS", "id": "e1"}],
+                [
+                    "AWS/EBS",
+                    "VolumeReadOps",
+                    "VolumeId",
+                    "{volume_id}",
+                    {"id": "m1", "visible": False},
+                ],
+                [".", "VolumeWriteOps", ".", ".", {"id": "m2", "visible": False}],
+                [".", "VolumeIdleTime", ".", ".", {"id": "m3", "visible": False}],
+            ],
+            "view": "timeSeries",
+            "stacked": False,
+            "region": "{region}",
+            "stat": "Sum",
+            "period": "{period}",
+            "title": "{vol_name_tag}_{volume_type}_IOPS",
+            "annotations": "{annotations}",
+        },
+    }
+)
+
+THROUGHPUT_WIDGET_TEMPLATE = WidgetTemplate(
+    {
+        "type": "metric",
+        "x": 0,
+        "y": 0,
+        "width": 12,
+        "height": 6,
+        "properties": {
+            "metrics": [
+                [
+                    {
+                        "expression": "(m1+m2)/({period}-m3)",
+                        "label": "Throughput",
+                        "id": "e1",
+                    }
+                ],
+                [
+                    "AWS/EBS",
+                    "VolumeReadBytes",
+                    "VolumeId",
+                    "{volume_id}",
+                    {"id": "m1", "visible": False},
+                ],
+                [".", "VolumeWriteBytes", ".", ".", {"id": "m2", "visible": False}],
+                [".", "VolumeIdleTime", ".", ".", {"id": "m3", "visible": False}],
+            ],
+            "view": "timeSeries",
+            "stacked": False,
+            "region": "{region}",
+            "stat": "Sum",
+            "period": "{period}",
+            "title": "{vol_name_tag}_{volume_type}_Throughput",
+            "annotations": "{annotations}",
+        },
+    }
+)
+
+
+def create_cpu_widget(instance_id, target_region, instance_name):
+    return CPU_WIDGET_TEMPLATE.render(
+        {
+            "instance_id": instance_id,
+            "region": target_region,
+            "instance_name": instance_name,
+        }
+    )
+
+
+def create_iops_widget(
+    volume_id, target_region, vol_name_tag, volume_type, allocated_iops, period=300
+):
+    iops_annotation = None
+    if allocated_iops != "N/A":
+        iops_annotation = {"horizontal": [{"label": "IOPS", "value": allocated_iops}]}
+
+    return IOPS_WIDGET_TEMPLATE.render(
+        {
+            "volume_id": volume_id,
+            "region": target_region,
+            "vol_name_tag": vol_name_tag,
+            "volume_type": volume_type,
+            "period": period,
+            "annotations": iops_annotation,
+        }
+    )
+
+
+def create_throughput_widget(
+    volume_id,
+    target_region,
+    vol_name_tag,
+    volume_type,
+    allocated_throughput,
+    period=300,
+):
+    throughput_annotation = None
+    if allocated_throughput != "N/A":
+        allocated_throughput = allocated_throughput * 1000000
+        throughput_annotation = {
+            "horizontal": [{"label": "Throughput", "value": allocated_throughput}]
+        }
+
+    return THROUGHPUT_WIDGET_TEMPLATE.render(
+        {
+            "volume_id": volume_id,
+            "region": target_region,
+            "vol_name_tag": vol_name_tag,
+            "volume_type": volume_type,
+            "period": period,
+            "annotations": throughput_annotation,
+        }
+    )
+
+
+def create_template_widgets(
+    widget_templates,
+    instance_name,
+    instance_id,
+    volume_id,
+    target_region,
+    vol_name_tag,
+    volume_type,
+    allocated_iops,
+    allocated_throughput,
+    period=300,
+):
+    """
+    Render user-defined widget templates (see
+    widget_templates.load_widget_templates) for one volume.
+
+    Returns:
+    - A list of widget dictionaries, in template order.
+    """
+    values = {
+        "instance_name": instance_name,
+        "instance_id": instance_id,
+        "volume_id": volume_id,
+        "region": target_region,
+        "vol_name_tag": vol_name_tag,
+        "volume_type": volume_type,
+        "allocated_iops": allocated_iops,
+        "allocated_throughput": allocated_throughput,
+        "period": period,
+    }
+    return [template.render(values) for template in widget_templates]
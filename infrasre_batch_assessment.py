@@ -0,0 +1,745 @@
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import os
+import sys
+
+from assessment_results import RESULT_FORMATS, AssessmentResults
+from aws_clients import ClientRegistry, get_account_id, pool_connections
+from console_output import buffered_output
+from dashboard import DASHBOARD_UPDATE_MODES
+from infrasre_create_dashboard_fullassessment import (
+    METRIC_MATH_MODES,
+    TARGET_PERCENTILE,
+    RANGE_WORKERS,
+    VOLUME_WORKERS,
+    get_date_range,
+    run_full_assessment,
+)
+from lookup_cache import (
+    DASHBOARD_LOOKUP_NAMESPACES,
+    EC2_LOOKUP_NAMESPACES,
+    LookupCache,
+)
+from metric_cache import MetricCache
+from run_report import RunReport, report_phase
+from volume_inventory import (
+    ambiguous_name_message,
+    discover_instances,
+    get_volumes_by_instance,
+    resolve_instance_names,
+)
+from widget_templates import load_widget_templates
+
+# Maximum number of servers assessed at the same time
+MAX_WORKERS = 8
+
+# The first four characters of a server name identify its region
+REGION_CODES = {
+    "USEA": "us-east-1",
+    "USWE": "us-west-2",
+    "EUWE": "eu-west-1",
+    "EUCE": "eu-central-1",
+    "APAU": "ap-southeast-2",
+    "APSP": "ap-southeast-1",
+    "CACE": "ca-central-1",
+}
+
+
+def get_server_names(inputservernames):
+    """
+    Normalize the server name inputs.
+
+    Args:
+    - inputservernames: List of server names. Each entry may hold several
+      names, one per line.
+
+    Returns:
+    - A list of upper-case server names with whitespace removed, without
+      blanks or duplicates, in input order.
+    """
+    server_names = []
+    for entry in inputservernames:
+        for line in entry.splitlines():
+            server_name = "".join(line.split()).upper()
+            if server_name and server_name not in server_names:
+                server_names.append(server_name)
+    return server_names
+
+
+def get_region_from_server_name(server_name):
+    """
+    Get the AWS region of a server from its 4-letter name prefix.
+
+    Args:
+    - server_name: The upper-case server name.
+
+    Returns:
+    - The region name, or None when the prefix is not a known region code.
+    """
+    return REGION_CODES.get(server_name[:4])
+
+
+def group_servers_by_region(server_names):
+    """
+    Group server names by the region derived from their prefix.
+
+    Args:
+    - server_names: List of upper-case server names.
+
+    Returns:
+    - A tuple containing a dictionary of region to server names and the list
+      of server names with an unknown region code.
+    """
+    servers_by_region = {}
+    unknown_servers = []
+    for server_name in server_names:
+        region = get_region_from_server_name(server_name)
+        if region:
+            servers_by_region.setdefault(region, []).append(server_name)
+        else:
+            unknown_servers.append(server_name)
+    return servers_by_region, unknown_servers
+
+
+def parse_tag_filters(tag_arguments):
+    """
+    Parse tag filters given as KEY=VALUE.
+
+    Args:
+    - tag_arguments: List of KEY=VALUE strings. Values of the same key are
+      alternatives, and different keys must all match.
+
+    Returns:
+    - A dictionary of tag key to the list of accepted values.
+    """
+    tag_filters = {}
+    for tag_argument in tag_arguments:
+        key, separator, value = tag_argument.partition("=")
+        key = key.strip()
+        if not separator or not key:
+            raise ValueError(f"Tag filter '{tag_argument}' is not KEY=VALUE")
+        values = tag_filters.setdefault(key, [])
+        if value.strip() not in values:
+            values.append(value.strip())
+    return tag_filters
+
+
+def get_servers_by_region(server_names, tag_filters=None, regions=None):
+    """
+    Get the regions to look up and the server names of each.
+
+    Args:
+    - server_names: List of upper-case server names, grouped by their region
+      code when no tag filters are given.
+    - tag_filters: Optional dictionary of tag key to accepted values. The
+      servers are discovered from the tags instead.
+    - regions: Regions searched with tag_filters. Defaults to every region
+      of REGION_CODES.
+
+    Returns:
+    - A tuple containing a dictionary of region to server names, empty when
+      discovering, and the list of server names with an unknown region code.
+    """
+    if tag_filters:
+        return {region: [] for region in regions or REGION_CODES.values()}, []
+    return group_servers_by_region(server_names)
+
+
+def look_up_region(ec2, region_servers, tag_filters=None, lookup_cache=None):
+    """
+    Find the instances of a region and their volumes, with a few paginated
+    describe_instances and describe_volumes calls for the whole region.
+
+    Args:
+    - ec2: EC2 client for the region.
+    - region_servers: List of the region's server names to resolve.
+    - tag_filters: Optional dictionary of tag key to accepted values. Every
+      live instance of the region with matching tags is found instead of
+      region_servers.
+    - lookup_cache: Optional LookupCache the name resolution and volumes are
+      read through.
+
+    Returns:
+    - A tuple containing a dictionary of name to instance IDs and a
+      dictionary of instance ID to its VolumeRecord tuples, for the names
+      that match exactly one instance.
+    """
+    if tag_filters:
+        instance_ids = discover_instances(ec2, tag_filters)
+    else:
+        instance_ids = resolve_instance_names(ec2, region_servers, lookup_cache)
+    return instance_ids, get_volumes_by_instance(
+        ec2, unique_instance_ids(instance_ids), lookup_cache
+    )
+
+
+def unique_instance_ids(instance_ids):
+    """
+    Get the IDs of the names that match exactly one instance.
+
+    Args:
+    - instance_ids: Dictionary of name to instance IDs.
+
+    Returns:
+    - A list of instance IDs.
+    """
+    return [
+        name_instance_ids[0]
+        for name_instance_ids in instance_ids.values()
+        if len(name_instance_ids) == 1
+    ]
+
+
+def assess_server(
+    server_name,
+    region,
+    clients,
+    ticketnumber,
+    date_range,
+    volume_workers,
+    metric_cache=None,
+    lookup_cache=None,
+    run_report=None,
+    metric_math="local",
+    target_percentile=TARGET_PERCENTILE,
+    adaptive_period=False,
+    assessment_results=None,
+    dashboard_update="replace",
+    widget_templates=(),
+    instance_id=None,
+    attached_volumes=None,
+    range_workers=RANGE_WORKERS,
+):
+    """
+    Run the full assessment of one server with its region's shared clients.
+
+    The server's output is printed as one block when it finishes.
+
+    Returns:
+    - The instance ID, or None when the server was not found or failed.
+    """
+    start_time, end_time, day_range = date_range
+    with buffered_output():
+        print(f"'{server_name}'")
+        print(f"aws region '{region}'")
+        try:
+            return run_full_assessment(
+                server_name,
+                region,
+                clients["ec2"],
+                clients["cloudwatch"],
+                ticketnumber,
+                start_time,
+                end_time,
+                day_range,
+                volume_workers,
+                metric_cache,
+                lookup_cache,
+                run_report,
+                metric_math,
+                target_percentile,
+                adaptive_period,
+                assessment_results,
+                dashboard_update,
+                widget_templates,
+                instance_id,
+                attached_volumes,
+                range_workers,
+            )
+        except Exception as e:
+            print(f"Error: {e}")
+            return None
+
+
+def print_unresolved_names(instance_ids):
+    """
+    Print the server names that match no instance or several instances.
+
+    Args:
+    - instance_ids: Dictionary of name to instance IDs, as returned by
+      volume_inventory.resolve_instance_names.
+
+    Returns:
+    - A dictionary of the names that match exactly one instance to its ID.
+    """
+    resolved = {}
+    for instance_name, name_instance_ids in instance_ids.items():
+        if len(name_instance_ids) == 1:
+            resolved[instance_name] = name_instance_ids[0]
+        elif not name_instance_ids:
+            print(f"No instance found with the name '{instance_name}'. Skipping.")
+        else:
+            print(
+                f"{ambiguous_name_message(instance_name, name_instance_ids)}. Skipping."
+            )
+    return resolved
+
+
+def region_assessments(region, region_servers, lookup, results):
+    """
+    Get the servers of a region to assess from its lookup.
+
+    Args:
+    - region: The region name.
+    - region_servers: List of the region's server names.
+    - lookup: The region's result of look_up_region, or None when it failed.
+    - results: Dictionary of (region, server name) to instance ID the
+      skipped names are added to, as None.
+
+    Returns:
+    - A list of tuples containing the server name, its instance ID and its
+      VolumeRecord tuples. When the lookup failed, the ID and volumes are
+      None and each server looks them up on its own.
+    """
+    if lookup is None:
+        return [(server_name, None, None) for server_name in region_servers]
+
+    instance_ids, volumes = lookup
+    resolved = print_unresolved_names(instance_ids)
+    for server_name in instance_ids:
+        if server_name not in resolved:
+            results[(region, server_name)] = None
+    return [
+        (server_name, instance_id, volumes[instance_id])
+        for server_name, instance_id in resolved.items()
+    ]
+
+
+def batch_servers(servers_by_region, lookups, results):
+    """
+    Get the servers to assess from the lookups of every region.
+
+    Tag discovery can find instances with the same name in several regions.
+    Their dashboards would share one name, so such a name is skipped, as a
+    name that matches several instances of one region is.
+
+    Args:
+    - servers_by_region: Dictionary of region to server names.
+    - lookups: Dictionary of region to its result of look_up_region, or None
+      when it failed.
+    - results: Dictionary of (region, server name) to instance ID the
+      skipped names are added to, as None.
+
+    Returns:
+    - A list of tuples containing the server name, its region, its instance
+      ID and its VolumeRecord tuples, see region_assessments.
+    """
+    servers = [
+        (server_name, region, instance_id, attached_volumes)
+        for region, region_servers in servers_by_region.items()
+        for server_name, instance_id, attached_volumes in region_assessments(
+            region, region_servers, lookups[region], results
+        )
+    ]
+    name_regions = {}
+    for server_name, region, _, _ in servers:
+        name_regions.setdefault(server_name, []).append(region)
+    for server_name, regions in name_regions.items():
+        if len(regions) > 1:
+            print(
+                f"The name '{server_name}' matches instances in {len(regions)} regions ({', '.join(regions)}). Skipping."
+            )
+            for region in regions:
+                results[(region, server_name)] = None
+    return [server for server in servers if len(name_regions[server[0]]) == 1]
+
+
+def print_discovered_instances(lookups):
+    """
+    Print how many instances matched the tag filters and in how many of the
+    searched regions, from the results of look_up_region (None when failed).
+    """
+    found = [lookup[0] for lookup in lookups if lookup is not None]
+    instance_count = sum(
+        len(name_instance_ids)
+        for instance_ids in found
+        for name_instance_ids in instance_ids.values()
+    )
+    region_count = sum(1 for instance_ids in found if instance_ids)
+    print(
+        f"Discovered {instance_count} instance(s) in {region_count} of {len(lookups)} region(s)."
+    )
+
+
+def run_batch_assessment(
+    server_names,
+    ticketnumber,
+    start_date,
+    end_date,
+    max_workers=MAX_WORKERS,
+    volume_workers=VOLUME_WORKERS,
+    metric_cache=None,
+    lookup_cache=None,
+    run_report=None,
+    metric_math="local",
+    target_percentile=TARGET_PERCENTILE,
+    adaptive_period=False,
+    assessment_results=None,
+    dashboard_update="replace",
+    widget_templates=(),
+    tag_filters=None,
+    regions=None,
+    range_workers=RANGE_WORKERS,
+):
+    """
+    Assess a list of servers concurrently in this process.
+
+    Servers are grouped by region, and every server of a region shares that
+    region's EC2 and CloudWatch clients. The regions are looked up
+    concurrently first: their names are resolved to instance IDs, or their
+    instances are discovered from tag filters, and the volumes of every
+    instance are fetched together. Names that match no instance or several
+    instances, or instances in several regions, are skipped.
+
+    Args:
+    - server_names: List of upper-case server names.
+    - ticketnumber: The ticket number used in the dashboard names.
+    - start_date: The first day of the range, as MM/DD/YYYY.
+    - end_date: The last day of the range, as MM/DD/YYYY.
+    - max_workers: Maximum number of servers assessed at the same time.
+    - volume_workers: Number of volume groups assessed in parallel per server.
+    - metric_cache: Optional MetricCache shared by every server.
+    - lookup_cache: Optional LookupCache shared by every server.
+    - run_report: Optional RunReport every client and server is recorded in.
+    - metric_math: Where the expressions are computed, one of
+      METRIC_MATH_MODES.
+    - target_percentile: The percentile the recommended allocations cover.
+    - adaptive_period: Fetch every part of the time range at the finest
+      period CloudWatch keeps for it, instead of 300 seconds.
+    - assessment_results: Optional AssessmentResults every server's
+      per-threshold results are added to.
+    - dashboard_update: How existing dashboards are updated, one of
+      DASHBOARD_UPDATE_MODES.
+    - widget_templates: List of WidgetTemplate added to every volume's row
+      of the dashboards.
+    - tag_filters: Optional dictionary of tag key to accepted values. Every
+      live instance with matching tags is assessed instead of server_names.
+    - regions: Regions searched with tag_filters. Defaults to every region
+      of REGION_CODES.
+    - range_workers: Number of sub-ranges of the time range fetched in
+      parallel per request.
+
+    Returns:
+    - A dictionary of (region, server name) to instance ID (None when not
+      assessed). The region is None for an unknown region code.
+    """
+    date_range = get_date_range(start_date, end_date)
+    print(f"{date_range[0]} to {date_range[1]}")
+
+    servers_by_region, unknown_servers = get_servers_by_region(
+        server_names, tag_filters, regions
+    )
+    results = {}
+    for server_name in unknown_servers:
+        print(f"Unknown region code for server '{server_name}'. Skipping.")
+        results[(None, server_name)] = None
+
+    # Every worker of a region shares that region's clients, so one client
+    # can have a request in flight per server, volume group and sub-range:
+    # 128 with the defaults. CloudWatch throttles well before that, so the
+    # pool is capped at aws_clients.MAX_POOL_CONNECTIONS, and the adaptive
+    # retries slow the workers down instead.
+    clients = ClientRegistry(
+        max_pool_connections=pool_connections(
+            max_workers * volume_workers * range_workers
+        ),
+        run_report=run_report,
+    )
+    region_clients = {
+        region: {
+            "ec2": clients.client("ec2", region),
+            "cloudwatch": clients.client("cloudwatch", region),
+        }
+        for region in servers_by_region
+    }
+
+    def look_up(region):
+        with report_phase(run_report, "lookup"):
+            return look_up_region(
+                region_clients[region]["ec2"],
+                servers_by_region[region],
+                tag_filters,
+                lookup_cache,
+            )
+
+    with ThreadPoolExecutor(max_workers=max(len(servers_by_region), 1)) as executor:
+        futures = {
+            region: executor.submit(look_up, region) for region in servers_by_region
+        }
+    lookups = {}
+    for region, future in futures.items():
+        try:
+            lookups[region] = future.result()
+        except Exception as e:
+            print(f"Error looking up the instances in {region}: {e}")
+            lookups[region] = None
+    if tag_filters:
+        print_discovered_instances(list(lookups.values()))
+
+    servers = batch_servers(servers_by_region, lookups, results)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            (region, server_name): executor.submit(
+                assess_server,
+                server_name,
+                region,
+                region_clients[region],
+                ticketnumber,
+                date_range,
+                volume_workers,
+                metric_cache,
+                lookup_cache,
+                run_report,
+                metric_math,
+                target_percentile,
+                adaptive_period,
+                assessment_results,
+                dashboard_update,
+                widget_templates,
+                instance_id,
+                attached_volumes,
+                range_workers,
+            )
+            for server_name, region, instance_id, attached_volumes in servers
+        }
+        for server_key, future in futures.items():
+            results[server_key] = future.result()
+
+    assessed = [name for name, instance_id in results.items() if instance_id]
+    print(
+        f"Assessed {len(assessed)} of {len(results)} server(s) in {len(servers_by_region)} region(s)."
+    )
+    return results
+
+
+def print_batch_plan(
+    server_names, start_date, end_date, tag_filters=None, regions=None
+):
+    """
+    Print the time range and the servers of each region without calling AWS.
+    With tag filters, print the filters and the regions searched instead.
+
+    Returns:
+    - True when every server has a known region code.
+    """
+    start_time, end_time, day_range = get_date_range(start_date, end_date)
+    print(f"{start_time} to {end_time} ({day_range} days)")
+
+    servers_by_region, unknown_servers = get_servers_by_region(
+        server_names, tag_filters, regions
+    )
+    if tag_filters:
+        for key, values in tag_filters.items():
+            print(f"tag:{key} = {' or '.join(values)}")
+        print(f"Regions: {', '.join(servers_by_region)}")
+    for region, region_servers in servers_by_region.items():
+        if region_servers:
+            print(f"{region}: {', '.join(region_servers)}")
+    for server_name in unknown_servers:
+        print(f"Unknown region code for server '{server_name}'.")
+    return not unknown_servers
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Create the dashboards and assess a list of servers."
+    )
+    parser.add_argument("start_date", help="The first day, as MM/DD/YYYY.")
+    parser.add_argument("end_date", help="The last day, as MM/DD/YYYY.")
+    parser.add_argument(
+        "servernames",
+        nargs="*",
+        help="Server names. Each argument may hold several names, one per line.",
+    )
+    parser.add_argument(
+        "--tag",
+        dest="tags",
+        metavar="KEY=VALUE",
+        action="append",
+        default=[],
+        help="Assess every running instance with this tag instead of server names. Repeat it to require several tags, or to accept several values of one tag. An argument may hold several filters, one per line.",
+    )
+    parser.add_argument(
+        "--regions",
+        help="Comma-separated regions searched with --tag (default: every region of the server name codes).",
+    )
+    parser.add_argument(
+        "--range-workers",
+        type=int,
+        default=RANGE_WORKERS,
+        help="Number of sub-ranges of a long time range fetched in parallel per request.",
+    )
+    parser.add_argument(
+        "--async",
+        dest="use_async",
+        action="store_true",
+        help="Run every server on one event loop with per-API rate limits.",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Read every metric and EC2 lookup from AWS, bypassing the local caches.",
+    )
+    parser.add_argument(
+        "--refresh-lookups",
+        action="store_true",
+        help="Clear the cached EC2 lookups first.",
+    )
+    parser.add_argument(
+        "--refresh-dashboards",
+        action="store_true",
+        help="Clear the recorded hashes of the dashboard bodies first, so every dashboard is compared with this run's.",
+    )
+    parser.add_argument(
+        "--validate-only",
+        action="store_true",
+        help="Check the dates and server names and print the plan without calling AWS.",
+    )
+    parser.add_argument(
+        "--report",
+        metavar="PATH",
+        help="Where the JSON run report is written (default: run_report_<ticketnumber>.json).",
+    )
+    parser.add_argument(
+        "--request-timing",
+        action="store_true",
+        help="Also time every HTTP request attempt in the run report.",
+    )
+    parser.add_argument(
+        "--metric-math",
+        choices=METRIC_MATH_MODES,
+        default="local",
+        help="Compute the IOPS and throughput expressions locally, in CloudWatch, or in both and compare them.",
+    )
+    parser.add_argument(
+        "--target-percentile",
+        type=float,
+        default=TARGET_PERCENTILE,
+        help="Percentile of the datapoints the recommended allocations cover.",
+    )
+    parser.add_argument(
+        "--adaptive-period",
+        action="store_true",
+        help="Fetch each part of the range at the finest period CloudWatch still keeps (60, 300 or 3600 seconds).",
+    )
+    parser.add_argument(
+        "--dashboard-update",
+        choices=DASHBOARD_UPDATE_MODES,
+        default="replace",
+        help="Always put the whole dashboard, put it only when its widgets changed, or only add the missing widgets.",
+    )
+    parser.add_argument(
+        "--widget-templates",
+        metavar="PATH",
+        help="JSON file of extra per-volume widget templates, such as a VolumeQueueLength or BurstBalance graph.",
+    )
+    parser.add_argument(
+        "--results",
+        metavar="PATH",
+        help="Where the per-threshold result table is written, as .csv, .json or .parquet (default: assessment_results_<ticketnumber>.csv).",
+    )
+    args = parser.parse_intermixed_args(argv)
+    if args.results and not args.results.lower().endswith(RESULT_FORMATS):
+        parser.error(f"--results must end with one of {', '.join(RESULT_FORMATS)}")
+
+    try:
+        tag_filters = parse_tag_filters(
+            line for entry in args.tags for line in entry.splitlines() if line.strip()
+        )
+    except ValueError as e:
+        parser.error(str(e))
+    regions = [
+        region.strip() for region in (args.regions or "").split(",") if region.strip()
+    ]
+    server_names = get_server_names(args.servernames)
+    if tag_filters and server_names:
+        parser.error("give either server names or --tag, not both")
+    if not tag_filters and not server_names:
+        parser.error("give server names or at least one --tag")
+    if regions and not tag_filters:
+        parser.error("--regions is only used with --tag")
+
+    if args.validate_only:
+        try:
+            valid = print_batch_plan(
+                server_names, args.start_date, args.end_date, tag_filters, regions
+            )
+        except ValueError as e:
+            parser.error(str(e))
+        sys.exit(0 if valid else 1)
+
+    widget_templates = []
+    if args.widget_templates:
+        try:
+            widget_templates = load_widget_templates(args.widget_templates)
+        except (OSError, ValueError) as e:
+            parser.error(str(e))
+
+    inputticketnumber = os.environ["ticketnumber"]
+    metric_cache = None if args.no_cache else MetricCache()
+    lookup_cache = None if args.no_cache else LookupCache(account_id=get_account_id())
+    if lookup_cache and args.refresh_lookups:
+        for namespace in EC2_LOOKUP_NAMESPACES:
+            lookup_cache.invalidate(namespace)
+    if lookup_cache and args.refresh_dashboards:
+        for namespace in DASHBOARD_LOOKUP_NAMESPACES:
+            lookup_cache.invalidate(namespace)
+    run_report = RunReport(request_timing=args.request_timing)
+    assessment_results = AssessmentResults()
+
+    if args.use_async:
+        import asyncio
+
+        import async_engine
+
+        asyncio.run(
+            async_engine.run_batch_assessment(
+                server_names,
+                inputticketnumber,
+                args.start_date,
+                args.end_date,
+                metric_cache=metric_cache,
+                lookup_cache=lookup_cache,
+                run_report=run_report,
+                metric_math=args.metric_math,
+                target_percentile=args.target_percentile,
+                adaptive_period=args.adaptive_period,
+                assessment_results=assessment_results,
+                dashboard_update=args.dashboard_update,
+                widget_templates=widget_templates,
+                tag_filters=tag_filters,
+                regions=regions,
+                range_workers=args.range_workers,
+            )
+        )
+    else:
+        run_batch_assessment(
+            server_names,
+            inputticketnumber,
+            args.start_date,
+            args.end_date,
+            metric_cache=metric_cache,
+            lookup_cache=lookup_cache,
+            run_report=run_report,
+            metric_math=args.metric_math,
+            target_percentile=args.target_percentile,
+            adaptive_period=args.adaptive_period,
+            assessment_results=assessment_results,
+            dashboard_update=args.dashboard_update,
+            widget_templates=widget_templates,
+            tag_filters=tag_filters,
+            regions=regions,
+            range_workers=args.range_workers,
+        )
+
+    if metric_cache:
+        metric_cache.evict()
+    run_report.write(args.report or f"run_report_{inputticketnumber}.json")
+    assessment_results.write(
+        args.results or f"assessment_results_{inputticketnumber}.csv"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,123 +1,21 @@
 from datetime import datetime, timedelta
-import boto3
-import json
+import argparse
 import os
-import sys
 
-inputticketnumber = os.environ['ticketnumber']
-inputservername = sys.argv[1]
-inputregion = sys.argv[2]
-target_region = inputregion
-instance_name = inputservername
+from assessment_engine import SeriesJoin, ThresholdSweep, expression_values
+from aws_clients import ClientRegistry
+from dashboard import create_cpu_widget, create_dashboards, create_iops_widget, create_throughput_widget, qcd_dashboard_name, volume_label
+from metric_fetch import IOPS_METRIC_IDS, THROUGHPUT_METRIC_IDS, iter_metric_data_pages
+from volume_inventory import get_instance_id_from_name, get_instance_volumes
 
+# Length of the assessment window, ending now
+DAY_RANGE = 60
 
-# Create a Boto3 session using the loaded credentials
-session = boto3.Session(
-    region_name= target_region
-)
+THRESHOLDS = [0, 500, 1000, 1500, 2000, 2500, 3000, 3500, 4000, 5000, 9000]
+THRESHOLDS_THROUGHPUT = [0, 50, 100, 150, 200, 250, 300, 350, 400]
 
-cloudwatch_data = session.client('cloudwatch')
 
-# Define the time range for the data retrieval (past 2 months)
-day_range = 60
-start_time = datetime.utcnow() - timedelta(days=day_range)
-#start_time = datetime.utcnow() - timedelta(minutes=15)
-end_time = datetime.utcnow()
-print (f"{start_time} to {end_time}")
-
-def get_instance_id_from_name(instance_name):
-    ec2 = session.client('ec2')
-
-    response = ec2.describe_instances(
-        Filters=[
-            {
-                'Name': 'tag:Name',
-                'Values': [instance_name]
-            }
-        ]
-    )
-
-    if 'Reservations' in response:
-        reservations = response['Reservations']
-        if reservations:
-            instances = reservations[0]['Instances']
-            if instances:
-                instance_id = instances[0]['InstanceId']
-                return instance_id
-
-    return None
-
-def get_attached_volumes(instance_id):
-    
-    # Use the session to create an EC2 resource
-    ec2 = session.resource('ec2')
-
-    # Get the instance object
-    instance = ec2.Instance(instance_id)
-
-    # Get all attached volumes
-    attached_volume_ids = [volume.id for volume in instance.volumes.all()]
-    return attached_volume_ids
-
-def create_dashboard(instance_name, widgets):
-    """
-    Create a new CloudWatch dashboard with given widgets.
-    
-    Args:
-    - widgets: List of widget dictionaries.
-    """
-    cloudwatch = session.client('cloudwatch')
-
-    # Define the dashboard body
-    dashboard_body = {
-        'widgets': widgets
-    }
-    dashboard_name = (f"infrasre_qcd_{inputticketnumber}-{instance_name}")
-    dashboard_body_json = json.dumps(dashboard_body)
-
-    # Create the dashboard
-    response = cloudwatch.put_dashboard(
-        DashboardName=dashboard_name,
-        DashboardBody=dashboard_body_json
-    )
-
-    print(f"Dashboard '{dashboard_name}' created successfully!")
-
-def get_volume_info(volume_id):
-    """
-    Get the allocated IOPS and Name tag for an EBS volume.
-
-    Args:
-    - volume_id: The ID of the EBS volume.
-
-    Returns:
-    - A tuple containing the allocated IOPS and Name tag of the EBS volume.
-    """
-    ec2 = session.client('ec2')
-
-    try:
-        response = ec2.describe_volumes(VolumeIds=[volume_id])
-        volumes = response['Volumes']
-        if volumes:
-            volume_info = volumes[0]
-            allocated_iops = volume_info.get('Iops', 'N/A')
-            #allocated_iops = 10
-            allocated_Throughput = volume_info.get('Throughput', 'N/A')
-            volume_type = volume_info['VolumeType']
-            vol_name_tag = None
-            for tag in volume_info.get('Tags', []):
-                if tag['Key'] == 'Name':
-                    vol_name_tag = tag['Value']
-                    break
-            return allocated_iops, allocated_Throughput, vol_name_tag, volume_type
-        else:
-            print(f"No volume found with ID: {volume_id}")
-            return None, None
-    except Exception as e:
-        print(f"Error: {e}")
-        return None, None
-    
-def get_assessment_iops(cloudwatch_data, iops_datapoints, iops_expression_match, volume_id, start_time, end_time, thresholds):
+def get_assessment_iops(cloudwatch_data, allocated_iops, vol_name_tag, volume_id, start_time, end_time, thresholds, day_range):
     metric_queries = [
             {
                 'Id': 'read_ops',
@@ -156,45 +54,28 @@ def get_assessment_iops(cloudwatch_data, iops_datapoints, iops_expression_match,
                 }
             }
         ]
-    response = cloudwatch_data.get_metric_data(
-    MetricDataQueries=metric_queries,
-    StartTime=start_time,
-    EndTime=end_time
-    )
-
-    iops_expression_matches = [0] * len(thresholds)
     iops_expression_matches_percentage = [0] * len(thresholds)
-    projected_threshold = [0] * len(thresholds)
+    projected_threshold = [allocated_iops + threshold for threshold in thresholds]
+    fetch_stats = {'pages': 0, 'datapoints': 0}
+
+    # One sweep answers the allocated and every "add N" limit at once
+    sweep = ThresholdSweep([allocated_iops] + projected_threshold)
+    # Consume the read ops, write ops, and volume idle time pages as they arrive,
+    # matching their datapoints by timestamp
+    series_join = SeriesJoin(IOPS_METRIC_IDS)
+    for page in iter_metric_data_pages(cloudwatch_data, metric_queries, start_time, end_time, fetch_stats):
+        _, block = series_join.add(page)
+
+        sweep.add(expression_values(*block, idle_clamp_from=299, idle_clamp_to=299))
+
+    matches = sweep.matches()
+    iops_datapoints = sweep.datapoints
+    iops_expression_match = matches[0]
+    iops_expression_matches = matches[1:]
+
+    print(f"{vol_name_tag}: Read {fetch_stats['pages']} page(s) and {fetch_stats['datapoints']} IOPS datapoint(s) from CloudWatch.")
+
     for i in range(len(thresholds)):
-        iops_datapoints = 0
-            # Get the metric data for read ops, write ops, and volume idle time
-        for data in zip(response['MetricDataResults'][0]['Timestamps'],
-                        response['MetricDataResults'][0]['Values'],
-                        response['MetricDataResults'][1]['Values'],
-                        response['MetricDataResults'][2]['Values']):
-            timestamp = data[0]
-            read_ops = data[1]
-            write_ops = data[2]
-            volume_idle_time = data[3]
-            if volume_idle_time >= 299 and volume_idle_time <= 300:
-                volume_idle_time = 299
-
-            if read_ops is None or write_ops is None or volume_idle_time is None:
-                continue
-
-            expression_value = (read_ops + write_ops) / (300 - volume_idle_time)
-            iops_datapoints += 1
-            if thresholds[i] == 0:
-                if expression_value >= allocated_iops:
-                    iops_expression_match += 1
-                    
-            else:
-                projected_threshold[i] = allocated_iops + thresholds[i]
-                if expression_value >= projected_threshold[i]:
-                    iops_expression_matches[i] += 1
-
-           
-    
         if thresholds[i] == 0:
             iops_expression_match_percentage = ((iops_expression_match / iops_datapoints)*100)
             print(f"{vol_name_tag} Total datapoints: {iops_datapoints}. There are {iops_expression_match} datapoint(s) greater than or equal to its allocated IOPS {allocated_iops}. This is {iops_expression_match_percentage} percent in the last {day_range} days.")
@@ -204,109 +85,7 @@ def get_assessment_iops(cloudwatch_data, iops_datapoints, iops_expression_match,
             print(f"{vol_name_tag}: Adding {thresholds[i]} IOPS will change the percentage to {iops_expression_matches_percentage[i]:.2f}%.")
 
 
-def create_cpu_widget(instance_id, target_region, instance_name):
-    widget = {
-            "type": "metric",
-                "x": 0,
-                "y": 0,
-                "width": 12,
-                "height": 6,
-                "properties": {
-                    "metrics": [
-                        [ "AWS/EC2", "CPUUtilization", "InstanceId", instance_id ]
-                    ],
-                    "view": "timeSeries",
-                    "stacked": False,
-                    "region": target_region,
-                    "stat": "Maximum",
-                    "period": 300,
-                    "title": f"{instance_name}_{instance_id}_CPU"
-                }
-        }
-    return widget
-
-
-def create_iops_widget(volume_id, target_region, vol_name_tag, volume_type, allocated_iops):
-    widget = {
-            "type": "metric",
-            "x": 0,
-            "y": 0,
-            "width": 12,
-            "height": 6,
-            "properties": {
-                "metrics": [
-                    [{"expression": "(m1+m2)/(300-m3)", "label": "IOPS", "id": "e1"}],
-                    ["AWS/EBS", "VolumeReadOps", "VolumeId", volume_id, {"id": "m1", "visible": False}],
-                    [".", "VolumeWriteOps", ".", ".", {"id": "m2", "visible": False}],
-                    [".", "VolumeIdleTime", ".", ".", {"id": "m3", "visible": False}]
-                ],
-                "view": "timeSeries",
-                "stacked": False,
-                "region": target_region,
-                "stat": "Sum",
-                "period": 300,
-                "title": f"{vol_name_tag}_{volume_type}_IOPS"
-            }
-        }
-    
-    if allocated_iops != "N/A":
-        iops_annotation = {
-            "horizontal": [
-                {
-                    "label": "IOPS",
-                    "value": allocated_iops
-                }
-            ]
-    }
-        widget["properties"]["annotations"] = iops_annotation
-                
-    else:
-        widget["properties"].pop("annotations", None)
-            
-    return widget
-
-
-def create_throughput_widget(volume_id, target_region, vol_name_tag, volume_type, allocated_throughput):
-    widget = {
-            "type": "metric",
-            "x": 0,
-            "y": 0,
-            "width": 12,
-            "height": 6,
-            "properties": {
-                "metrics": [
-                    [{"expression": "(m1+m2)/(300-m3)", "label": "Throughput", "id": "e1"}],
-                    ["AWS/EBS", "VolumeReadBytes", "VolumeId", volume_id, {"id": "m1", "visible": False}],
-                    [".", "VolumeWriteBytes", ".", ".", {"id": "m2", "visible": False}],
-                    [".", "VolumeIdleTime", ".", ".", {"id": "m3", "visible": False}]
-                ],
-                "view": "timeSeries",
-                "stacked": False,
-                "region": target_region,
-                "stat": "Sum",
-                "period": 300,
-                "title": f"{vol_name_tag}_{volume_type}_Throughput"
-            }
-        }
-
-    if allocated_throughput != "N/A":
-            allocated_throughput = allocated_throughput * 1000000
-            throughput_annotation = {
-                "horizontal": [
-                        {
-                            "label": "Throughput",
-                            "value": allocated_throughput
-                        }
-                    ]   
-        }
-            widget["properties"]["annotations"] = throughput_annotation
-    else:
-        widget["properties"].pop("annotations", None)
-    return widget
-
-
-
-def get_assessment_throughput(cloudwatch_data, throughput_datapoints, throughput_expression_match, volume_id, start_time, end_time, thresholds_throughput):
+def get_assessment_throughput(cloudwatch_data, allocated_throughput, vol_name_tag, volume_id, start_time, end_time, thresholds_throughput, day_range):
     metric_queries = [
             {
                 'Id': 'read_bytes',
@@ -345,45 +124,28 @@ def get_assessment_throughput(cloudwatch_data, throughput_datapoints, throughput
                 }
             }
         ]
-    response = cloudwatch_data.get_metric_data(
-    MetricDataQueries=metric_queries,
-    StartTime=start_time,
-    EndTime=end_time
-    )
-    throughput_expression_matches = [0] * len(thresholds_throughput)
     throughput_expression_matches_percentage = [0] * len(thresholds_throughput)
-    projected_threshold = [0] * len(thresholds_throughput)
+    projected_threshold = [(allocated_throughput * 1000000) + (threshold * 1000000) for threshold in thresholds_throughput]
+    fetch_stats = {'pages': 0, 'datapoints': 0}
+
+    # One sweep answers the allocated and every "add N" limit at once
+    sweep = ThresholdSweep([allocated_throughput * 1000000] + projected_threshold)
+    # Consume the read bytes, write bytes, and volume idle time pages as they arrive,
+    # matching their datapoints by timestamp
+    series_join = SeriesJoin(THROUGHPUT_METRIC_IDS)
+    for page in iter_metric_data_pages(cloudwatch_data, metric_queries, start_time, end_time, fetch_stats):
+        _, block = series_join.add(page)
+
+        sweep.add(expression_values(*block, idle_clamp_from=299, idle_clamp_to=299))
+
+    matches = sweep.matches()
+    throughput_datapoints = sweep.datapoints
+    throughput_expression_match = matches[0]
+    throughput_expression_matches = matches[1:]
+
+    print(f"{vol_name_tag}: Read {fetch_stats['pages']} page(s) and {fetch_stats['datapoints']} throughput datapoint(s) from CloudWatch.")
+
     for i in range(len(thresholds_throughput)):
-        throughput_datapoints = 0
-            # Get the metric data for read ops, write ops, and volume idle time
-        for data in zip(response['MetricDataResults'][0]['Timestamps'],
-                        response['MetricDataResults'][0]['Values'],
-                        response['MetricDataResults'][1]['Values'],
-                        response['MetricDataResults'][2]['Values']):
-            timestamp = data[0]
-            read_bytes = data[1]
-            write_bytes = data[2]
-            volume_idle_time = data[3]
-            if volume_idle_time >= 299 and volume_idle_time <= 300:
-                volume_idle_time = 299
-
-            if read_bytes is None or write_bytes is None or volume_idle_time is None:
-                continue
-
-            expression_value = (read_bytes + write_bytes) / (300 - volume_idle_time)
-            throughput_datapoints += 1
-
-            if thresholds_throughput[i] == 0:
-                if expression_value >= (allocated_throughput * 1000000):
-                    throughput_expression_match += 1
-                    
-            else:
-                projected_threshold[i] = (allocated_throughput * 1000000) + (thresholds_throughput[i] * 1000000)
-                if expression_value >= projected_threshold[i]:
-                    throughput_expression_matches[i] += 1
-
-           
-    
         if thresholds_throughput[i] == 0:
             throughput_expression_match_percentage = ((throughput_expression_match / throughput_datapoints)*100)
             print(f"{vol_name_tag} Total datapoints: {throughput_datapoints}. There are {throughput_expression_match} datapoint(s) greater than or equal to its allocated throughput {allocated_throughput}. This is {throughput_expression_match_percentage} percent in the last {day_range} days.")
@@ -393,52 +155,76 @@ def get_assessment_throughput(cloudwatch_data, throughput_datapoints, throughput
             print(f"{vol_name_tag}: Adding {thresholds_throughput[i]} throughput will change the percentage to {throughput_expression_matches_percentage[i]:.2f}%.")
 
 
-#########################################################################
-# Main Action
-instance_id = get_instance_id_from_name(instance_name)
+def run_assessment(ec2, cloudwatch_data, instance_name, target_region, ticketnumber, start_time, end_time, day_range):
+    """
+    Create the dashboard and print the IOPS and throughput assessment of an instance.
 
+    Returns:
+    - The instance ID, or None when no instance has the given name.
+    """
+    instance_id = get_instance_id_from_name(ec2, instance_name)
+
+    if not instance_id:
+        print(f"No instance found with the name '{instance_name}'.")
+        return None
 
-if instance_id:
     print(f"Instance ID of '{instance_name}' is: {instance_id}")
-    attached_volumes = get_attached_volumes(instance_id)
-    widgets=[]
+    attached_volumes = get_instance_volumes(ec2, instance_id)
+    # One row per volume, below the CPU widget
+    widget_rows=[]
 
-    widgets.append(create_cpu_widget(instance_id, target_region, instance_name))
+    widget_rows.append([create_cpu_widget(instance_id, target_region, instance_name)])
 
     print("Attached volumes:")
-    for volume_id in attached_volumes:
-        print(volume_id)
-
-    
-    for volume_id in attached_volumes:
-        iops_datapoints = 0
-        iops_expression_match = 0
-        throughput_datapoints = 0
-        throughput_expression_match = 0
-        allocated_iops, allocated_throughput, vol_name_tag, volume_type = get_volume_info(volume_id)
-        
-        if vol_name_tag:
-            vol_name_tag = f"{vol_name_tag}_{volume_id}"
-            print (vol_name_tag)
-        else:
-            vol_name_tag = f"{instance_name}_{volume_id}"
-            print (vol_name_tag)
+    for volume in attached_volumes:
+        print(volume.volume_id)
+
+    for volume_id, allocated_iops, allocated_throughput, vol_name_tag, volume_type in attached_volumes:
+        vol_name_tag = volume_label(instance_name, volume_id, vol_name_tag)
+        print (vol_name_tag)
 
         #call create IOPS widget
-        widgets.append(create_iops_widget(volume_id, target_region, vol_name_tag, volume_type, allocated_iops))
-        widgets.append(create_throughput_widget(volume_id, target_region, vol_name_tag, volume_type, allocated_throughput))
+        widget_rows.append([
+            create_iops_widget(volume_id, target_region, vol_name_tag, volume_type, allocated_iops),
+            create_throughput_widget(volume_id, target_region, vol_name_tag, volume_type, allocated_throughput)
+        ])
 
-        thresholds = [0, 500, 1000, 1500, 2000, 2500, 3000, 3500, 4000, 5000, 9000]
         if allocated_iops != "N/A":
-            get_assessment_iops(cloudwatch_data, iops_datapoints, iops_expression_match, volume_id, start_time, end_time, thresholds)
+            get_assessment_iops(cloudwatch_data, allocated_iops, vol_name_tag, volume_id, start_time, end_time, THRESHOLDS, day_range)
 
-        thresholds_throughput = [0, 50, 100, 150, 200, 250, 300, 350, 400]
         if allocated_throughput != "N/A":
-            get_assessment_throughput(cloudwatch_data, throughput_datapoints, throughput_expression_match, volume_id, start_time, end_time, thresholds_throughput)
+            get_assessment_throughput(cloudwatch_data, allocated_throughput, vol_name_tag, volume_id, start_time, end_time, THRESHOLDS_THROUGHPUT, day_range)
 
     #Create dashboard from collected widgets
-    create_dashboard(instance_name, widgets)
+    create_dashboards(cloudwatch_data, qcd_dashboard_name(ticketnumber, instance_name), widget_rows)
+    return instance_id
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=f'Create the dashboard and the {DAY_RANGE}-day IOPS and throughput assessment of an instance.')
+    parser.add_argument('servername', help='The Name tag of the instance.')
+    parser.add_argument('region', help='The AWS region of the instance.')
+    args = parser.parse_args(argv)
+
+    inputticketnumber = os.environ['ticketnumber']
+    clients = ClientRegistry(region_name=args.region)
+
+    # Define the time range for the data retrieval (past 2 months)
+    end_time = datetime.utcnow()
+    start_time = end_time - timedelta(days=DAY_RANGE)
+    print (f"{start_time} to {end_time}")
+
+    run_assessment(
+        clients.client('ec2'),
+        clients.client('cloudwatch'),
+        args.servername,
+        args.region,
+        inputticketnumber,
+        start_time,
+        end_time,
+        DAY_RANGE
+    )
 
-else:
-    print(f"No instance found with the name '{instance_name}'.")
 
+if __name__ == '__main__':
+    main()
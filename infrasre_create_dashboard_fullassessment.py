@@ -1,226 +1,165 @@
-from datetime import datetime, timedelta
-import boto3
-import json
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import argparse
+import math
 import os
-import sys
-
-inputticketnumber = os.environ["ticketnumber"]
-inputservername = sys.argv[1]
-inputregion = sys.argv[2]
-start_date = sys.argv[3]
-end_date = sys.argv[4]
-target_region = inputregion
-instance_name = inputservername
-
-
-# Create a Boto3 session using the loaded credentials
-session = boto3.Session(region_name=target_region)
-
-cloudwatch_data = session.client("cloudwatch")
-
-# Define the time range for the data retrieval (past 2 months)
-# day_range = int(input_days)
-# start_time = datetime.utcnow() - timedelta(days=day_range)
-# #start_time = datetime.utcnow() - timedelta(minutes=15)
-# end_time = datetime.utcnow()
-
-# Convert the string inputs to datetime objects, setting times to 00:00 for start and 23:59 for end
-start_time = datetime.strptime(start_date, "%m/%d/%Y")
-start_time = start_time.replace(hour=0, minute=0, second=0)
-
-end_time = datetime.strptime(end_date, "%m/%d/%Y")
-end_time = end_time.replace(hour=23, minute=59, second=59)
-
-# Calculate the number of days between the start and end dates
-day_range = (end_time - start_time).days + 1  # Add 1 to include both start and end days
-
-print(f"{start_time} to {end_time}")
-
-
-def get_instance_id_from_name(instance_name):
-    ec2 = session.client("ec2")
-
-    response = ec2.describe_instances(
-        Filters=[{"Name": "tag:Name", "Values": [instance_name]}]
-    )
-
-    if "Reservations" in response:
-        reservations = response["Reservations"]
-        if reservations:
-            instances = reservations[0]["Instances"]
-            if instances:
-                instance_id = instances[0]["InstanceId"]
-                return instance_id
-
-    return None
-
-
-def get_attached_volumes(instance_id):
-
-    # Use the session to create an EC2 resource
-    ec2 = session.resource("ec2")
-
-    # Get the instance object
-    instance = ec2.Instance(instance_id)
-
-    # Get all attached volumes
-    attached_volume_ids = [volume.id for volume in instance.volumes.all()]
-    return attached_volume_ids
-
-
-def create_dashboard(instance_name, widgets):
+import time
+
+from assessment_engine import (
+    ExpressionCheck,
+    QuantileSketch,
+    SeriesJoin,
+    ThresholdSweep,
+    drop_missing,
+    expression_values,
+)
+from assessment_results import RESULT_FORMATS, AssessmentResults, threshold_results
+from aws_clients import ClientRegistry, get_account_id, pool_connections
+from dashboard import (
+    DASHBOARD_UPDATE_MODES,
+    create_cpu_widget,
+    create_dashboards,
+    create_iops_widget,
+    create_template_widgets,
+    create_throughput_widget,
+    qcd_dashboard_name,
+    volume_label,
+)
+from lookup_cache import (
+    DASHBOARD_LOOKUP_NAMESPACES,
+    EC2_LOOKUP_NAMESPACES,
+    LookupCache,
+)
+from metric_cache import MetricCache, iter_cached_volume_metric_pages
+from metric_fetch import (
+    IOPS_METRIC_IDS,
+    THROUGHPUT_METRIC_IDS,
+    VOLUME_EXPRESSIONS,
+    iter_volume_metric_pages,
+    local_metric_ids,
+    page_values,
+    plan_periods,
+    split_volume_metric_ids,
+)
+from run_report import RunReport, report_phase
+from volume_inventory import get_instance_id_from_name, get_instance_volumes
+from widget_templates import load_widget_templates
+
+# Number of volume groups fetched and assessed in parallel for one instance
+VOLUME_WORKERS = 4
+
+# Number of sub-ranges of a long time range fetched in parallel per request
+RANGE_WORKERS = 4
+
+THRESHOLDS = [0, 500, 1000, 1500, 2000, 2500, 3000, 3500, 4000, 5000, 9000]
+THRESHOLDS_THROUGHPUT = [0, 50, 100, 150, 200, 250, 300, 350, 400]
+
+# Percentiles printed for every volume
+PERCENTILES = [50, 90, 99, 99.9]
+
+# Percentile of the datapoints the recommended allocation covers
+TARGET_PERCENTILE = 99
+
+# Where the (read + write) / (period - idle) expressions are computed:
+# - "local": from the raw series.
+# - "server": by CloudWatch with metric math, so one series per assessment
+#   comes back instead of three.
+# - "check": by CloudWatch, and compared with the local result computed
+#   from the raw series fetched in the same requests.
+METRIC_MATH_MODES = ("local", "server", "check")
+
+# Errors with which CloudWatch rejects a metric math expression
+METRIC_MATH_ERROR_CODES = {
+    "ValidationError",
+    "InvalidParameterValue",
+    "InvalidParameterCombination",
+}
+
+
+def get_date_range(start_date, end_date):
     """
-    Create a new CloudWatch dashboard with given widgets.
+    Convert the MM/DD/YYYY inputs to the assessment time range.
 
     Args:
-    - widgets: List of widget dictionaries.
+    - start_date: The first day of the range.
+    - end_date: The last day of the range.
+
+    Returns:
+    - A tuple containing the start time (00:00:00), end time (23:59:59) and the
+      number of days covered, including both start and end days.
     """
-    cloudwatch = session.client("cloudwatch")
+    # Convert the string inputs to datetime objects, setting times to 00:00 for start and 23:59 for end
+    start_time = datetime.strptime(start_date, "%m/%d/%Y")
+    start_time = start_time.replace(hour=0, minute=0, second=0)
 
-    # Define the dashboard body
-    dashboard_body = {"widgets": widgets}
-    dashboard_name = f"infrasre_qcd_{inputticketnumber}-{instance_name}"
-    dashboard_body_json = json.dumps(dashboard_body)
+    end_time = datetime.strptime(end_date, "%m/%d/%Y")
+    end_time = end_time.replace(hour=23, minute=59, second=59)
 
-    # Create the dashboard
-    response = cloudwatch.put_dashboard(
-        DashboardName=dashboard_name, DashboardBody=dashboard_body_json
-    )
+    # Calculate the number of days between the start and end dates
+    day_range = (
+        end_time - start_time
+    ).days + 1  # Add 1 to include both start and end days
 
-    print(f"Dashboard '{dashboard_name}' created successfully!")
+    return start_time, end_time, day_range
 
 
-def get_volume_info(volume_id):
+def create_iops_sweep(allocated_iops, thresholds):
     """
-    Get the allocated IOPS and Name tag for an EBS volume.
+    Create the threshold sweep for the IOPS assessment of a volume.
 
     Args:
-    - volume_id: The ID of the EBS volume.
+    - allocated_iops: The allocated IOPS of the volume.
+    - thresholds: List of IOPS amounts to add to and decrease from the allocation.
 
     Returns:
-    - A tuple containing the allocated IOPS and Name tag of the EBS volume.
-    """
-    ec2 = session.client("ec2")
-
-    try:
-        response = ec2.describe_volumes(VolumeIds=[volume_id])
-        volumes = response["Volumes"]
-        if volumes:
-            volume_info = volumes[0]
-            allocated_iops = volume_info.get("Iops", "N/A")
-            # allocated_iops = 10
-            allocated_Throughput = volume_info.get("Throughput", "N/A")
-            volume_type = volume_info["VolumeType"]
-            vol_name_tag = None
-            for tag in volume_info.get("Tags", []):
-                if tag["Key"] == "Name":
-                    vol_name_tag = tag["Value"]
-                    break
-            return allocated_iops, allocated_Throughput, vol_name_tag, volume_type
-        else:
-            print(f"No volume found with ID: {volume_id}")
-            return None, None
-    except Exception as e:
-        print(f"Error: {e}")
-        return None, None
+    - A ThresholdSweep over the allocated, "add N" and "decrease N" limits.
+    """
+    projected_threshold = [allocated_iops + threshold for threshold in thresholds]
+    costsaving_threshold = [allocated_iops - threshold for threshold in thresholds]
+    return ThresholdSweep([allocated_iops] + projected_threshold + costsaving_threshold)
+
+
+def add_iops_page(
+    iops_sweep, page, iops_sketch=None, period=300, weight=1, iops_join=None
+):
+    # Without a join carried over between pages, the page is joined alone
+    iops_join = iops_join or SeriesJoin(IOPS_METRIC_IDS)
+    _, iops_block = iops_join.add(page)
+
+    iops_values = expression_values(*iops_block, period)
+    iops_sweep.add(iops_values, weight)
+    if iops_sketch:
+        iops_sketch.add(iops_values, weight)
 
 
 def get_assessment_iops(
     allocated_iops,
-    cloudwatch_data,
-    iops_datapoints,
-    iops_expression_match,
-    volume_id,
-    start_time,
-    end_time,
+    iops_sweep,
+    vol_name_tag,
     thresholds,
+    day_range,
 ):
-    metric_queries = [
-        {
-            "Id": "read_ops",
-            "MetricStat": {
-                "Metric": {
-                    "Namespace": "AWS/EBS",
-                    "MetricName": "VolumeReadOps",
-                    "Dimensions": [{"Name": "VolumeId", "Value": volume_id}],
-                },
-                "Period": 300,
-                "Stat": "Sum",
-            },
-        },
-        {
-            "Id": "write_ops",
-            "MetricStat": {
-                "Metric": {
-                    "Namespace": "AWS/EBS",
-                    "MetricName": "VolumeWriteOps",
-                    "Dimensions": [{"Name": "VolumeId", "Value": volume_id}],
-                },
-                "Period": 300,
-                "Stat": "Sum",
-            },
-        },
-        {
-            "Id": "idle_time",
-            "MetricStat": {
-                "Metric": {
-                    "Namespace": "AWS/EBS",
-                    "MetricName": "VolumeIdleTime",
-                    "Dimensions": [{"Name": "VolumeId", "Value": volume_id}],
-                },
-                "Period": 300,
-                "Stat": "Sum",
-            },
-        },
-    ]
-    response = cloudwatch_data.get_metric_data(
-        MetricDataQueries=metric_queries, StartTime=start_time, EndTime=end_time
-    )
+    """
+    Print the IOPS recommendations of a volume.
 
-    iops_expression_matches = [0] * len(thresholds)
-    iops_expression_matches_saving = [0] * len(thresholds)
+    Returns:
+    - The per-threshold results (see assessment_results.threshold_results),
+      or an empty list when the volume has no datapoints.
+    """
     iops_expression_matches_percentage = [0] * len(thresholds)
     iops_expression_matches_saving_percentage = [0] * len(thresholds)
-    projected_threshold = [0] * len(thresholds)
-    costsaving_threshold = [0] * len(thresholds)
-    for i in range(len(thresholds)):
-        iops_datapoints = 0
-        # Get the metric data for read ops, write ops, and volume idle time
-        for data in zip(
-            response["MetricDataResults"][0]["Timestamps"],
-            response["MetricDataResults"][0]["Values"],
-            response["MetricDataResults"][1]["Values"],
-            response["MetricDataResults"][2]["Values"],
-        ):
-            timestamp = data[0]
-            read_ops = data[1]
-            write_ops = data[2]
-            volume_idle_time = data[3]
 
-            if volume_idle_time >= 300:
-                volume_idle_time = 299.999999999
-
-            if read_ops is None or write_ops is None or volume_idle_time is None:
-                continue
+    matches = iops_sweep.matches()
+    iops_datapoints = iops_sweep.datapoints
+    iops_expression_match = matches[0]
+    iops_expression_matches = matches[1 : len(thresholds) + 1]
+    iops_expression_matches_saving = matches[len(thresholds) + 1 :]
 
-            expression_value = (read_ops + write_ops) / (300 - volume_idle_time)
-            iops_datapoints += 1
-            if thresholds[i] == 0:
-                if expression_value >= allocated_iops:
-                    iops_expression_match += 1
-
-            else:
-                projected_threshold[i] = allocated_iops + thresholds[i]
-                if expression_value >= projected_threshold[i]:
-                    iops_expression_matches[i] += 1
-                costsaving_threshold[i] = allocated_iops - thresholds[i]
-                if expression_value >= costsaving_threshold[i]:
-                    iops_expression_matches_saving[i] += 1
-                    
-        if iops_datapoints == 0:
-            print ("Unable to make recommendations. IOPS datapoints is 0.")
-            break
+    if iops_datapoints == 0:
+        print("Unable to make recommendations. IOPS datapoints is 0.")
+        return []
 
+    for i in range(len(thresholds)):
         if thresholds[i] == 0:
             iops_expression_match_percentage = (
                 iops_expression_match / iops_datapoints
@@ -254,210 +193,90 @@ def get_assessment_iops(
                     f"{vol_name_tag}: Decreasing {thresholds[i]} IOPS will change the percentage to {iops_expression_matches_saving_percentage[i]:.2f}%."
                 )
 
-
-def create_cpu_widget(instance_id, target_region, instance_name):
-    widget = {
-        "type": "metric",
-        "x": 0,
-        "y": 0,
-        "width": 12,
-        "height": 6,
-        "properties": {
-            "metrics": [["AWS/EC2", "CPUUtilization", "InstanceId", instance_id]],
-            "view": "timeSeries",
-            "stacked": False,
-            "region": target_region,
-            "stat": "Maximum",
-            "period": 300,
-            "title": f"{instance_name}_{instance_id}_CPU",
-        },
-    }
-    return widget
+    return threshold_results(
+        allocated_iops,
+        matches,
+        iops_datapoints,
+        thresholds,
+        3000,
+        16000,
+    )
 
 
-def create_iops_widget(
-    volume_id, target_region, vol_name_tag, volume_type, allocated_iops
-):
-    widget = {
-        "type": "metric",
-        "x": 0,
-        "y": 0,
-        "width": 12,
-        "height": 6,
-        "properties": {
-            "metrics": [
-                [{"expression": "(m1+m2)/(300-m3)", "label": "IOPS", "id": "e1"}],
-                [
-                    "AWS/EBS",
-                    "VolumeReadOps",
-                    "VolumeId",
-                    volume_id,
-                    {"id": "m1", "visible": False},
-                ],
-                [".", "VolumeWriteOps", ".", ".", {"id": "m2", "visible": False}],
-                [".", "VolumeIdleTime", ".", ".", {"id": "m3", "visible": False}],
-            ],
-            "view": "timeSeries",
-            "stacked": False,
-            "region": target_region,
-            "stat": "Sum",
-            "period": 300,
-            "title": f"{vol_name_tag}_{volume_type}_IOPS",
-        },
-    }
-
-    if allocated_iops != "N/A":
-        iops_annotation = {"horizontal": [{"label": "IOPS", "value": allocated_iops}]}
-        widget["properties"]["annotations"] = iops_annotation
+def create_throughput_sweep(allocated_throughput, thresholds_throughput):
+    """
+    Create the threshold sweep for the throughput assessment of a volume.
 
-    else:
-        widget["properties"].pop("annotations", None)
+    Args:
+    - allocated_throughput: The allocated throughput of the volume in MiB/s.
+    - thresholds_throughput: List of throughput amounts to add to and decrease
+      from the allocation.
 
-    return widget
+    Returns:
+    - A ThresholdSweep over the allocated, "add N" and "decrease N" limits.
+    """
+    projected_threshold = [
+        (allocated_throughput * 1000000) + (threshold * 1000000)
+        for threshold in thresholds_throughput
+    ]
+    savings_projected_threshold = [
+        (allocated_throughput * 1000000) - (threshold * 1000000)
+        for threshold in thresholds_throughput
+    ]
+    return ThresholdSweep(
+        [allocated_throughput * 1000000]
+        + projected_threshold
+        + savings_projected_threshold
+    )
 
 
-def create_throughput_widget(
-    volume_id, target_region, vol_name_tag, volume_type, allocated_throughput
+def add_throughput_page(
+    throughput_sweep,
+    page,
+    throughput_sketch=None,
+    period=300,
+    weight=1,
+    throughput_join=None,
 ):
-    widget = {
-        "type": "metric",
-        "x": 0,
-        "y": 0,
-        "width": 12,
-        "height": 6,
-        "properties": {
-            "metrics": [
-                [{"expression": "(m1+m2)/(300-m3)", "label": "Throughput", "id": "e1"}],
-                [
-                    "AWS/EBS",
-                    "VolumeReadBytes",
-                    "VolumeId",
-                    volume_id,
-                    {"id": "m1", "visible": False},
-                ],
-                [".", "VolumeWriteBytes", ".", ".", {"id": "m2", "visible": False}],
-                [".", "VolumeIdleTime", ".", ".", {"id": "m3", "visible": False}],
-            ],
-            "view": "timeSeries",
-            "stacked": False,
-            "region": target_region,
-            "stat": "Sum",
-            "period": 300,
-            "title": f"{vol_name_tag}_{volume_type}_Throughput",
-        },
-    }
+    # Without a join carried over between pages, the page is joined alone
+    throughput_join = throughput_join or SeriesJoin(THROUGHPUT_METRIC_IDS)
+    _, throughput_block = throughput_join.add(page)
 
-    if allocated_throughput != "N/A":
-        allocated_throughput = allocated_throughput * 1000000
-        throughput_annotation = {
-            "horizontal": [{"label": "Throughput", "value": allocated_throughput}]
-        }
-        widget["properties"]["annotations"] = throughput_annotation
-    else:
-        widget["properties"].pop("annotations", None)
-    return widget
+    throughput_values = expression_values(*throughput_block, period)
+    throughput_sweep.add(throughput_values, weight)
+    if throughput_sketch:
+        throughput_sketch.add(throughput_values, weight)
 
 
 def get_assessment_throughput(
     allocated_throughput,
-    cloudwatch_data,
-    throughput_datapoints,
-    throughput_expression_match,
-    volume_id,
-    start_time,
-    end_time,
+    throughput_sweep,
+    vol_name_tag,
     thresholds_throughput,
+    day_range,
 ):
-    metric_queries = [
-        {
-            "Id": "read_bytes",
-            "MetricStat": {
-                "Metric": {
-                    "Namespace": "AWS/EBS",
-                    "MetricName": "VolumeReadBytes",
-                    "Dimensions": [{"Name": "VolumeId", "Value": volume_id}],
-                },
-                "Period": 300,
-                "Stat": "Sum",
-            },
-        },
-        {
-            "Id": "write_bytes",
-            "MetricStat": {
-                "Metric": {
-                    "Namespace": "AWS/EBS",
-                    "MetricName": "VolumeWriteBytes",
-                    "Dimensions": [{"Name": "VolumeId", "Value": volume_id}],
-                },
-                "Period": 300,
-                "Stat": "Sum",
-            },
-        },
-        {
-            "Id": "idle_time",
-            "MetricStat": {
-                "Metric": {
-                    "Namespace": "AWS/EBS",
-                    "MetricName": "VolumeIdleTime",
-                    "Dimensions": [{"Name": "VolumeId", "Value": volume_id}],
-                },
-                "Period": 300,
-                "Stat": "Sum",
-            },
-        },
-    ]
-    response = cloudwatch_data.get_metric_data(
-        MetricDataQueries=metric_queries, StartTime=start_time, EndTime=end_time
-    )
-    throughput_expression_matches = [0] * len(thresholds_throughput)
+    """
+    Print the throughput recommendations of a volume.
+
+    Returns:
+    - The per-threshold results in MiB/s (see
+      assessment_results.threshold_results), or an empty list when the
+      volume has no datapoints.
+    """
     throughput_expression_matches_percentage = [0] * len(thresholds_throughput)
-    projected_threshold = [0] * len(thresholds_throughput)
-    savings_throughput_expression_matches = [0] * len(thresholds_throughput)
     savings_throughput_expression_matches_percentage = [0] * len(thresholds_throughput)
-    savings_projected_threshold = [0] * len(thresholds_throughput)
-    for i in range(len(thresholds_throughput)):
-        throughput_datapoints = 0
-        # Get the metric data for read ops, write ops, and volume idle time
-        for data in zip(
-            response["MetricDataResults"][0]["Timestamps"],
-            response["MetricDataResults"][0]["Values"],
-            response["MetricDataResults"][1]["Values"],
-            response["MetricDataResults"][2]["Values"],
-        ):
-            timestamp = data[0]
-            read_bytes = data[1]
-            write_bytes = data[2]
-            volume_idle_time = data[3]
-
-            if volume_idle_time >= 300:
-                volume_idle_time = 299.999999999
-
-            if read_bytes is None or write_bytes is None or volume_idle_time is None:
-                continue
 
-            expression_value = (read_bytes + write_bytes) / (300 - volume_idle_time)
-            throughput_datapoints += 1
+    matches = throughput_sweep.matches()
+    throughput_datapoints = throughput_sweep.datapoints
+    throughput_expression_match = matches[0]
+    throughput_expression_matches = matches[1 : len(thresholds_throughput) + 1]
+    savings_throughput_expression_matches = matches[len(thresholds_throughput) + 1 :]
 
-            if thresholds_throughput[i] == 0:
-                if expression_value >= (allocated_throughput * 1000000):
-                    throughput_expression_match += 1
+    if throughput_datapoints == 0:
+        print("Unable to make recommendations. Throughput datapoints is 0.")
+        return []
 
-            else:
-                projected_threshold[i] = (allocated_throughput * 1000000) + (
-                    thresholds_throughput[i] * 1000000
-                )
-                if expression_value >= projected_threshold[i]:
-                    throughput_expression_matches[i] += 1
-                savings_projected_threshold[i] = (allocated_throughput * 1000000) - (
-                    thresholds_throughput[i] * 1000000
-                )
-                if expression_value >= savings_projected_threshold[i]:
-                    savings_throughput_expression_matches[i] += 1
-
-        if throughput_datapoints == 0:
-            print ("Unable to make recommendations. Throughput datapoints is 0.")
-            break
-        
+    for i in range(len(thresholds_throughput)):
         if thresholds_throughput[i] == 0:
             throughput_expression_match_percentage = (
                 throughput_expression_match / throughput_datapoints
@@ -491,83 +310,871 @@ def get_assessment_throughput(
                     f"{vol_name_tag}: Decreasing {thresholds_throughput[i]} throughput will change the percentage to {savings_throughput_expression_matches_percentage[i]:.2f}%."
                 )
 
+    return threshold_results(
+        allocated_throughput,
+        matches,
+        throughput_datapoints,
+        thresholds_throughput,
+        125,
+        1000,
+    )
 
-#########################################################################
-# Main Action
-instance_id = get_instance_id_from_name(instance_name)
-
-
-if instance_id:
-    print(f"Instance ID of '{instance_name}' is: {instance_id}")
-    attached_volumes = get_attached_volumes(instance_id)
-    widgets = []
 
-    widgets.append(create_cpu_widget(instance_id, target_region, instance_name))
+def prepare_volume_assessments(
+    instance_name,
+    instance_id,
+    target_region,
+    attached_volumes,
+    metric_math="local",
+    widget_templates=(),
+):
+    """
+    Build the dashboard widgets and the assessment sweeps of an instance's volumes.
 
-    print("Attached volumes:")
-    for volume_id in attached_volumes:
-        print(volume_id)
-
-    for volume_id in attached_volumes:
-        iops_datapoints = 0
-        iops_expression_match = 0
-        throughput_datapoints = 0
-        throughput_expression_match = 0
-        allocated_iops, allocated_throughput, vol_name_tag, volume_type = (
-            get_volume_info(volume_id)
-        )
+    Args:
+    - instance_name: The Name tag of the instance.
+    - instance_id: The ID of the instance.
+    - target_region: The AWS region of the instance.
+    - attached_volumes: List of VolumeRecord tuples.
+    - metric_math: One of METRIC_MATH_MODES.
+    - widget_templates: List of WidgetTemplate rendered for every volume,
+      after its IOPS and throughput widgets.
 
-        if vol_name_tag:
-            vol_name_tag = f"{vol_name_tag}_{volume_id}"
-            print(vol_name_tag)
-        else:
-            vol_name_tag = f"{instance_name}_{volume_id}"
-            print(vol_name_tag)
+    Returns:
+    - A dictionary with the "instance_name", "instance_id" and
+      "target_region", the "widget_rows" of the dashboard (the CPU widget,
+      then one row per volume), the
+      "volume_metric_ids" to fetch, the "volumes" to report as
+      (volume_id, vol_name_tag, allocated_iops, allocated_throughput,
+      volume_type) tuples,
+      and the "iops_sweeps", "throughput_sweeps", their QuantileSketch
+      "iops_sketches" and "throughput_sketches", the SeriesJoin
+      "iops_joins" and "throughput_joins" of their input series, and the
+      processed "datapoints", keyed by volume ID. The "server_math" set holds the volumes whose
+      expressions CloudWatch computes, and "math_checks" the ExpressionCheck
+      of each (volume_id, expression id) in "check" mode.
+    """
+    widget_rows = []
+
+    widget_rows.append([create_cpu_widget(instance_id, target_region, instance_name)])
+
+    volume_assessments = []
+    volume_metric_ids = []
+    iops_sweeps = {}
+    throughput_sweeps = {}
+    iops_sketches = {}
+    throughput_sketches = {}
+    iops_joins = {}
+    throughput_joins = {}
+    server_math = set()
+    math_checks = {}
+
+    for (
+        volume_id,
+        allocated_iops,
+        allocated_throughput,
+        vol_name_tag,
+        volume_type,
+    ) in attached_volumes:
+        vol_name_tag = volume_label(instance_name, volume_id, vol_name_tag)
+        print(vol_name_tag)
 
         # call create IOPS widget
-        widgets.append(
-            create_iops_widget(
-                volume_id, target_region, vol_name_tag, volume_type, allocated_iops
-            )
-        )
-        widgets.append(
-            create_throughput_widget(
+        widget_rows.append(
+            [
+                create_iops_widget(
+                    volume_id, target_region, vol_name_tag, volume_type, allocated_iops
+                ),
+                create_throughput_widget(
+                    volume_id,
+                    target_region,
+                    vol_name_tag,
+                    volume_type,
+                    allocated_throughput,
+                ),
+            ]
+            + create_template_widgets(
+                widget_templates,
+                instance_name,
+                instance_id,
                 volume_id,
                 target_region,
                 vol_name_tag,
                 volume_type,
+                allocated_iops,
                 allocated_throughput,
             )
         )
 
-        thresholds = [0, 500, 1000, 1500, 2000, 2500, 3000, 3500, 4000, 5000, 9000]
+        metric_ids = []
+        if allocated_iops != "N/A":
+            iops_sweeps[volume_id] = create_iops_sweep(allocated_iops, THRESHOLDS)
+            iops_sketches[volume_id] = QuantileSketch()
+            iops_joins[volume_id] = SeriesJoin(IOPS_METRIC_IDS)
+            metric_ids.extend(IOPS_METRIC_IDS)
+        if allocated_throughput != "N/A":
+            throughput_sweeps[volume_id] = create_throughput_sweep(
+                allocated_throughput, THRESHOLDS_THROUGHPUT
+            )
+            throughput_sketches[volume_id] = QuantileSketch()
+            throughput_joins[volume_id] = SeriesJoin(THROUGHPUT_METRIC_IDS)
+            metric_ids.extend(THROUGHPUT_METRIC_IDS)
+
+        if metric_math != "local" and metric_ids:
+            expression_ids = []
+            if volume_id in iops_sweeps:
+                expression_ids.append("iops")
+            if volume_id in throughput_sweeps:
+                expression_ids.append("throughput")
+            if metric_math == "server":
+                metric_ids = expression_ids
+            else:
+                metric_ids = list(dict.fromkeys(metric_ids)) + expression_ids
+                for expression_id in expression_ids:
+                    math_checks[(volume_id, expression_id)] = ExpressionCheck(
+                        expression_id, VOLUME_EXPRESSIONS[expression_id]
+                    )
+            server_math.add(volume_id)
+
+        volume_metric_ids.append((volume_id, metric_ids))
+        volume_assessments.append(
+            (volume_id, vol_name_tag, allocated_iops, allocated_throughput, volume_type)
+        )
+
+    return {
+        "instance_name": instance_name,
+        "instance_id": instance_id,
+        "target_region": target_region,
+        "widget_rows": widget_rows,
+        "volume_metric_ids": volume_metric_ids,
+        "volumes": volume_assessments,
+        "iops_sweeps": iops_sweeps,
+        "throughput_sweeps": throughput_sweeps,
+        "iops_sketches": iops_sketches,
+        "throughput_sketches": throughput_sketches,
+        "iops_joins": iops_joins,
+        "throughput_joins": throughput_joins,
+        "datapoints": {volume_id: 0 for volume_id, _ in volume_metric_ids},
+        "server_math": server_math,
+        "math_checks": math_checks,
+    }
+
+
+def add_volume_page(assessment, volume_id, page, period=300, weight=1):
+    """
+    Feed one page of a volume's series to its sweeps and sketches.
+
+    Args:
+    - assessment: The dictionary returned by prepare_volume_assessments.
+    - volume_id: The ID of the volume.
+    - page: The volume's MetricDataResults, keyed by metric id.
+    - period: The period of the page's datapoints in seconds.
+    - weight: How many datapoints each of the page's datapoints counts as.
+    """
+    assessment["datapoints"][volume_id] += sum(
+        len(result["Values"]) for result in page.values()
+    )
+    if volume_id in assessment["server_math"]:
+        for expression_id, sweeps, sketches in (
+            ("iops", assessment["iops_sweeps"], assessment["iops_sketches"]),
+            (
+                "throughput",
+                assessment["throughput_sweeps"],
+                assessment["throughput_sketches"],
+            ),
+        ):
+            if volume_id in sweeps:
+                _, values = page_values(page, expression_id)
+                values = drop_missing(values)
+                sweeps[volume_id].add(values, weight)
+                sketches[volume_id].add(values, weight)
+            math_check = assessment["math_checks"].get((volume_id, expression_id))
+            if math_check:
+                math_check.add(page, period)
+        return
+
+    if volume_id in assessment["iops_sweeps"]:
+        add_iops_page(
+            assessment["iops_sweeps"][volume_id],
+            page,
+            assessment["iops_sketches"][volume_id],
+            period,
+            weight,
+            assessment["iops_joins"][volume_id],
+        )
+    if volume_id in assessment["throughput_sweeps"]:
+        add_throughput_page(
+            assessment["throughput_sweeps"][volume_id],
+            page,
+            assessment["throughput_sketches"][volume_id],
+            period,
+            weight,
+            assessment["throughput_joins"][volume_id],
+        )
+
+
+def end_volume_pages(assessment, volume_metric_ids):
+    """
+    Drop the datapoints the volumes' joins still carry over, at the end of a
+    time range. They are missing from some of the series.
+    """
+    for volume_id, _ in volume_metric_ids:
+        for joins in (assessment["iops_joins"], assessment["throughput_joins"]):
+            if volume_id in joins:
+                joins[volume_id].reset()
+
+
+def compute_locally(assessment, group_metric_ids):
+    """
+    Switch the volumes of a group from server-side to local metric math
+    after CloudWatch rejected the expressions, and reset what they counted
+    so far.
+
+    Returns:
+    - The group's volume_metric_ids with the raw metric ids only.
+    """
+    for volume_id, _ in group_metric_ids:
+        assessment["server_math"].discard(volume_id)
+        assessment["datapoints"][volume_id] = 0
+        for summaries in (
+            assessment["iops_sweeps"],
+            assessment["throughput_sweeps"],
+            assessment["iops_sketches"],
+            assessment["throughput_sketches"],
+            assessment["iops_joins"],
+            assessment["throughput_joins"],
+        ):
+            if volume_id in summaries:
+                summaries[volume_id].reset()
+        for expression_id in ("iops", "throughput"):
+            assessment["math_checks"].pop((volume_id, expression_id), None)
+    return [
+        (volume_id, local_metric_ids(metric_ids))
+        for volume_id, metric_ids in group_metric_ids
+    ]
+
+
+def plan_resolutions(assessment, start_time, end_time, adaptive_period):
+    """
+    Pick the period of every part of the time range.
+
+    Returns:
+    - A tuple containing the list of (range_start, range_end, period) tuples
+      and the period datapoints are weighted in units of.
+    """
+    if not adaptive_period:
+        return [(start_time, end_time, 300)], 300
+
+    resolutions = plan_periods(start_time, end_time)
+    assessment["resolutions"] = resolutions
+    weight_period = min((period for _, _, period in resolutions if period), default=300)
+    return resolutions, weight_period
+
+
+def fetch_volume_sweeps(
+    cloudwatch_data,
+    assessment,
+    start_time,
+    end_time,
+    volume_workers,
+    metric_cache=None,
+    adaptive_period=False,
+    range_workers=RANGE_WORKERS,
+):
+    """
+    Fetch the volumes' metrics and feed every page to the volume's sweeps.
+
+    The volumes are split into up to volume_workers groups that are fetched
+    and assessed in parallel. Each volume belongs to exactly one group, so
+    each sweep is only updated by one worker. Within a group, a request
+    that spans several pages is split into up to range_workers sub-ranges
+    fetched in parallel, whose pages are fed in chronological order (see
+    metric_fetch.iter_volume_metric_pages).
+
+    With a metric_cache, only the time ranges that are not cached yet are
+    fetched from CloudWatch.
+
+    When CloudWatch rejects a group's metric math expressions, the group is
+    fetched again with the raw series and its expressions are computed
+    locally.
+
+    With adaptive_period, every part of the time range is fetched at the
+    finest period CloudWatch still keeps for it (see
+    metric_fetch.plan_periods). Each datapoint is weighted by its period,
+    in units of the finest period used, and the plan is stored in the
+    assessment's "resolutions" as (range_start, range_end, period) tuples.
+    Otherwise the whole range is fetched at 300 seconds.
+
+    Returns:
+    - A dictionary with the number of query "batches", "pages" and
+      "datapoints" read, plus the number of "cached" datapoints served when a
+      metric_cache is used, and the number of "math_fallbacks" volumes when
+      server-side metric math is used.
+    """
+    fetch_stats = {"batches": 0, "pages": 0, "datapoints": 0}
+    if metric_cache:
+        fetch_stats["cached"] = 0
+    if assessment["server_math"]:
+        from botocore.exceptions import ClientError
+
+        fetch_stats["math_fallbacks"] = 0
+
+    resolutions, weight_period = plan_resolutions(
+        assessment, start_time, end_time, adaptive_period
+    )
+
+    def add_group_pages(group_metric_ids, group_stats):
+        for range_start, range_end, period in resolutions:
+            if not period:
+                continue
+            if metric_cache:
+                volume_pages = iter_cached_volume_metric_pages(
+                    cloudwatch_data,
+                    group_metric_ids,
+                    range_start,
+                    range_end,
+                    metric_cache,
+                    group_stats,
+                    period,
+                    range_workers,
+                )
+            else:
+                volume_pages = iter_volume_metric_pages(
+                    cloudwatch_data,
+                    group_metric_ids,
+                    range_start,
+                    range_end,
+                    group_stats,
+                    period,
+                    range_workers,
+                )
+            for volume_id, page in volume_pages:
+                add_volume_page(
+                    assessment, volume_id, page, period, period // weight_period
+                )
+            end_volume_pages(assessment, group_metric_ids)
+
+    def fetch_group(group_metric_ids):
+        group_stats = dict.fromkeys(fetch_stats, 0)
+        if "math_fallbacks" not in fetch_stats:
+            add_group_pages(group_metric_ids, group_stats)
+            return group_stats
+
+        try:
+            add_group_pages(group_metric_ids, group_stats)
+        except ClientError as e:
+            error_code = e.response.get("Error", {}).get("Code")
+            if error_code not in METRIC_MATH_ERROR_CODES:
+                raise
+            group_stats["math_fallbacks"] += sum(
+                volume_id in assessment["server_math"]
+                for volume_id, _ in group_metric_ids
+            )
+            add_group_pages(compute_locally(assessment, group_metric_ids), group_stats)
+        return group_stats
+
+    groups = split_volume_metric_ids(assessment["volume_metric_ids"], volume_workers)
+    if not groups:
+        return fetch_stats
+
+    with ThreadPoolExecutor(max_workers=len(groups)) as executor:
+        for group_stats in executor.map(fetch_group, groups):
+            for key in fetch_stats:
+                fetch_stats[key] += group_stats[key]
+
+    return fetch_stats
+
+
+def print_resolutions(assessment):
+    """
+    Print the period that backed each part of the time range, when it was
+    picked adaptively.
+    """
+    resolutions = assessment.get("resolutions")
+    if not resolutions:
+        return
+
+    periods = set()
+    for range_start, range_end, period in resolutions:
+        time_range = f"{range_start:%Y-%m-%d %H:%M:%S} to {range_end:%Y-%m-%d %H:%M:%S}"
+        if period:
+            periods.add(period)
+            print(f"{time_range}: {period}-second datapoints.")
+        else:
+            print(f"{time_range}: No datapoints, CloudWatch no longer keeps them.")
+    if len(periods) > 1:
+        print(
+            f"Datapoints are counted in {min(periods)}-second units, so coarser datapoints count once per {min(periods)} seconds they cover."
+        )
+
+
+def print_math_checks(assessment):
+    """
+    Print how the server-side expressions compare with the local ones, in
+    volume order.
+    """
+    for volume_id, vol_name_tag, _, _, _ in assessment["volumes"]:
+        for expression_id in ("iops", "throughput"):
+            math_check = assessment["math_checks"].get((volume_id, expression_id))
+            if not math_check:
+                continue
+            result = math_check.compare()
+            if result["mismatched"] or result["local_only"] or result["server_only"]:
+                print(
+                    f"{vol_name_tag}: Server-side {expression_id} differs from the local expression in {result['mismatched']} of {result['compared']} datapoint(s) (largest relative difference {result['max_difference']:.3g}). {result['local_only']} datapoint(s) are only computed locally and {result['server_only']} only by CloudWatch."
+                )
+            else:
+                print(
+                    f"{vol_name_tag}: Server-side {expression_id} matches the local expression in all {result['compared']} datapoint(s)."
+                )
+
+
+def get_percentile_recommendation(
+    sketch,
+    allocated,
+    vol_name_tag,
+    metric_label,
+    unit_name,
+    scale,
+    minimum,
+    maximum,
+    target_percentile,
+    day_range,
+):
+    """
+    Print a volume's percentiles and the allocation that covers the target
+    percentile.
+
+    Args:
+    - sketch: The QuantileSketch of the expression, in units per second.
+    - allocated: The allocated IOPS or MiB/s of the volume.
+    - vol_name_tag: The volume label.
+    - metric_label: "IOPS" or "throughput".
+    - unit_name: The allocation unit, such as "MB/s".
+    - scale: The size of one allocation unit in expression units, such as
+      1000000 bytes per second for throughput.
+    - minimum: The minimum recommended allocation.
+    - maximum: The maximum recommended allocation.
+    - target_percentile: The percentile the allocation must cover.
+    - day_range: Number of days covered by the time range.
+    """
+    if not sketch.count:
+        return
+
+    percentiles = ", ".join(
+        f"p{percentile:g} {sketch.quantile(percentile / 100) / scale:.1f}"
+        for percentile in PERCENTILES
+    )
+    print(
+        f"{vol_name_tag} {metric_label} percentiles in {unit_name}: {percentiles}, max {sketch.max / scale:.1f}."
+    )
+
+    needed = math.ceil(sketch.quantile(target_percentile / 100) / scale)
+    recommended = min(max(needed, minimum), maximum)
+    print(
+        f"{vol_name_tag}: The p{target_percentile:g} {metric_label} of the last {day_range} days is {needed} {unit_name}. Recommended allocation: {recommended} {unit_name} (allocated {allocated})."
+    )
+    if needed > maximum:
+        print(
+            f"{vol_name_tag}: The p{target_percentile:g} {metric_label} is above the maximum recommended size for {metric_label} at {maximum}"
+        )
+
+
+def print_volume_assessments(
+    assessment, fetch_stats, day_range, target_percentile=TARGET_PERCENTILE
+):
+    """
+    Print the IOPS and throughput recommendations of every volume, in volume order.
+
+    Returns:
+    - The result rows of every volume, metric and threshold, keyed by
+      assessment_results.RESULT_COLUMNS.
+    """
+    print(
+        f"Read {fetch_stats['pages']} page(s) in {fetch_stats['batches']} batch(es) and {fetch_stats['datapoints']} datapoint(s) from CloudWatch."
+    )
+    if "cached" in fetch_stats:
+        print(
+            f"Served {fetch_stats['cached']} datapoint(s) from the local metric cache."
+        )
+    if fetch_stats.get("math_fallbacks"):
+        print(
+            f"CloudWatch rejected the metric math of {fetch_stats['math_fallbacks']} volume(s). Their expressions were computed locally."
+        )
+    print_math_checks(assessment)
+    print_resolutions(assessment)
+
+    rows = []
+
+    def add_rows(
+        volume_id, vol_name_tag, volume_type, metric, unit, allocated, sweep, results
+    ):
+        for result in results:
+            rows.append(
+                {
+                    "instance": assessment["instance_name"],
+                    "instance_id": assessment["instance_id"],
+                    "region": assessment["target_region"],
+                    "volume_id": volume_id,
+                    "volume_label": vol_name_tag,
+                    "volume_type": volume_type,
+                    "metric": metric,
+                    "unit": unit,
+                    "allocated": allocated,
+                    "datapoints": sweep.datapoints,
+                    **result,
+                }
+            )
+
+    for (
+        volume_id,
+        vol_name_tag,
+        allocated_iops,
+        allocated_throughput,
+        volume_type,
+    ) in assessment["volumes"]:
         if allocated_iops != "N/A":
-            get_assessment_iops(
+            iops_results = get_assessment_iops(
                 allocated_iops,
-                cloudwatch_data,
-                iops_datapoints,
-                iops_expression_match,
+                assessment["iops_sweeps"][volume_id],
+                vol_name_tag,
+                THRESHOLDS,
+                day_range,
+            )
+            add_rows(
                 volume_id,
-                start_time,
-                end_time,
-                thresholds,
+                vol_name_tag,
+                volume_type,
+                "iops",
+                "IOPS",
+                allocated_iops,
+                assessment["iops_sweeps"][volume_id],
+                iops_results,
+            )
+            get_percentile_recommendation(
+                assessment["iops_sketches"][volume_id],
+                allocated_iops,
+                vol_name_tag,
+                "IOPS",
+                "IOPS",
+                1,
+                3000,
+                16000,
+                target_percentile,
+                day_range,
             )
 
-        thresholds_throughput = [0, 50, 100, 150, 200, 250, 300, 350, 400]
         if allocated_throughput != "N/A":
-            get_assessment_throughput(
+            throughput_results = get_assessment_throughput(
                 allocated_throughput,
-                cloudwatch_data,
-                throughput_datapoints,
-                throughput_expression_match,
+                assessment["throughput_sweeps"][volume_id],
+                vol_name_tag,
+                THRESHOLDS_THROUGHPUT,
+                day_range,
+            )
+            add_rows(
                 volume_id,
-                start_time,
-                end_time,
-                thresholds_throughput,
+                vol_name_tag,
+                volume_type,
+                "throughput",
+                "MB/s",
+                allocated_throughput,
+                assessment["throughput_sweeps"][volume_id],
+                throughput_results,
             )
+            get_percentile_recommendation(
+                assessment["throughput_sketches"][volume_id],
+                allocated_throughput,
+                vol_name_tag,
+                "throughput",
+                "MB/s",
+                1000000,
+                125,
+                1000,
+                target_percentile,
+                day_range,
+            )
+
+    return rows
+
+
+def run_full_assessment(
+    instance_name,
+    target_region,
+    ec2,
+    cloudwatch_data,
+    ticketnumber,
+    start_time,
+    end_time,
+    day_range,
+    volume_workers=VOLUME_WORKERS,
+    metric_cache=None,
+    lookup_cache=None,
+    run_report=None,
+    metric_math="local",
+    target_percentile=TARGET_PERCENTILE,
+    adaptive_period=False,
+    assessment_results=None,
+    dashboard_update="replace",
+    widget_templates=(),
+    instance_id=None,
+    attached_volumes=None,
+    range_workers=RANGE_WORKERS,
+):
+    """
+    Create the dashboard and print the IOPS and throughput assessment of an instance.
+
+    Args:
+    - instance_name: The Name tag of the instance.
+    - target_region: The AWS region of the instance.
+    - ec2: EC2 client for the region.
+    - cloudwatch_data: CloudWatch client for the region.
+    - ticketnumber: The ticket number used in the dashboard name.
+    - start_time: Start of the assessment time range.
+    - end_time: End of the assessment time range.
+    - day_range: Number of days covered by the time range.
+    - volume_workers: Number of volume groups fetched and assessed in parallel.
+    - metric_cache: Optional MetricCache the metrics are read through.
+    - lookup_cache: Optional LookupCache the EC2 lookups are read through.
+    - run_report: Optional RunReport the phase timings and the datapoints per
+      volume are recorded in.
+    - metric_math: Where the expressions are computed, one of
+      METRIC_MATH_MODES.
+    - target_percentile: The percentile the recommended allocations cover.
+    - adaptive_period: Fetch every part of the time range at the finest
+      period CloudWatch keeps for it, instead of 300 seconds.
+    - assessment_results: Optional AssessmentResults the per-threshold
+      results of every volume are added to.
+    - dashboard_update: How an existing dashboard is updated, one of
+      DASHBOARD_UPDATE_MODES. The lookup_cache keeps the hash of the body
+      last pushed.
+    - widget_templates: List of WidgetTemplate added to every volume's row
+      of the dashboard.
+    - instance_id: The instance ID when it is already known, such as from
+      volume_inventory.resolve_instance_names. It is looked up otherwise.
+    - attached_volumes: The instance's list of VolumeRecord tuples when they
+      are already known, such as from volume_inventory.get_volumes_by_instance.
+      They are looked up otherwise.
+    - range_workers: Number of sub-ranges of the time range fetched in
+      parallel per request.
+
+    Returns:
+    - The instance ID, or None when no instance has the given name.
+    """
+    started = time.perf_counter()
+    if not instance_id:
+        with report_phase(run_report, "lookup"):
+            instance_id = get_instance_id_from_name(ec2, instance_name, lookup_cache)
+
+    if not instance_id:
+        print(f"No instance found with the name '{instance_name}'.")
+        return None
+
+    print(f"Instance ID of '{instance_name}' is: {instance_id}")
+    if attached_volumes is None:
+        with report_phase(run_report, "lookup"):
+            attached_volumes = get_instance_volumes(ec2, instance_id, lookup_cache)
+
+    print("Attached volumes:")
+    for volume in attached_volumes:
+        print(volume.volume_id)
+
+    with report_phase(run_report, "prepare"):
+        assessment = prepare_volume_assessments(
+            instance_name,
+            instance_id,
+            target_region,
+            attached_volumes,
+            metric_math,
+            widget_templates,
+        )
+    with report_phase(run_report, "fetch"):
+        fetch_stats = fetch_volume_sweeps(
+            cloudwatch_data,
+            assessment,
+            start_time,
+            end_time,
+            volume_workers,
+            metric_cache,
+            adaptive_period,
+            range_workers,
+        )
+    with report_phase(run_report, "report"):
+        rows = print_volume_assessments(
+            assessment, fetch_stats, day_range, target_percentile
+        )
+        if assessment_results:
+            assessment_results.add_rows(rows)
 
     # Create dashboard from collected widgets
-    create_dashboard(instance_name, widgets)
+    with report_phase(run_report, "dashboard"):
+        create_dashboards(
+            cloudwatch_data,
+            qcd_dashboard_name(ticketnumber, instance_name),
+            assessment["widget_rows"],
+            dashboard_update,
+            lookup_cache,
+        )
+
+    if run_report:
+        run_report.add_volume_datapoints(instance_name, assessment["datapoints"])
+        run_report.add_instance(
+            instance_name, instance_id, time.perf_counter() - started
+        )
+
+    return instance_id
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Create the dashboard and the IOPS and throughput assessment of an instance."
+    )
+    parser.add_argument("servername", help="The Name tag of the instance.")
+    parser.add_argument("region", help="The AWS region of the instance.")
+    parser.add_argument("start_date", help="The first day, as MM/DD/YYYY.")
+    parser.add_argument("end_date", help="The last day, as MM/DD/YYYY.")
+    parser.add_argument(
+        "volume_workers",
+        nargs="?",
+        type=int,
+        default=VOLUME_WORKERS,
+        help="Number of volume groups fetched and assessed in parallel.",
+    )
+    parser.add_argument(
+        "--range-workers",
+        type=int,
+        default=RANGE_WORKERS,
+        help="Number of sub-ranges of a long time range fetched in parallel per request.",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Read every metric and EC2 lookup from AWS, bypassing the local caches.",
+    )
+    parser.add_argument(
+        "--refresh-lookups",
+        action="store_true",
+        help="Clear the cached EC2 lookups first.",
+    )
+    parser.add_argument(
+        "--refresh-dashboards",
+        action="store_true",
+        help="Clear the recorded hashes of the dashboard bodies first, so every dashboard is compared with this run's.",
+    )
+    parser.add_argument(
+        "--report",
+        metavar="PATH",
+        help="Where the JSON run report is written (default: run_report_<ticketnumber>.json).",
+    )
+    parser.add_argument(
+        "--request-timing",
+        action="store_true",
+        help="Also time every HTTP request attempt in the run report.",
+    )
+    parser.add_argument(
+        "--metric-math",
+        choices=METRIC_MATH_MODES,
+        default="local",
+        help="Compute the IOPS and throughput expressions locally, in CloudWatch, or in both and compare them.",
+    )
+    parser.add_argument(
+        "--target-percentile",
+        type=float,
+        default=TARGET_PERCENTILE,
+        help="Percentile of the datapoints the recommended allocations cover.",
+    )
+    parser.add_argument(
+        "--adaptive-period",
+        action="store_true",
+        help="Fetch each part of the range at the finest period CloudWatch still keeps (60, 300 or 3600 seconds).",
+    )
+    parser.add_argument(
+        "--dashboard-update",
+        choices=DASHBOARD_UPDATE_MODES,
+        default="replace",
+        help="Always put the whole dashboard, put it only when its widgets changed, or only add the missing widgets.",
+    )
+    parser.add_argument(
+        "--widget-templates",
+        metavar="PATH",
+        help="JSON file of extra per-volume widget templates, such as a VolumeQueueLength or BurstBalance graph.",
+    )
+    parser.add_argument(
+        "--results",
+        metavar="PATH",
+        help="Where the per-threshold result table is written, as .csv, .json or .parquet (default: assessment_results_<ticketnumber>.csv).",
+    )
+    args = parser.parse_args(argv)
+    if args.results and not args.results.lower().endswith(RESULT_FORMATS):
+        parser.error(f"--results must end with one of {', '.join(RESULT_FORMATS)}")
+
+    inputticketnumber = os.environ["ticketnumber"]
+    target_region = args.region
+    instance_name = args.servername
+
+    widget_templates = []
+    if args.widget_templates:
+        try:
+            widget_templates = load_widget_templates(args.widget_templates)
+        except (OSError, ValueError) as e:
+            parser.error(str(e))
+
+    run_report = RunReport(request_timing=args.request_timing)
+    assessment_results = AssessmentResults()
+    # Every group and sub-range in flight needs its own connection
+    clients = ClientRegistry(
+        region_name=target_region,
+        max_pool_connections=pool_connections(args.volume_workers * args.range_workers),
+        run_report=run_report,
+    )
+
+    cloudwatch_data = clients.client("cloudwatch")
+    ec2 = clients.client("ec2")
+
+    start_time, end_time, day_range = get_date_range(args.start_date, args.end_date)
+
+    print(f"{start_time} to {end_time}")
+
+    metric_cache = None if args.no_cache else MetricCache()
+    lookup_cache = (
+        None if args.no_cache else LookupCache(account_id=get_account_id(clients))
+    )
+    if lookup_cache and args.refresh_lookups:
+        for namespace in EC2_LOOKUP_NAMESPACES:
+            lookup_cache.invalidate(namespace)
+    if lookup_cache and args.refresh_dashboards:
+        for namespace in DASHBOARD_LOOKUP_NAMESPACES:
+            lookup_cache.invalidate(namespace)
+
+    run_full_assessment(
+        instance_name,
+        target_region,
+        ec2,
+        cloudwatch_data,
+        inputticketnumber,
+        start_time,
+        end_time,
+        day_range,
+        args.volume_workers,
+        metric_cache,
+        lookup_cache,
+        run_report,
+        args.metric_math,
+        args.target_percentile,
+        args.adaptive_period,
+        assessment_results,
+        args.dashboard_update,
+        widget_templates,
+        range_workers=args.range_workers,
+    )
+
+    if metric_cache:
+        metric_cache.evict()
+    run_report.write(args.report or f"run_report_{inputticketnumber}.json")
+    assessment_results.write(
+        args.results or f"assessment_results_{inputticketnumber}.csv"
+    )
+
 
-else:
-    print(f"No instance found with the name '{instance_name}'.")
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+DEFAULT_LOOKUP_CACHE_PATH = os.environ.get(
+    "LOOKUP_CACHE_PATH",
+    os.path.join(os.path.expanduser("~"), ".cache", "infrasre_qcd", "lookups.sqlite"),
+)
+
+# Instance IDs and attached volumes rarely change during a day of tickets
+DEFAULT_TTL_SECONDS = int(os.environ.get("LOOKUP_CACHE_TTL_HOURS", "6")) * 3600
+
+# Volume records hold the allocated IOPS and throughput, which change as soon
+# as a recommendation is acted on, so they expire much sooner. The shard
+# counts of split dashboards are kept for as long as their stale shards may
+# need deleting.
+DEFAULT_NAMESPACE_TTL_SECONDS = {
+    "volumes": int(os.environ.get("LOOKUP_CACHE_VOLUME_TTL_MINUTES", "10")) * 60,
+    "dashboard_shards": int(os.environ.get("LOOKUP_CACHE_SHARD_TTL_DAYS", "90"))
+    * 86400,
+}
+DEFAULT_MAX_ENTRIES = 10000
+
+# Namespaces cleared by --refresh-lookups and --refresh-dashboards
+EC2_LOOKUP_NAMESPACES = ("instance_id", "volumes")
+DASHBOARD_LOOKUP_NAMESPACES = ("dashboard_body",)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS lookups (
+    namespace TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    stored_at REAL NOT NULL,
+    last_used REAL NOT NULL,
+    PRIMARY KEY (namespace, key)
+);
+CREATE INDEX IF NOT EXISTS lookups_last_used ON lookups (last_used);
+"""
+
+
+class LookupCache:
+    """
+    File-backed TTL cache of EC2 lookups, such as instance name to instance ID
+    and instance ID to attached volumes.
+
+    Entries expire ttl seconds after they were stored, or after the
+    namespace's own TTL in namespace_ttls. Past max_entries, the least
+    recently used entries are evicted. Values are stored as JSON, so tuples
+    come back as lists.
+
+    Several AWS accounts share one cache file on a Jenkins agent, so every
+    key is stored under the account_id of the run's credentials, such as
+    from aws_clients.get_account_id.
+    """
+
+    def __init__(
+        self,
+        path=DEFAULT_LOOKUP_CACHE_PATH,
+        ttl=DEFAULT_TTL_SECONDS,
+        max_entries=DEFAULT_MAX_ENTRIES,
+        account_id=None,
+        namespace_ttls=None,
+    ):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.account_id = account_id
+        self.namespace_ttls = dict(
+            DEFAULT_NAMESPACE_TTL_SECONDS, **(namespace_ttls or {})
+        )
+        self.local = threading.local()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        connection = self.connection()
+        with connection:
+            connection.executescript(SCHEMA)
+
+    def connection(self):
+        # SQLite connections cannot be shared between threads, so every
+        # worker thread opens its own
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=60)
+            connection.execute("PRAGMA journal_mode = WAL")
+            self.local.connection = connection
+        return connection
+
+    def stored_key(self, key):
+        return json.dumps([self.account_id, key])
+
+    def get(self, namespace, key):
+        """
+        Get a cached value.
+
+        Args:
+        - namespace: The kind of lookup, such as "instance_id".
+        - key: A JSON serializable key, such as [region, instance_name].
+
+        Returns:
+        - The cached value, or None when it is missing or expired.
+        """
+        connection = self.connection()
+        key = self.stored_key(key)
+        row = connection.execute(
+            "SELECT value, stored_at FROM lookups WHERE namespace = ? AND key = ?",
+            (namespace, key),
+        ).fetchone()
+        if row is None:
+            return None
+
+        value, stored_at = row
+        now = time.time()
+        with connection:
+            if now - stored_at > self.namespace_ttls.get(namespace, self.ttl):
+                connection.execute(
+                    "DELETE FROM lookups WHERE namespace = ? AND key = ?",
+                    (namespace, key),
+                )
+                return None
+            connection.execute(
+                "UPDATE lookups SET last_used = ? WHERE namespace = ? AND key = ?",
+                (now, namespace, key),
+            )
+        return json.loads(value)
+
+    def put(self, namespace, key, value):
+        """
+        Store a value, evicting the least recently used entries past
+        max_entries.
+        """
+        connection = self.connection()
+        now = time.time()
+        with connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO lookups VALUES (?, ?, ?, ?, ?)",
+                (namespace, self.stored_key(key), json.dumps(value), now, now),
+            )
+            connection.execute(
+                "DELETE FROM lookups WHERE rowid IN ("
+                " SELECT rowid FROM lookups ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+
+    def memoize(self, namespace, key, function, *args):
+        """
+        Get a cached value, or call function(*args) and cache its result.
+
+        None results are not cached, so a missing instance is looked up again
+        on the next run.
+        """
+        value = self.get(namespace, key)
+        if value is None:
+            value = function(*args)
+            if value is not None:
+                self.put(namespace, key, value)
+        return value
+
+    def invalidate(self, namespace=None, key=None, all_accounts=False):
+        """
+        Remove cached entries of this cache's account.
+
+        Args:
+        - namespace: Only remove this kind of lookup. Everything is removed
+          when None.
+        - key: Only remove the entry with this key from the namespace.
+        - all_accounts: Remove the entries of every account sharing the cache
+          file, instead of only this one's. Ignored with a key.
+        """
+        conditions = []
+        parameters = []
+        if namespace is not None:
+            conditions.append("namespace = ?")
+            parameters.append(namespace)
+        if key is not None:
+            conditions.append("key = ?")
+            parameters.append(self.stored_key(key))
+        elif not all_accounts:
+            # Every stored key of the account starts with the same prefix,
+            # see stored_key
+            prefix = json.dumps([self.account_id])[:-1] + ", "
+            conditions.append("substr(key, 1, ?) = ?")
+            parameters.extend([len(prefix), prefix])
+
+        statement = "DELETE FROM lookups"
+        if conditions:
+            statement += " WHERE " + " AND ".join(conditions)
+        connection = self.connection()
+        with connection:
+            connection.execute(statement, parameters)
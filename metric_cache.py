@@ -0,0 +1,384 @@
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+from assessment_engine import epoch_seconds
+from metric_fetch import from_epoch, iter_volume_metric_pages, to_epoch
+
+# The cache location and size limit can be overridden per Jenkins agent
+DEFAULT_CACHE_PATH = os.environ.get(
+    "METRIC_CACHE_PATH",
+    os.path.join(os.path.expanduser("~"), ".cache", "infrasre_qcd", "metrics.sqlite"),
+)
+DEFAULT_MAX_BYTES = int(os.environ.get("METRIC_CACHE_MAX_MB", "512")) * 1024 * 1024
+
+# Buckets newer than this may still receive late datapoints, so they are
+# fetched from CloudWatch again on every run
+SETTLE_SECONDS = 2 * 3600
+
+# Length of the time window served from the cache as one page
+CACHE_PAGE_SECONDS = 7 * 86400
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS datapoints (
+    volume_id TEXT NOT NULL,
+    metric_id TEXT NOT NULL,
+    period INTEGER NOT NULL,
+    timestamp INTEGER NOT NULL,
+    value REAL NOT NULL,
+    PRIMARY KEY (volume_id, metric_id, period, timestamp)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS coverage (
+    volume_id TEXT NOT NULL,
+    metric_id TEXT NOT NULL,
+    period INTEGER NOT NULL,
+    range_start INTEGER NOT NULL,
+    range_end INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS coverage_series
+    ON coverage (volume_id, metric_id, period);
+CREATE TABLE IF NOT EXISTS series_access (
+    volume_id TEXT NOT NULL,
+    metric_id TEXT NOT NULL,
+    period INTEGER NOT NULL,
+    last_used REAL NOT NULL,
+    PRIMARY KEY (volume_id, metric_id, period)
+);
+"""
+
+
+def subtract_ranges(range_start, range_end, covered_ranges):
+    """
+    Get the parts of [range_start, range_end) that are not covered.
+
+    Args:
+    - range_start: Start of the range in epoch seconds.
+    - range_end: End of the range in epoch seconds (exclusive).
+    - covered_ranges: List of (start, end) tuples.
+
+    Returns:
+    - A sorted list of uncovered (start, end) tuples.
+    """
+    missing = []
+    cursor = range_start
+    for covered_start, covered_end in sorted(covered_ranges):
+        if covered_end <= cursor:
+            continue
+        if covered_start >= range_end:
+            break
+        if covered_start > cursor:
+            missing.append((cursor, covered_start))
+        cursor = max(cursor, covered_end)
+    if cursor < range_end:
+        missing.append((cursor, range_end))
+    return missing
+
+
+class MetricCache:
+    """
+    SQLite cache of the per-volume MetricDataResults series used by the
+    assessments, keyed by volume, metric, period and timestamp.
+
+    The time ranges already fetched are recorded per series, so later runs
+    over an overlapping window only fetch the missing ranges. When the
+    database grows past max_bytes, the least recently used series are evicted.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_bytes=DEFAULT_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.local = threading.local()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        connection = self.connection()
+        with connection:
+            connection.executescript(SCHEMA)
+
+    def connection(self):
+        # SQLite connections cannot be shared between threads, so every
+        # worker thread opens its own
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=60)
+            connection.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            connection.execute("PRAGMA journal_mode = WAL")
+            self.local.connection = connection
+        return connection
+
+    def missing_ranges(self, volume_id, metric_ids, period, range_start, range_end):
+        """
+        Get the parts of a time range that are not cached for every metric of
+        a volume.
+
+        Returns:
+        - A sorted list of (start, end) tuples in epoch seconds.
+        """
+        missing = []
+        for metric_id in metric_ids:
+            covered_ranges = (
+                self.connection()
+                .execute(
+                    "SELECT range_start, range_end FROM coverage"
+                    " WHERE volume_id = ? AND metric_id = ? AND period = ?",
+                    (volume_id, metric_id, period),
+                )
+                .fetchall()
+            )
+            missing.extend(subtract_ranges(range_start, range_end, covered_ranges))
+
+        # Merge the ranges missing for any metric, so the volume's metrics are
+        # fetched together
+        merged = []
+        for start, end in sorted(missing):
+            if merged and start <= merged[-1][1]:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+            else:
+                merged.append((start, end))
+        return merged
+
+    def plan_missing(self, volume_metric_ids, start_time, end_time, period=300):
+        """
+        Group the volumes by the time ranges that still have to be fetched.
+
+        Returns:
+        - A list of (range_start, range_end, volume_metric_ids) tuples, with
+          the range bounds as datetimes.
+        """
+        range_start, range_end = self.aligned_range(start_time, end_time, period)
+        volumes_by_range = {}
+        for volume_id, metric_ids in volume_metric_ids:
+            for missing_range in self.missing_ranges(
+                volume_id, metric_ids, period, range_start, range_end
+            ):
+                volumes_by_range.setdefault(missing_range, []).append(
+                    (volume_id, metric_ids)
+                )
+
+        return [
+            (from_epoch(start), from_epoch(end), range_volume_metric_ids)
+            for (start, end), range_volume_metric_ids in sorted(
+                volumes_by_range.items()
+            )
+        ]
+
+    def aligned_range(self, start_time, end_time, period):
+        range_start = to_epoch(start_time) // period * period
+        range_end = -(-to_epoch(end_time) // period) * period
+        return range_start, range_end
+
+    def store_page(self, volume_id, page, period=300):
+        """
+        Store one volume's page of MetricDataResults, keyed by metric id.
+        """
+        rows = []
+        for metric_id, result in page.items():
+            timestamps = epoch_seconds(result["Timestamps"])
+            values = np.asarray(result["Values"], dtype=np.float64)
+            present = ~np.isnan(values)
+            rows.extend(
+                (volume_id, metric_id, period, timestamp, value)
+                for timestamp, value in zip(
+                    timestamps[present].tolist(), values[present].tolist()
+                )
+            )
+        connection = self.connection()
+        with connection:
+            connection.executemany(
+                "INSERT OR REPLACE INTO datapoints VALUES (?, ?, ?, ?, ?)", rows
+            )
+
+    def mark_fetched(self, volume_metric_ids, start_time, end_time, period=300):
+        """
+        Record that a time range was fetched for the given volumes.
+
+        Only buckets older than SETTLE_SECONDS are recorded, so recent data is
+        fetched again on the next run.
+        """
+        range_start, range_end = self.aligned_range(start_time, end_time, period)
+        settled_end = int(time.time()) - SETTLE_SECONDS
+        range_end = min(range_end, settled_end // period * period)
+        if range_end <= range_start:
+            return
+
+        rows = [
+            (volume_id, metric_id, period, range_start, range_end)
+            for volume_id, metric_ids in volume_metric_ids
+            for metric_id in dict.fromkeys(metric_ids)
+        ]
+        connection = self.connection()
+        with connection:
+            connection.executemany("INSERT INTO coverage VALUES (?, ?, ?, ?, ?)", rows)
+
+    def iter_volume_pages(
+        self,
+        volume_metric_ids,
+        start_time,
+        end_time,
+        period=300,
+        fetch_stats=None,
+        fetched_ranges=None,
+    ):
+        """
+        Read the cached series of the given volumes.
+
+        fetch_stats["cached"] counts the datapoints served, except those in
+        fetched_ranges, a dictionary of volume ID to the (start, end) epoch
+        second ranges just fetched from CloudWatch, such as from
+        fetched_ranges(). Those were already counted as read from CloudWatch.
+
+        Yields:
+        - (volume_id, page) tuples in the same shape as
+          metric_fetch.iter_volume_metric_pages, one page per volume and
+          CACHE_PAGE_SECONDS window. The series are compacted as by
+          metric_fetch.compact_results.
+        """
+        range_start, range_end = self.aligned_range(start_time, end_time, period)
+        connection = self.connection()
+        now = time.time()
+
+        for volume_id, metric_ids in volume_metric_ids:
+            metric_ids = list(dict.fromkeys(metric_ids))
+            with connection:
+                connection.executemany(
+                    "INSERT OR REPLACE INTO series_access VALUES (?, ?, ?, ?)",
+                    [(volume_id, metric_id, period, now) for metric_id in metric_ids],
+                )
+
+            for window_start in range(range_start, range_end, CACHE_PAGE_SECONDS):
+                window_end = min(window_start + CACHE_PAGE_SECONDS, range_end)
+                page = {}
+                for metric_id in metric_ids:
+                    rows = connection.execute(
+                        "SELECT timestamp, value FROM datapoints"
+                        " WHERE volume_id = ? AND metric_id = ? AND period = ?"
+                        " AND timestamp >= ? AND timestamp < ?"
+                        " ORDER BY timestamp",
+                        (volume_id, metric_id, period, window_start, window_end),
+                    ).fetchall()
+                    columns = np.array(rows, dtype=np.float64).reshape(-1, 2)
+                    timestamps = columns[:, 0].astype(np.int64)
+                    page[metric_id] = {
+                        "Id": metric_id,
+                        "Timestamps": timestamps,
+                        "Values": columns[:, 1].copy(),
+                    }
+                    if fetch_stats is not None:
+                        served = np.ones(len(timestamps), dtype=bool)
+                        for fetched_start, fetched_end in (fetched_ranges or {}).get(
+                            volume_id, ()
+                        ):
+                            served &= (timestamps < fetched_start) | (
+                                timestamps >= fetched_end
+                            )
+                        fetch_stats["cached"] = fetch_stats.get("cached", 0) + int(
+                            served.sum()
+                        )
+                yield volume_id, page
+
+    def used_bytes(self):
+        connection = self.connection()
+        page_size = connection.execute("PRAGMA page_size").fetchone()[0]
+        page_count = connection.execute("PRAGMA page_count").fetchone()[0]
+        freelist_count = connection.execute("PRAGMA freelist_count").fetchone()[0]
+        return (page_count - freelist_count) * page_size
+
+    def evict(self):
+        """
+        Remove the least recently used series until the cache fits max_bytes.
+
+        Returns:
+        - The number of series evicted.
+        """
+        connection = self.connection()
+        evicted = 0
+        while self.used_bytes() > self.max_bytes:
+            series = connection.execute(
+                "SELECT volume_id, metric_id, period FROM series_access"
+                " ORDER BY last_used LIMIT 16"
+            ).fetchall()
+            if not series:
+                break
+            with connection:
+                for table in ("datapoints", "coverage", "series_access"):
+                    connection.executemany(
+                        f"DELETE FROM {table}"
+                        " WHERE volume_id = ? AND metric_id = ? AND period = ?",
+                        series,
+                    )
+            evicted += len(series)
+
+        connection.execute("PRAGMA incremental_vacuum")
+        return evicted
+
+
+def fetched_ranges(missing_ranges):
+    """
+    Get the time ranges fetched for each volume from the result of
+    MetricCache.plan_missing.
+
+    Returns:
+    - A dictionary of volume ID to a list of (start, end) tuples in epoch
+      seconds.
+    """
+    ranges = {}
+    for range_start, range_end, range_volume_metric_ids in missing_ranges:
+        for volume_id, _ in range_volume_metric_ids:
+            ranges.setdefault(volume_id, []).append(
+                (to_epoch(range_start), to_epoch(range_end))
+            )
+    return ranges
+
+
+def iter_cached_volume_metric_pages(
+    cloudwatch_data,
+    volume_metric_ids,
+    start_time,
+    end_time,
+    metric_cache,
+    fetch_stats=None,
+    period=300,
+    range_workers=1,
+):
+    """
+    Cached version of metric_fetch.iter_volume_metric_pages.
+
+    Only the time ranges that are not cached yet are fetched from CloudWatch.
+    The fetched pages are stored, then every volume's series is served from
+    the cache. Only the datapoints that were not just fetched are counted as
+    "cached" in fetch_stats.
+
+    Yields:
+    - (volume_id, page) tuples, where page is keyed by metric id.
+    """
+    missing_ranges = metric_cache.plan_missing(
+        volume_metric_ids, start_time, end_time, period
+    )
+    for range_start, range_end, range_volume_metric_ids in missing_ranges:
+        for volume_id, page in iter_volume_metric_pages(
+            cloudwatch_data,
+            range_volume_metric_ids,
+            range_start,
+            range_end,
+            fetch_stats,
+            period,
+            range_workers,
+        ):
+            metric_cache.store_page(volume_id, page, period)
+        metric_cache.mark_fetched(
+            range_volume_metric_ids, range_start, range_end, period
+        )
+
+    yield from metric_cache.iter_volume_pages(
+        volume_metric_ids,
+        start_time,
+        end_time,
+        period,
+        fetch_stats,
+        fetched_ranges(missing_ranges),
+    )
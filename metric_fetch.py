@@ -0,0 +1,498 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+import calendar
+import math
+import queue
+import threading
+import time
+
+import numpy as np
+
+from assessment_engine import epoch_seconds, expression_math, same_timestamps
+
+# GetMetricData accepts at most 500 MetricDataQueries per request
+MAX_METRIC_DATA_QUERIES = 500
+
+# GetMetricData returns at most 100,800 datapoints per page
+MAX_METRIC_DATA_DATAPOINTS = 100800
+
+# Pages each later sub-range of a split request may read ahead of the
+# sub-range being yielded, so a long window is never held in memory whole
+RANGE_BUFFER_PAGES = 4
+
+# How long CloudWatch keeps the datapoints of each period, finest first
+PERIOD_RETENTION = [
+    (60, 15 * 86400),
+    (300, 63 * 86400),
+    (3600, 455 * 86400),
+]
+
+# Data this close to the end of a period's retention is fetched at the next
+# coarser period, so it does not expire while the run is fetching it
+RETENTION_MARGIN_SECONDS = 3600
+
+VOLUME_METRIC_NAMES = {
+    "read_ops": "VolumeReadOps",
+    "write_ops": "VolumeWriteOps",
+    "read_bytes": "VolumeReadBytes",
+    "write_bytes": "VolumeWriteBytes",
+    "idle_time": "VolumeIdleTime",
+}
+
+IOPS_METRIC_IDS = ("read_ops", "write_ops", "idle_time")
+THROUGHPUT_METRIC_IDS = ("read_bytes", "write_bytes", "idle_time")
+
+# Expressions computed by CloudWatch with metric math, and the metric ids
+# they are computed from
+VOLUME_EXPRESSIONS = {
+    "iops": IOPS_METRIC_IDS,
+    "throughput": THROUGHPUT_METRIC_IDS,
+}
+
+
+def to_epoch(value):
+    """
+    Convert a datetime to epoch seconds. Naive datetimes are taken as UTC,
+    like botocore does.
+    """
+    return calendar.timegm(value.utctimetuple())
+
+
+def from_epoch(seconds):
+    return datetime.fromtimestamp(seconds, tz=timezone.utc)
+
+
+def plan_periods(start_time, end_time, now=None):
+    """
+    Split a time range into the sub-ranges CloudWatch keeps at each period,
+    so every part of the range is fetched at the finest period available.
+
+    The end of every sub-range is a whole multiple of its period, so the
+    buckets of consecutive sub-ranges do not overlap.
+
+    Args:
+    - start_time: Start of the time range.
+    - end_time: End of the time range.
+    - now: The current time. Defaults to the system clock.
+
+    Returns:
+    - A chronological list of (range_start, range_end, period) tuples with
+      UTC datetimes. period is None for the oldest part of the range, when
+      CloudWatch keeps no data for it anymore.
+    """
+    now = to_epoch(now) if now else int(time.time())
+    start = to_epoch(start_time)
+    end = to_epoch(end_time)
+
+    # Sub-ranges from the oldest to the newest, each ending where the next
+    # finer period becomes available
+    boundaries = [start]
+    periods = [None]
+    for period, retention in reversed(PERIOD_RETENTION):
+        available_from = now - retention + RETENTION_MARGIN_SECONDS
+        coarser_period = periods[-1] or period
+        boundary = -(-available_from // coarser_period) * coarser_period
+        boundaries.append(min(max(boundary, start), end))
+        periods.append(period)
+    boundaries.append(end)
+
+    return [
+        (from_epoch(range_start), from_epoch(range_end), period)
+        for range_start, range_end, period in zip(boundaries, boundaries[1:], periods)
+        if range_end > range_start
+    ]
+
+
+def split_time_range(start_time, end_time, period, parts):
+    """
+    Split a time range into up to parts consecutive sub-ranges of about the
+    same length, so they can be fetched in parallel.
+
+    The inner boundaries are whole multiples of both the period and an hour,
+    so they fall on bucket boundaries however old the data is, and every
+    bucket lands in exactly one sub-range.
+
+    Args:
+    - start_time: Start of the time range.
+    - end_time: End of the time range.
+    - period: The metric period in seconds.
+    - parts: The maximum number of sub-ranges.
+
+    Returns:
+    - A chronological list of (range_start, range_end) tuples. The first
+      start and the last end are start_time and end_time, the inner
+      boundaries are UTC datetimes.
+    """
+    start = to_epoch(start_time)
+    end = to_epoch(end_time)
+    step = period * 3600 // math.gcd(period, 3600)
+
+    boundaries = [start]
+    for part in range(1, parts):
+        boundary = (start + (end - start) * part // parts) // step * step
+        if boundary > boundaries[-1]:
+            boundaries.append(boundary)
+
+    range_starts = [start_time] + [from_epoch(boundary) for boundary in boundaries[1:]]
+    range_ends = range_starts[1:] + [end_time]
+    return list(zip(range_starts, range_ends))
+
+
+def range_parts(series, start_time, end_time, period, range_workers):
+    """
+    Get the number of sub-ranges a request for some series is split into.
+
+    A range is only split as far as its datapoints fill whole pages, so the
+    sub-ranges take about as many GetMetricData calls as the range does.
+
+    Args:
+    - series: The number of series the request returns.
+    - start_time: Start of the time range.
+    - end_time: End of the time range.
+    - period: The metric period in seconds.
+    - range_workers: The maximum number of sub-ranges.
+
+    Returns:
+    - The number of sub-ranges, at least 1.
+    """
+    buckets = -(-(to_epoch(end_time) - to_epoch(start_time)) // period)
+    pages = -(-series * buckets // MAX_METRIC_DATA_DATAPOINTS)
+    return max(1, min(range_workers, pages))
+
+
+def compact_results(results):
+    """
+    Replace the Timestamps and Values lists of MetricDataResults entries
+    with int64 arrays of epoch seconds and float64 arrays, in place.
+
+    As botocore parses them, every datapoint is a timezone-aware datetime
+    and a float in two lists, about 90 bytes. Compacted it takes 16 bytes,
+    and the lists are freed as soon as the response is dropped. The series
+    of a response usually share their timestamps, so equal timestamp lists
+    are converted once and share one read-only array.
+
+    Returns:
+    - The results.
+    """
+    converted = None
+    for result in results:
+        if converted is None or not same_timestamps(result["Timestamps"], converted[0]):
+            timestamps = epoch_seconds(result["Timestamps"])
+            timestamps.flags.writeable = False
+            converted = (result["Timestamps"], timestamps)
+        result["Timestamps"] = converted[1]
+        result["Values"] = np.asarray(result["Values"], dtype=np.float64)
+    return results
+
+
+def local_metric_ids(metric_ids):
+    """
+    Replace the expression ids of VOLUME_EXPRESSIONS with the metric ids they
+    are computed from, so the expressions can be computed locally instead.
+
+    Returns:
+    - The metric ids, without duplicates.
+    """
+    raw_metric_ids = []
+    for metric_id in metric_ids:
+        raw_metric_ids.extend(VOLUME_EXPRESSIONS.get(metric_id, (metric_id,)))
+    return list(dict.fromkeys(raw_metric_ids))
+
+
+def iter_metric_data_pages(
+    cloudwatch_data, metric_queries, start_time, end_time, fetch_stats=None
+):
+    """
+    Yield GetMetricData results one page at a time, following NextToken.
+
+    Args:
+    - cloudwatch_data: CloudWatch client used for the requests.
+    - metric_queries: List of MetricDataQueries.
+    - start_time: Start of the time range.
+    - end_time: End of the time range.
+    - fetch_stats: Optional dictionary updated with the number of "pages" and
+      "datapoints" read so far.
+
+    Yields:
+    - A dictionary of MetricDataResults for the page, keyed by query Id, with
+      the series compacted by compact_results.
+    """
+    request = {
+        "MetricDataQueries": metric_queries,
+        "StartTime": start_time,
+        "EndTime": end_time,
+    }
+
+    while True:
+        response = cloudwatch_data.get_metric_data(**request)
+        page = {
+            result["Id"]: result
+            for result in compact_results(response["MetricDataResults"])
+        }
+        next_token = response.get("NextToken")
+        del response
+
+        if fetch_stats is not None:
+            fetch_stats["pages"] = fetch_stats.get("pages", 0) + 1
+            fetch_stats["datapoints"] = fetch_stats.get("datapoints", 0) + sum(
+                len(result["Values"]) for result in page.values()
+            )
+
+        yield page
+
+        if not next_token:
+            break
+        request["NextToken"] = next_token
+
+
+def iter_range_pages(cloudwatch_data, metric_queries, time_ranges, fetch_stats=None):
+    """
+    Fetch consecutive sub-ranges of a time range in parallel, one thread per
+    sub-range, and yield their pages in chronological order.
+
+    The pages of the first sub-range are yielded as they arrive. The later
+    sub-ranges read at most RANGE_BUFFER_PAGES pages ahead, then wait until
+    the sub-ranges before them have been yielded.
+
+    Args:
+    - cloudwatch_data: CloudWatch client used for the requests.
+    - metric_queries: List of MetricDataQueries.
+    - time_ranges: List of (range_start, range_end) tuples, such as from
+      split_time_range.
+    - fetch_stats: Optional dictionary updated with the number of "pages" and
+      "datapoints" read so far.
+
+    Yields:
+    - The pages of iter_metric_data_pages.
+    """
+
+    stopped = threading.Event()
+    buffers = [queue.Queue(maxsize=RANGE_BUFFER_PAGES) for _ in time_ranges]
+    range_stats = [{} for _ in time_ranges]
+
+    def put(buffer, item):
+        # Stop waiting for room once the pages are no longer being read
+        while not stopped.is_set():
+            try:
+                buffer.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def fetch_range(time_range, buffer, stats):
+        try:
+            for page in iter_metric_data_pages(
+                cloudwatch_data, metric_queries, *time_range, stats
+            ):
+                if not put(buffer, page):
+                    return
+        except Exception as error:
+            put(buffer, error)
+        else:
+            put(buffer, None)
+
+    with ThreadPoolExecutor(max_workers=len(time_ranges)) as executor:
+        for arguments in zip(time_ranges, buffers, range_stats):
+            executor.submit(fetch_range, *arguments)
+        try:
+            for buffer, stats in zip(buffers, range_stats):
+                while True:
+                    page = buffer.get()
+                    if page is None:
+                        break
+                    if isinstance(page, Exception):
+                        raise page
+                    yield page
+                if fetch_stats is not None:
+                    for key, value in stats.items():
+                        fetch_stats[key] = fetch_stats.get(key, 0) + value
+        finally:
+            stopped.set()
+
+
+def page_values(page, query_id):
+    """
+    Get the timestamps and values of one query from a page.
+
+    Args:
+    - page: A page yielded by iter_metric_data_pages.
+    - query_id: The Id of the metric query.
+
+    Returns:
+    - A tuple containing the timestamps and values (empty when the query has
+      no data in this page).
+    """
+    result = page.get(query_id)
+    if result is None:
+        return [], []
+    return result["Timestamps"], result["Values"]
+
+
+def plan_volume_metric_queries(
+    volume_metric_ids, period=300, max_queries=MAX_METRIC_DATA_QUERIES
+):
+    """
+    Pack the EBS metric queries of many volumes into as few requests as possible.
+
+    A metric that several assessments share (such as idle_time) is queried only
+    once per volume, and a volume's queries are never split across requests.
+
+    Metric ids that are keys of VOLUME_EXPRESSIONS are computed by CloudWatch
+    with metric math. Their input metrics are queried with ReturnData False,
+    unless they are requested too, so only the expression's series comes back.
+
+    Args:
+    - volume_metric_ids: List of (volume_id, metric_ids) tuples, where
+      metric_ids are keys of VOLUME_METRIC_NAMES or VOLUME_EXPRESSIONS.
+    - period: The metric period in seconds.
+    - max_queries: The maximum number of queries per request.
+
+    Returns:
+    - A list of (metric_queries, query_targets) tuples, one per request.
+      query_targets maps each query Id to its (volume_id, metric_id).
+    """
+    batches = []
+    metric_queries = []
+    query_targets = {}
+
+    for volume_index, (volume_id, metric_ids) in enumerate(volume_metric_ids):
+        metric_ids = list(dict.fromkeys(metric_ids))
+        expression_ids = [
+            metric_id for metric_id in metric_ids if metric_id in VOLUME_EXPRESSIONS
+        ]
+        raw_metric_ids = local_metric_ids(metric_ids)
+        if not raw_metric_ids:
+            continue
+
+        volume_queries = len(raw_metric_ids) + len(expression_ids)
+        if metric_queries and len(metric_queries) + volume_queries > max_queries:
+            batches.append((metric_queries, query_targets))
+            metric_queries = []
+            query_targets = {}
+
+        for metric_id in raw_metric_ids:
+            # Query Ids must start with a lowercase letter, so the volume ID
+            # itself cannot be used
+            query_id = f"v{volume_index}_{metric_id}"
+            metric_query = {
+                "Id": query_id,
+                "MetricStat": {
+                    "Metric": {
+                        "Namespace": "AWS/EBS",
+                        "MetricName": VOLUME_METRIC_NAMES[metric_id],
+                        "Dimensions": [{"Name": "VolumeId", "Value": volume_id}],
+                    },
+                    "Period": period,
+                    "Stat": "Sum",
+                },
+            }
+            if metric_id in metric_ids:
+                query_targets[query_id] = (volume_id, metric_id)
+            else:
+                metric_query["ReturnData"] = False
+            metric_queries.append(metric_query)
+
+        for metric_id in expression_ids:
+            query_id = f"v{volume_index}_{metric_id}"
+            metric_queries.append(
+                {
+                    "Id": query_id,
+                    "Expression": expression_math(
+                        *(
+                            f"v{volume_index}_{input_id}"
+                            for input_id in VOLUME_EXPRESSIONS[metric_id]
+                        ),
+                        period=period,
+                    ),
+                }
+            )
+            query_targets[query_id] = (volume_id, metric_id)
+
+    if metric_queries:
+        batches.append((metric_queries, query_targets))
+
+    return batches
+
+
+def split_volume_metric_ids(volume_metric_ids, groups):
+    """
+    Spread volumes over a number of groups that can be fetched in parallel.
+
+    Args:
+    - volume_metric_ids: List of (volume_id, metric_ids) tuples.
+    - groups: The maximum number of groups.
+
+    Returns:
+    - A list of non-empty volume_metric_ids lists.
+    """
+    groups = max(1, min(groups, len(volume_metric_ids)))
+    return [
+        volume_metric_ids[i::groups]
+        for i in range(groups)
+        if volume_metric_ids[i::groups]
+    ]
+
+
+def iter_volume_metric_pages(
+    cloudwatch_data,
+    volume_metric_ids,
+    start_time,
+    end_time,
+    fetch_stats=None,
+    period=300,
+    range_workers=1,
+):
+    """
+    Fetch the metrics of many volumes with batched, paginated GetMetricData calls.
+
+    With range_workers, a request that spans several pages is split into up
+    to range_workers sub-ranges (see split_time_range and range_parts) that
+    are fetched in parallel, and its pages are yielded in chronological
+    order.
+
+    Args:
+    - cloudwatch_data: CloudWatch client used for the requests.
+    - volume_metric_ids: List of (volume_id, metric_ids) tuples.
+    - start_time: Start of the time range.
+    - end_time: End of the time range.
+    - fetch_stats: Optional dictionary updated with the number of query "batches",
+      "pages" and "datapoints" read so far.
+    - period: The metric period in seconds.
+    - range_workers: The maximum number of sub-ranges fetched in parallel
+      per request.
+
+    Yields:
+    - (volume_id, page) tuples, where page holds that volume's
+      MetricDataResults for one response page, keyed by metric id.
+    """
+    for metric_queries, query_targets in plan_volume_metric_queries(
+        volume_metric_ids, period
+    ):
+        if fetch_stats is not None:
+            fetch_stats["batches"] = fetch_stats.get("batches", 0) + 1
+
+        time_ranges = split_time_range(
+            start_time,
+            end_time,
+            period,
+            range_parts(
+                len(query_targets), start_time, end_time, period, range_workers
+            ),
+        )
+        if len(time_ranges) > 1:
+            pages = iter_range_pages(
+                cloudwatch_data, metric_queries, time_ranges, fetch_stats
+            )
+        else:
+            pages = iter_metric_data_pages(
+                cloudwatch_data, metric_queries, start_time, end_time, fetch_stats
+            )
+
+        for page in pages:
+            volume_pages = {}
+            for query_id, result in page.items():
+                volume_id, metric_id = query_targets[query_id]
+                volume_pages.setdefault(volume_id, {})[metric_id] = result
+
+            yield from volume_pages.items()
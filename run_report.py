@@ -0,0 +1,248 @@
+from datetime import datetime, timezone
+import contextlib
+import json
+import threading
+import time
+
+# Upper bounds of the latency histogram buckets, in milliseconds
+LATENCY_BUCKETS_MS = [10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000]
+
+THROTTLING_ERROR_CODES = {
+    "Throttling",
+    "ThrottlingException",
+    "RequestLimitExceeded",
+    "TooManyRequestsException",
+}
+
+
+class LatencyHistogram:
+    """
+    Count latencies in the fixed LATENCY_BUCKETS_MS buckets.
+    """
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.count = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+
+    def add(self, seconds):
+        milliseconds = seconds * 1000
+        bucket = len(LATENCY_BUCKETS_MS)
+        for index, bound in enumerate(LATENCY_BUCKETS_MS):
+            if milliseconds <= bound:
+                bucket = index
+                break
+        self.counts[bucket] += 1
+        self.count += 1
+        self.seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+
+    def to_dict(self):
+        buckets = {
+            f"le_{bound}ms": count
+            for bound, count in zip(LATENCY_BUCKETS_MS, self.counts)
+        }
+        buckets["gt_10000ms"] = self.counts[-1]
+        return {
+            "count": self.count,
+            "seconds": round(self.seconds, 6),
+            "max_ms": round(self.max_seconds * 1000, 3),
+            "buckets": buckets,
+        }
+
+
+class RunReport:
+    """
+    Collect the timings and counters of one run and write them as JSON.
+
+    It records:
+    - The wall time of each phase, such as "lookup" or "fetch".
+    - Per API operation: latency histogram, errors, retries, throttled
+      responses and bytes received, from the clients passed to instrument().
+    - Per HTTP request attempt: latency histogram, when created with
+      request_timing=True.
+    - The datapoints processed per volume and the time spent per instance.
+
+    Every method is thread safe.
+    """
+
+    def __init__(self, request_timing=False):
+        self.request_timing = request_timing
+        self.started_at = datetime.now(timezone.utc)
+        self.started = time.perf_counter()
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.phases = {}
+        self.api_calls = {}
+        self.requests = {}
+        self.volumes = {}
+        self.instances = {}
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """
+        Add the time spent in the block to the named phase. Time spent in
+        concurrent workers is added up.
+        """
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - started
+            with self.lock:
+                phase = self.phases.setdefault(name, {"count": 0, "seconds": 0.0})
+                phase["count"] += 1
+                phase["seconds"] += seconds
+
+    def add_instance(self, instance_name, instance_id, seconds):
+        with self.lock:
+            self.instances[instance_name] = {
+                "instance_id": instance_id,
+                "seconds": round(seconds, 6),
+            }
+
+    def add_volume_datapoints(self, instance_name, volume_datapoints):
+        """
+        Record the datapoints processed for each volume of an instance.
+
+        Args:
+        - instance_name: The Name tag of the instance.
+        - volume_datapoints: Dictionary of volume ID to datapoints.
+        """
+        with self.lock:
+            for volume_id, datapoints in volume_datapoints.items():
+                self.volumes[volume_id] = {
+                    "instance": instance_name,
+                    "datapoints": datapoints,
+                }
+
+    def api_stats(self, operation_name):
+        # Called with the lock held
+        if operation_name not in self.api_calls:
+            self.api_calls[operation_name] = {
+                "latency": LatencyHistogram(),
+                "errors": 0,
+                "retries": 0,
+                "throttled": 0,
+                "bytes_received": 0,
+            }
+        return self.api_calls[operation_name]
+
+    def instrument(self, client):
+        """
+        Record every API call of a boto3 client through botocore events. With
+        request_timing, each HTTP request attempt is timed too, including
+        retried ones.
+
+        Returns:
+        - The client.
+        """
+        events = client.meta.events
+        events.register("before-parameter-build", self.before_call)
+        events.register("after-call", self.after_call)
+        events.register("needs-retry", self.needs_retry)
+        if self.request_timing:
+            events.register("before-send", self.before_send)
+            events.register("response-received", self.response_received)
+        return client
+
+    def before_call(self, model, context, **kwargs):
+        context["run_report_started"] = time.perf_counter()
+        context["run_report_operation"] = model.name
+
+    def after_call(self, http_response, parsed, model, context, **kwargs):
+        started = context.get("run_report_started")
+        if started is None:
+            return
+        seconds = time.perf_counter() - started
+
+        bytes_received = 0
+        if getattr(http_response, "raw", None) is not None:
+            bytes_received = len(http_response.content or b"")
+        retries = parsed.get("ResponseMetadata", {}).get("RetryAttempts", 0)
+
+        with self.lock:
+            stats = self.api_stats(model.name)
+            stats["latency"].add(seconds)
+            stats["retries"] += retries
+            stats["bytes_received"] += bytes_received
+            if http_response.status_code >= 300:
+                stats["errors"] += 1
+
+    def needs_retry(self, response, operation, **kwargs):
+        # Called after every attempt, whether or not it is retried
+        if not response:
+            return None
+        error_code = response[1].get("Error", {}).get("Code")
+        if error_code in THROTTLING_ERROR_CODES:
+            with self.lock:
+                self.api_stats(operation.name)["throttled"] += 1
+        return None
+
+    def before_send(self, request, **kwargs):
+        # Requests are sent synchronously, so the attempt's start time can be
+        # kept per thread
+        self.local.request_started = time.perf_counter()
+        return None
+
+    def response_received(self, context, **kwargs):
+        started = getattr(self.local, "request_started", None)
+        if started is None:
+            return
+        self.local.request_started = None
+        seconds = time.perf_counter() - started
+        operation_name = context.get("run_report_operation", "unknown")
+        with self.lock:
+            if operation_name not in self.requests:
+                self.requests[operation_name] = LatencyHistogram()
+            self.requests[operation_name].add(seconds)
+
+    def to_dict(self):
+        with self.lock:
+            report = {
+                "started_at": self.started_at.isoformat(),
+                "wall_seconds": round(time.perf_counter() - self.started, 6),
+                "phases": {
+                    name: {
+                        "count": phase["count"],
+                        "seconds": round(phase["seconds"], 6),
+                    }
+                    for name, phase in self.phases.items()
+                },
+                "api_calls": {
+                    name: dict(
+                        stats["latency"].to_dict(),
+                        errors=stats["errors"],
+                        retries=stats["retries"],
+                        throttled=stats["throttled"],
+                        bytes_received=stats["bytes_received"],
+                    )
+                    for name, stats in self.api_calls.items()
+                },
+                "instances": dict(self.instances),
+                "volumes": dict(self.volumes),
+            }
+            if self.requests:
+                report["requests"] = {
+                    name: histogram.to_dict()
+                    for name, histogram in self.requests.items()
+                }
+        return report
+
+    def write(self, path):
+        with open(path, "w") as report_file:
+            json.dump(self.to_dict(), report_file, indent=2)
+        print(f"Run report written to '{path}'.")
+
+
+@contextlib.contextmanager
+def report_phase(run_report, name):
+    """
+    Time a phase when a RunReport is given, otherwise do nothing.
+    """
+    if run_report is None:
+        yield
+    else:
+        with run_report.phase(name):
+            yield
@@ -0,0 +1,131 @@
+import math
+import types
+import zlib
+
+from botocore.exceptions import ClientError
+
+from metric_fetch import MAX_METRIC_DATA_DATAPOINTS, from_epoch, to_epoch
+
+
+def metric_value(volume_id, metric_name, timestamp):
+    """
+    Get the deterministic value of a fake datapoint.
+    """
+    return float(zlib.crc32(f"{volume_id}/{metric_name}/{timestamp}".encode()) % 10000)
+
+
+class FakeCloudWatch:
+    """
+    GetMetricData over a fleet where every volume has a datapoint in every
+    bucket, paginated like CloudWatch.
+
+    Only MetricStat queries are answered; expressions return no datapoints.
+    """
+
+    def __init__(self, page_datapoints=MAX_METRIC_DATA_DATAPOINTS):
+        self.page_datapoints = page_datapoints
+        self.requests = []
+
+    def get_metric_data(self, MetricDataQueries, StartTime, EndTime, NextToken=None):
+        if NextToken is None:
+            self.requests.append((to_epoch(StartTime), to_epoch(EndTime)))
+        queries = [
+            query
+            for query in MetricDataQueries
+            if "MetricStat" in query and query.get("ReturnData", True)
+        ]
+        per_query = self.page_datapoints // max(1, len(queries))
+        offset = int(NextToken or 0)
+
+        results = []
+        more = False
+        for query in queries:
+            stat = query["MetricStat"]
+            period = stat["Period"]
+            volume_id = stat["Metric"]["Dimensions"][0]["Value"]
+            metric_name = stat["Metric"]["MetricName"]
+            buckets = range(
+                math.ceil(to_epoch(StartTime) / period) * period,
+                to_epoch(EndTime),
+                period,
+            )
+            page_buckets = buckets[offset : offset + per_query]
+            more = more or offset + per_query < len(buckets)
+            results.append(
+                {
+                    "Id": query["Id"],
+                    "Timestamps": [from_epoch(bucket) for bucket in page_buckets],
+                    "Values": [
+                        metric_value(volume_id, metric_name, bucket)
+                        for bucket in page_buckets
+                    ],
+                    "StatusCode": "PartialData" if more else "Complete",
+                }
+            )
+
+        response = {"MetricDataResults": results}
+        if more:
+            response["NextToken"] = str(offset + per_query)
+        return response
+
+
+def collect_series(volume_pages):
+    """
+    Gather the datapoints of (volume_id, page) tuples.
+
+    Returns:
+    - A dictionary of (volume_id, metric_id) to a dictionary of epoch
+      second timestamps to values.
+    """
+    series = {}
+    for volume_id, page in volume_pages:
+        for metric_id, result in page.items():
+            series.setdefault((volume_id, metric_id), {}).update(
+                zip(
+                    [int(timestamp) for timestamp in result["Timestamps"]],
+                    [float(value) for value in result["Values"]],
+                )
+            )
+    return series
+
+
+class FakeDashboardClient:
+    """
+    The dashboard calls of a CloudWatch client, over a dictionary of
+    dashboard name to body JSON. Every call is recorded in calls as an
+    (operation, dashboard names) tuple.
+    """
+
+    def __init__(self, dashboards=None, region_name="us-east-1", deny_delete=False):
+        self.meta = types.SimpleNamespace(region_name=region_name)
+        self.dashboards = dict(dashboards or {})
+        self.deny_delete = deny_delete
+        self.calls = []
+
+    def put_dashboard(self, DashboardName, DashboardBody):
+        self.calls.append(("PutDashboard", DashboardName))
+        self.dashboards[DashboardName] = DashboardBody
+        return {"DashboardValidationMessages": []}
+
+    def get_dashboard(self, DashboardName):
+        self.calls.append(("GetDashboard", DashboardName))
+        if DashboardName not in self.dashboards:
+            raise ClientError(
+                {"Error": {"Code": "ResourceNotFound", "Message": "Not found"}},
+                "GetDashboard",
+            )
+        return {
+            "DashboardName": DashboardName,
+            "DashboardBody": self.dashboards[DashboardName],
+        }
+
+    def delete_dashboards(self, DashboardNames):
+        self.calls.append(("DeleteDashboards", tuple(DashboardNames)))
+        if self.deny_delete:
+            raise ClientError(
+                {"Error": {"Code": "AccessDenied", "Message": "Not authorized"}},
+                "DeleteDashboards",
+            )
+        for name in DashboardNames:
+            del self.dashboards[name]
+        return {}
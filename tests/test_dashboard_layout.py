@@ -0,0 +1,185 @@
+import json
+
+import numpy as np
+import pytest
+
+from dashboard import (
+    GRID_COLUMNS,
+    MAX_WIDGET_METRICS,
+    DashboardLayout,
+    create_dashboards,
+    layout_dashboards,
+)
+from fake_cloudwatch import FakeDashboardClient
+from lookup_cache import LookupCache
+
+
+def widget(title, width=12, height=6, metrics=1):
+    return {
+        "type": "metric",
+        "width": width,
+        "height": height,
+        "properties": {
+            "title": title,
+            "metrics": [["AWS/EBS", "VolumeReadOps", "VolumeId", title]] * metrics,
+        },
+    }
+
+
+def without_position(widgets):
+    return [
+        {key: value for key, value in widget.items() if key not in ("x", "y")}
+        for widget in widgets
+    ]
+
+
+def overlaps(first, second):
+    return (
+        first["x"] < second["x"] + second["width"]
+        and second["x"] < first["x"] + first["width"]
+        and first["y"] < second["y"] + second["height"]
+        and second["y"] < first["y"] + first["height"]
+    )
+
+
+def test_rows_are_placed_left_to_right_and_wrap():
+    dashboards = layout_dashboards(
+        [
+            [widget("cpu", width=24)],
+            [widget("iops"), widget("throughput")],
+            [widget("a", width=10), widget("b", width=10), widget("c", height=3)],
+            [widget("d")],
+        ]
+    )
+
+    assert [
+        (widget["properties"]["title"], widget["x"], widget["y"])
+        for widget in dashboards[0]
+    ] == [
+        ("cpu", 0, 0),
+        ("iops", 0, 6),
+        ("throughput", 12, 6),
+        ("a", 0, 12),
+        ("b", 10, 12),
+        ("c", 0, 18),
+        ("d", 0, 21),
+    ]
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_dashboards_stay_within_the_limits(seed):
+    rng = np.random.default_rng(seed)
+    rows = [
+        [
+            widget(
+                f"w{row}_{column}",
+                width=int(rng.choice([6, 8, 12, 24])),
+                height=int(rng.integers(3, 9)),
+                metrics=int(rng.integers(1, 20)),
+            )
+            for column in range(rng.integers(1, 5))
+        ]
+        for row in range(200)
+    ]
+    layout = DashboardLayout(max_widgets=60, max_metrics=400, max_body_bytes=20000)
+    for row in rows:
+        layout.add_row(row)
+
+    assert len(layout.dashboards) > 1
+    for widgets in layout.dashboards:
+        assert len(widgets) <= 60
+        assert sum(len(widget["properties"]["metrics"]) for widget in widgets) <= 400
+        assert len(json.dumps({"widgets": widgets})) <= 20000
+        assert all(
+            0 <= widget["x"] and widget["x"] + widget["width"] <= GRID_COLUMNS
+            for widget in widgets
+        )
+        assert not any(
+            overlaps(first, second)
+            for index, first in enumerate(widgets)
+            for second in widgets[index + 1 :]
+        )
+
+    # Every widget is placed once, in order, and a row is never split
+    placed = [widget for widgets in layout.dashboards for widget in widgets]
+    assert without_position(placed) == [widget for row in rows for widget in row]
+    row_titles = [{widget["properties"]["title"] for widget in row} for row in rows]
+    dashboard_titles = [
+        {widget["properties"]["title"] for widget in widgets}
+        for widgets in layout.dashboards
+    ]
+    assert all(
+        any(titles <= dashboard for dashboard in dashboard_titles)
+        for titles in row_titles
+    )
+
+
+def test_a_widget_over_the_metric_limit_is_rejected():
+    with pytest.raises(ValueError):
+        layout_dashboards([[widget("big", metrics=MAX_WIDGET_METRICS + 1)]])
+
+
+def volume_rows(count):
+    # 10 metrics a widget, so 125 volumes fill a dashboard's 2500 metrics
+    return [
+        [widget(f"iops{i}", metrics=10), widget(f"throughput{i}", metrics=10)]
+        for i in range(count)
+    ]
+
+
+@pytest.fixture
+def lookup_cache(tmp_path):
+    return LookupCache(str(tmp_path / "lookups.sqlite"), account_id="123456789012")
+
+
+def test_shards_are_named_with_a_part_suffix(lookup_cache):
+    cloudwatch = FakeDashboardClient()
+
+    names = create_dashboards(
+        cloudwatch, "dash", volume_rows(300), lookup_cache=lookup_cache
+    )
+
+    assert names == ["dash", "dash__part2", "dash__part3"]
+    assert sorted(cloudwatch.dashboards) == names
+
+
+def test_stale_shards_are_deleted_but_not_other_dashboards(lookup_cache):
+    # The dashboards of instances named dash-2 and dash-3
+    other_dashboards = {"dash-2": "{}", "dash-3": "{}"}
+    cloudwatch = FakeDashboardClient(other_dashboards)
+    create_dashboards(cloudwatch, "dash", volume_rows(300), lookup_cache=lookup_cache)
+
+    names = create_dashboards(
+        cloudwatch, "dash", volume_rows(10), lookup_cache=lookup_cache
+    )
+
+    assert names == ["dash"]
+    assert ("DeleteDashboards", ("dash__part2", "dash__part3")) in cloudwatch.calls
+    assert sorted(cloudwatch.dashboards) == ["dash", "dash-2", "dash-3"]
+
+
+def test_unsplit_dashboards_make_no_delete_calls(lookup_cache):
+    cloudwatch = FakeDashboardClient()
+    create_dashboards(cloudwatch, "dash", volume_rows(10), lookup_cache=lookup_cache)
+    create_dashboards(cloudwatch, "dash", volume_rows(5), lookup_cache=lookup_cache)
+
+    assert [operation for operation, _ in cloudwatch.calls] == [
+        "PutDashboard",
+        "PutDashboard",
+    ]
+
+
+def test_a_denied_delete_keeps_the_recorded_shards(lookup_cache, capsys):
+    cloudwatch = FakeDashboardClient()
+    create_dashboards(cloudwatch, "dash", volume_rows(300), lookup_cache=lookup_cache)
+
+    cloudwatch.deny_delete = True
+    create_dashboards(cloudwatch, "dash", volume_rows(10), lookup_cache=lookup_cache)
+
+    assert "Warning: Could not delete" in capsys.readouterr().out
+    assert sorted(cloudwatch.dashboards) == ["dash", "dash__part2", "dash__part3"]
+
+    cloudwatch.deny_delete = False
+    create_dashboards(cloudwatch, "dash", volume_rows(10), lookup_cache=lookup_cache)
+
+    assert sorted(cloudwatch.dashboards) == ["dash"]
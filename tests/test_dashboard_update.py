@@ -0,0 +1,110 @@
+import json
+
+import pytest
+
+from dashboard import MAX_DASHBOARD_WIDGETS, create_dashboard, layout_dashboards
+from fake_cloudwatch import FakeDashboardClient
+from lookup_cache import LookupCache
+
+
+def widget(title, metrics=1):
+    return {
+        "type": "metric",
+        "width": 12,
+        "height": 6,
+        "properties": {
+            "title": title,
+            "metrics": [["AWS/EBS", "VolumeReadOps", "VolumeId", title]] * metrics,
+        },
+    }
+
+
+def built_widgets(*titles):
+    return layout_dashboards([[widget(title)] for title in titles])[0]
+
+
+def put_calls(cloudwatch):
+    return [name for operation, name in cloudwatch.calls if operation == "PutDashboard"]
+
+
+@pytest.fixture
+def lookup_cache(tmp_path):
+    return LookupCache(str(tmp_path / "lookups.sqlite"), account_id="123456789012")
+
+
+def test_update_puts_only_a_changed_body(lookup_cache):
+    cloudwatch = FakeDashboardClient()
+    widgets = built_widgets("a", "b")
+
+    assert create_dashboard(cloudwatch, "d", widgets, "update", lookup_cache) == (
+        "created"
+    )
+    assert create_dashboard(cloudwatch, "d", widgets, "update", lookup_cache) == (
+        "unchanged"
+    )
+    assert (
+        create_dashboard(
+            cloudwatch, "d", built_widgets("a", "c"), "update", lookup_cache
+        )
+        == "updated"
+    )
+    assert put_calls(cloudwatch) == ["d", "d"]
+
+
+@pytest.mark.parametrize("update_mode", ["update", "merge"])
+def test_a_dashboard_deleted_or_edited_since_the_last_run_is_restored(
+    lookup_cache, update_mode
+):
+    cloudwatch = FakeDashboardClient()
+    widgets = built_widgets("a", "b")
+    create_dashboard(cloudwatch, "d", widgets, update_mode, lookup_cache)
+
+    del cloudwatch.dashboards["d"]
+    assert create_dashboard(cloudwatch, "d", widgets, update_mode, lookup_cache) == (
+        "created"
+    )
+
+    cloudwatch.dashboards["d"] = json.dumps({"widgets": built_widgets("a")})
+    assert create_dashboard(cloudwatch, "d", widgets, update_mode, lookup_cache) == (
+        "updated"
+    )
+    titles = [
+        widget["properties"]["title"]
+        for widget in json.loads(cloudwatch.dashboards["d"])["widgets"]
+    ]
+    assert titles == ["a", "b"]
+
+
+def test_merge_adds_the_missing_widgets_below_the_existing_ones(lookup_cache):
+    existing = [
+        dict(widget("console"), x=0, y=0, height=9),
+        dict(widget("a"), x=12, y=0),
+    ]
+    cloudwatch = FakeDashboardClient({"d": json.dumps({"widgets": existing})})
+
+    status = create_dashboard(
+        cloudwatch, "d", built_widgets("a", "b", "c"), "merge", lookup_cache
+    )
+
+    merged = json.loads(cloudwatch.dashboards["d"])["widgets"]
+    assert status == "updated"
+    assert merged[:2] == existing
+    assert [
+        (widget["properties"]["title"], widget["x"], widget["y"])
+        for widget in merged[2:]
+    ] == [("b", 0, 9), ("c", 0, 15)]
+
+
+def test_a_full_dashboard_reports_the_rows_left_out(lookup_cache, capsys):
+    existing = built_widgets(*(f"w{i}" for i in range(MAX_DASHBOARD_WIDGETS - 1)))
+    cloudwatch = FakeDashboardClient({"d": json.dumps({"widgets": existing})})
+    widgets = built_widgets("new1", "new2")
+
+    create_dashboard(cloudwatch, "d", widgets, "merge", lookup_cache)
+
+    assert len(json.loads(cloudwatch.dashboards["d"])["widgets"]) == (
+        MAX_DASHBOARD_WIDGETS
+    )
+    assert "1 widget(s) were not merged: new2" in capsys.readouterr().out
+    # Nothing is recorded, so the next run tries to merge the row again
+    assert lookup_cache.get("dashboard_body", ["us-east-1", "d"]) is None
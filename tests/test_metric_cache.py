@@ -0,0 +1,160 @@
+from datetime import datetime, timedelta, timezone
+import itertools
+import time
+import types
+
+import numpy as np
+import pytest
+
+import metric_cache
+from fake_cloudwatch import FakeCloudWatch, collect_series
+from metric_cache import MetricCache, iter_cached_volume_metric_pages
+from metric_fetch import IOPS_METRIC_IDS, iter_volume_metric_pages, to_epoch
+
+PERIOD = 300
+START = datetime(2020, 1, 1, tzinfo=timezone.utc)
+END = START + timedelta(days=2)
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return MetricCache(str(tmp_path / "metrics.sqlite"))
+
+
+def uncovered_ranges(range_start, range_end, coverage_by_metric):
+    """
+    Get the missing ranges one bucket at a time.
+    """
+    missing = [
+        bucket
+        for bucket in range(range_start, range_end, PERIOD)
+        if not all(
+            any(start <= bucket < end for start, end in coverage)
+            for coverage in coverage_by_metric.values()
+        )
+    ]
+    ranges = []
+    for bucket in missing:
+        if ranges and ranges[-1][1] == bucket:
+            ranges[-1][1] = bucket + PERIOD
+        else:
+            ranges.append([bucket, bucket + PERIOD])
+    return [tuple(missing_range) for missing_range in ranges]
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_missing_ranges_match_the_uncovered_buckets(cache, seed):
+    rng = np.random.default_rng(seed)
+    range_start = to_epoch(START)
+    range_end = to_epoch(END)
+    buckets = (range_end - range_start) // PERIOD
+
+    coverage_by_metric = {metric_id: [] for metric_id in IOPS_METRIC_IDS}
+    for metric_id, coverage in coverage_by_metric.items():
+        for _ in range(rng.integers(0, 5)):
+            first, last = sorted(rng.integers(-10, buckets + 10, 2))
+            start = range_start + int(first) * PERIOD
+            end = range_start + int(last) * PERIOD
+            cache.mark_fetched(
+                [("vol-1", [metric_id])],
+                datetime.fromtimestamp(start, timezone.utc),
+                datetime.fromtimestamp(end, timezone.utc),
+                PERIOD,
+            )
+            coverage.append((start, end))
+
+    assert cache.missing_ranges(
+        "vol-1", IOPS_METRIC_IDS, PERIOD, range_start, range_end
+    ) == uncovered_ranges(range_start, range_end, coverage_by_metric)
+
+
+def test_cached_pages_match_cloudwatch(cache):
+    volume_metric_ids = [(f"vol-{i}", IOPS_METRIC_IDS) for i in range(3)]
+    expected = collect_series(
+        iter_volume_metric_pages(
+            FakeCloudWatch(page_datapoints=1000), volume_metric_ids, START, END
+        )
+    )
+
+    cloudwatch = FakeCloudWatch(page_datapoints=1000)
+    first_run = collect_series(
+        iter_cached_volume_metric_pages(
+            cloudwatch, volume_metric_ids, START, END, cache
+        )
+    )
+    assert first_run == expected
+    assert cloudwatch.requests == [(to_epoch(START), to_epoch(END))]
+
+    cloudwatch = FakeCloudWatch(page_datapoints=1000)
+    fetch_stats = {}
+    second_run = collect_series(
+        iter_cached_volume_metric_pages(
+            cloudwatch, volume_metric_ids, START, END, cache, fetch_stats
+        )
+    )
+    assert second_run == expected
+    assert cloudwatch.requests == []
+    assert fetch_stats["cached"] == sum(len(series) for series in expected.values())
+
+
+def test_only_the_uncached_range_is_fetched(cache):
+    volume_metric_ids = [("vol-1", IOPS_METRIC_IDS)]
+    list(
+        iter_cached_volume_metric_pages(
+            FakeCloudWatch(), volume_metric_ids, START, END, cache
+        )
+    )
+
+    later_end = END + timedelta(days=1)
+    cloudwatch = FakeCloudWatch()
+    served = collect_series(
+        iter_cached_volume_metric_pages(
+            cloudwatch, volume_metric_ids, START, later_end, cache
+        )
+    )
+
+    assert cloudwatch.requests == [(to_epoch(END), to_epoch(later_end))]
+    assert served == collect_series(
+        iter_volume_metric_pages(FakeCloudWatch(), volume_metric_ids, START, later_end)
+    )
+
+
+def test_evict_removes_the_least_recently_used_series(cache, monkeypatch):
+    clock = itertools.count(int(time.time()))
+    monkeypatch.setattr(
+        metric_cache, "time", types.SimpleNamespace(time=lambda: next(clock))
+    )
+    # Series are evicted 16 at a time, so the fleet needs more than that
+    volume_ids = [f"vol-{i}" for i in range(12)]
+    list(
+        iter_cached_volume_metric_pages(
+            FakeCloudWatch(),
+            [(volume_id, IOPS_METRIC_IDS) for volume_id in volume_ids],
+            START,
+            END,
+            cache,
+        )
+    )
+    # Use the volumes again, most recently the first ones
+    for volume_id in reversed(volume_ids):
+        list(cache.iter_volume_pages([(volume_id, IOPS_METRIC_IDS)], START, END))
+
+    cache.max_bytes = cache.used_bytes() * 9 // 10
+    evicted = cache.evict()
+
+    assert evicted == 16
+    assert cache.used_bytes() <= cache.max_bytes
+    range_start = to_epoch(START)
+    range_end = to_epoch(END)
+    missing = {
+        volume_id: cache.missing_ranges(
+            volume_id, IOPS_METRIC_IDS, PERIOD, range_start, range_end
+        )
+        for volume_id in volume_ids
+    }
+    # The last six volumes were used least recently. Five of them and one
+    # series of the sixth were evicted
+    assert all(missing[volume_id] == [] for volume_id in volume_ids[:6])
+    assert all(
+        missing[volume_id] == [(range_start, range_end)] for volume_id in volume_ids[6:]
+    )
@@ -0,0 +1,75 @@
+import numpy as np
+import pytest
+
+from assessment_engine import QuantileSketch
+
+QUANTILES = [0.0, 0.01, 0.25, 0.5, 0.9, 0.95, 0.99, 0.999]
+
+
+def exact_quantile(values, q):
+    """
+    The value at rank q * (count - 1) of the sorted values, rounded down, as
+    the sketch ranks them.
+    """
+    return float(np.quantile(values, q, method="lower"))
+
+
+def assert_within_accuracy(sketch, values, relative_accuracy):
+    for q in QUANTILES:
+        exact = exact_quantile(values, q)
+        estimate = sketch.quantile(q)
+        if exact < sketch.min_value:
+            assert estimate == 0.0
+        else:
+            assert abs(estimate - exact) <= relative_accuracy * exact * (1 + 1e-9)
+
+
+@pytest.mark.parametrize("relative_accuracy", [0.01, 0.05])
+@pytest.mark.parametrize("seed", range(3))
+def test_quantiles_are_within_the_relative_accuracy(relative_accuracy, seed):
+    rng = np.random.default_rng(seed)
+    # IOPS-like values over several orders of magnitude, with idle buckets
+    values = np.concatenate(
+        (rng.lognormal(5, 2, 20000), np.zeros(500), rng.uniform(0, 0.01, 100))
+    )
+    sketch = QuantileSketch(relative_accuracy)
+    for page in np.array_split(rng.permutation(values), 7):
+        sketch.add(page)
+
+    assert sketch.count == len(values)
+    assert sketch.quantile(1) == values.max()
+    assert_within_accuracy(sketch, values, relative_accuracy)
+
+
+def test_weight_counts_each_value_several_times():
+    rng = np.random.default_rng(0)
+    values = rng.lognormal(5, 1, 1000)
+    weighted = QuantileSketch()
+    weighted.add(values, weight=3)
+    repeated = QuantileSketch()
+    repeated.add(np.repeat(values, 3))
+
+    assert weighted.count == repeated.count
+    assert [weighted.quantile(q) for q in QUANTILES] == [
+        repeated.quantile(q) for q in QUANTILES
+    ]
+
+
+def test_memory_does_not_grow_with_the_values():
+    sketch = QuantileSketch()
+    buckets = len(sketch.counts)
+    sketch.add(np.random.default_rng(0).lognormal(5, 3, 100000))
+
+    assert len(sketch.counts) == buckets
+
+
+def test_empty_and_reset():
+    sketch = QuantileSketch()
+
+    assert sketch.quantile(0.5) is None
+
+    sketch.add([1.0, 2.0])
+    sketch.reset()
+
+    assert sketch.quantile(0.5) is None
+    assert sketch.max == 0.0
@@ -0,0 +1,129 @@
+from datetime import datetime, timezone
+
+import numpy as np
+import pytest
+
+from assessment_engine import SeriesJoin
+
+METRIC_IDS = ("read_ops", "write_ops", "idle_time")
+START = 1577836800
+PERIOD = 300
+
+
+def value(row, timestamp):
+    return float(row * 1000000 + (timestamp - START) // PERIOD)
+
+
+def result(row, timestamps, status="Complete"):
+    return {
+        "Id": METRIC_IDS[row],
+        "Timestamps": [
+            datetime.fromtimestamp(int(timestamp), timezone.utc)
+            for timestamp in timestamps
+        ],
+        "Values": [value(row, int(timestamp)) for timestamp in timestamps],
+        "StatusCode": status,
+    }
+
+
+def baseline_join(series):
+    """
+    Join the whole series at once, on the timestamps every series has.
+    """
+    common = set.intersection(*(set(timestamps.tolist()) for timestamps in series))
+    return {
+        timestamp: tuple(value(row, timestamp) for row in range(len(series)))
+        for timestamp in common
+    }
+
+
+def paged(rng, series, pages, descending):
+    """
+    Split every series into the same number of pages at different points.
+    Each series is complete from the page after its last datapoint.
+    """
+    chunks = []
+    for timestamps in series:
+        if descending:
+            timestamps = timestamps[::-1]
+        cuts = np.sort(rng.integers(0, len(timestamps) + 1, pages - 1))
+        chunks.append(np.split(timestamps, cuts))
+
+    for page_index in range(pages):
+        page = {}
+        for row, metric_id in enumerate(METRIC_IDS):
+            remaining = sum(len(chunk) for chunk in chunks[row][page_index + 1 :])
+            page[metric_id] = result(
+                row,
+                chunks[row][page_index],
+                "PartialData" if remaining else "Complete",
+            )
+        yield page
+
+
+def join_pages(join, pages):
+    joined = {}
+    for page in pages:
+        common, block = join.add(page)
+        for timestamp, values in zip(common.tolist(), block.T.tolist()):
+            assert timestamp not in joined
+            joined[timestamp] = tuple(values)
+    return joined
+
+
+@pytest.mark.parametrize("seed", range(10))
+@pytest.mark.parametrize("pages", [1, 2, 5])
+@pytest.mark.parametrize("descending", [True, False])
+def test_paged_join_matches_the_whole_series_join(seed, pages, descending):
+    rng = np.random.default_rng(seed)
+    grid = START + PERIOD * np.arange(400)
+    # Every series misses some buckets
+    series = [np.sort(rng.choice(grid, 360, replace=False)) for _ in METRIC_IDS]
+
+    assert join_pages(
+        SeriesJoin(METRIC_IDS), paged(rng, series, pages, descending)
+    ) == baseline_join(series)
+
+
+def test_datapoints_are_carried_over_to_the_next_page():
+    grid = START + PERIOD * np.arange(10)
+    # The first series returns every bucket in the first page, the others
+    # return half of them in each page
+    first_page = {
+        "read_ops": result(0, grid),
+        "write_ops": result(1, grid[:5], "PartialData"),
+        "idle_time": result(2, grid[:5], "PartialData"),
+    }
+    second_page = {
+        "read_ops": result(0, []),
+        "write_ops": result(1, grid[5:]),
+        "idle_time": result(2, grid[5:]),
+    }
+
+    join = SeriesJoin(METRIC_IDS)
+    first_common, _ = join.add(first_page)
+    second_common, second_block = join.add(second_page)
+
+    assert first_common.tolist() == grid[:5].tolist()
+    assert second_common.tolist() == grid[5:].tolist()
+    assert second_block.tolist() == [
+        [value(row, timestamp) for timestamp in grid[5:].tolist()]
+        for row in range(len(METRIC_IDS))
+    ]
+
+
+def test_a_new_request_does_not_join_with_the_previous_one():
+    join = SeriesJoin(METRIC_IDS)
+    first_request = {
+        "read_ops": result(0, [START]),
+        "write_ops": result(1, []),
+        "idle_time": result(2, [START]),
+    }
+    second_request = {
+        "read_ops": result(0, []),
+        "write_ops": result(1, [START]),
+        "idle_time": result(2, []),
+    }
+
+    assert join.add(first_request)[0].tolist() == []
+    assert join.add(second_request)[0].tolist() == []
@@ -0,0 +1,76 @@
+from datetime import datetime, timedelta, timezone
+import math
+
+import pytest
+
+import metric_fetch
+from fake_cloudwatch import FakeCloudWatch, collect_series
+from metric_fetch import (
+    IOPS_METRIC_IDS,
+    iter_volume_metric_pages,
+    split_time_range,
+    to_epoch,
+)
+
+START = datetime(2020, 1, 1, 0, 7, 13, tzinfo=timezone.utc)
+
+
+def buckets(start_time, end_time, period):
+    return range(
+        math.ceil(to_epoch(start_time) / period) * period, to_epoch(end_time), period
+    )
+
+
+@pytest.mark.parametrize("period", [60, 300, 3600, 86400])
+@pytest.mark.parametrize("parts", [1, 2, 3, 7, 64])
+@pytest.mark.parametrize("days", [0.01, 1, 9.5, 63])
+def test_sub_ranges_cover_every_bucket_once(period, parts, days):
+    end_time = START + timedelta(days=days)
+    time_ranges = split_time_range(START, end_time, period, parts)
+
+    assert 1 <= len(time_ranges) <= parts
+    assert time_ranges[0][0] is START
+    assert time_ranges[-1][1] is end_time
+    step = period * 3600 // math.gcd(period, 3600)
+    for (_, range_end), (range_start, _) in zip(time_ranges, time_ranges[1:]):
+        assert range_end == range_start
+        assert to_epoch(range_start) % step == 0
+    assert all(to_epoch(start) < to_epoch(end) for start, end in time_ranges)
+
+    range_buckets = [
+        bucket
+        for range_start, range_end in time_ranges
+        for bucket in buckets(range_start, range_end, period)
+    ]
+    assert range_buckets == list(buckets(START, end_time, period))
+
+
+def test_a_range_shorter_than_a_boundary_step_is_not_split():
+    end_time = START + timedelta(minutes=40)
+
+    assert split_time_range(START, end_time, 300, 8) == [(START, end_time)]
+
+
+def test_split_fetch_matches_a_single_range(monkeypatch):
+    monkeypatch.setattr(metric_fetch, "MAX_METRIC_DATA_DATAPOINTS", 1000)
+    volume_metric_ids = [("vol-1", IOPS_METRIC_IDS), ("vol-2", IOPS_METRIC_IDS)]
+    end_time = START + timedelta(days=2)
+
+    expected = collect_series(
+        iter_volume_metric_pages(
+            FakeCloudWatch(page_datapoints=1000), volume_metric_ids, START, end_time
+        )
+    )
+    cloudwatch = FakeCloudWatch(page_datapoints=1000)
+    split = collect_series(
+        iter_volume_metric_pages(
+            cloudwatch, volume_metric_ids, START, end_time, range_workers=4
+        )
+    )
+
+    assert split == expected
+    # The sub-ranges are requested from parallel threads
+    requests = sorted(cloudwatch.requests)
+    assert len(requests) == 4
+    assert requests[0][0] == to_epoch(START)
+    assert requests[-1][1] == to_epoch(end_time)
@@ -0,0 +1,106 @@
+import numpy as np
+import pytest
+
+from assessment_engine import ThresholdSweep, expression_values
+
+ALLOCATED_IOPS = 3000
+THRESHOLDS = [0, 500, 1000, 2000, 4000]
+
+
+def baseline_matches(read_ops, write_ops, idle_times, allocated_iops, thresholds):
+    """
+    The per-datapoint, per-threshold loop of the assessment scripts before
+    the sweep.
+    """
+    datapoints = 0
+    match = 0
+    matches = [0] * len(thresholds)
+    matches_saving = [0] * len(thresholds)
+    for read, write, idle_time in zip(read_ops, write_ops, idle_times):
+        if idle_time is not None and idle_time >= 300:
+            idle_time = 299.999999999
+        if read is None or write is None or idle_time is None:
+            continue
+
+        expression_value = (read + write) / (300 - idle_time)
+        datapoints += 1
+        for i in range(len(thresholds)):
+            if thresholds[i] == 0:
+                if expression_value >= allocated_iops:
+                    match += 1
+            else:
+                if expression_value >= allocated_iops + thresholds[i]:
+                    matches[i] += 1
+                if expression_value >= allocated_iops - thresholds[i]:
+                    matches_saving[i] += 1
+    return datapoints, match, matches, matches_saving
+
+
+def sweep_matches(pages, allocated_iops, thresholds):
+    limits = [allocated_iops]
+    limits += [allocated_iops + threshold for threshold in thresholds[1:]]
+    limits += [allocated_iops - threshold for threshold in thresholds[1:]]
+    sweep = ThresholdSweep(limits)
+    for read_ops, write_ops, idle_times in pages:
+        sweep.add(
+            expression_values(
+                [np.nan if value is None else value for value in read_ops],
+                [np.nan if value is None else value for value in write_ops],
+                [np.nan if value is None else value for value in idle_times],
+            )
+        )
+
+    counts = sweep.matches()
+    added = len(thresholds) - 1
+    return (
+        sweep.datapoints,
+        counts[0],
+        [0] + counts[1 : 1 + added],
+        [0] + counts[1 + added :],
+    )
+
+
+def random_pages(seed, pages=4, size=500):
+    rng = np.random.default_rng(seed)
+    result = []
+    for _ in range(pages):
+        read_ops = (rng.beta(2, 5, size) * 2000000).tolist()
+        write_ops = (rng.beta(2, 5, size) * 1000000).tolist()
+        idle_times = rng.choice([0.0, 10.0, 150.0, 299.5, 300.0, 400.0], size).tolist()
+        for values in (read_ops, write_ops, idle_times):
+            for index in rng.choice(size, size // 50, replace=False):
+                values[index] = None
+        result.append((read_ops, write_ops, idle_times))
+    return result
+
+
+@pytest.mark.parametrize("seed", [1, 2, 3])
+def test_sweep_matches_the_per_threshold_loop(seed):
+    pages = random_pages(seed)
+    flat = [sum((list(page[row]) for page in pages), []) for row in range(3)]
+
+    assert sweep_matches(pages, ALLOCATED_IOPS, THRESHOLDS) == baseline_matches(
+        *flat, ALLOCATED_IOPS, THRESHOLDS
+    )
+
+
+def test_values_equal_to_a_limit_match():
+    sweep = ThresholdSweep([1.0, 2.0, 3.0])
+    sweep.add([1.0, 2.0, 2.0, 3.0, 0.5])
+
+    assert sweep.matches() == [4, 3, 1]
+    assert sweep.datapoints == 5
+
+
+def test_weight_and_reset():
+    sweep = ThresholdSweep([1.0, 2.0])
+    sweep.add([0.0, 1.5, 2.5], weight=3)
+
+    assert sweep.matches() == [6, 3]
+    assert sweep.datapoints == 9
+
+    sweep.reset()
+    sweep.add(np.empty(0))
+
+    assert sweep.matches() == [0, 0]
+    assert sweep.datapoints == 0
@@ -0,0 +1,263 @@
+import json
+
+import pytest
+
+from dashboard import (
+    create_cpu_widget,
+    create_iops_widget,
+    create_template_widgets,
+    create_throughput_widget,
+)
+from widget_templates import WidgetTemplate, load_widget_templates
+
+
+def baseline_cpu_widget(instance_id, target_region, instance_name):
+    # The widget builders as they were before the templates
+    widget = {
+        "type": "metric",
+        "x": 0,
+        "y": 0,
+        "width": 12,
+        "height": 6,
+        "properties": {
+            "metrics": [["AWS/EC2", "CPUUtilization", "InstanceId", instance_id]],
+            "view": "timeSeries",
+            "stacked": False,
+            "region": target_region,
+            "stat": "Maximum",
+            "period": 300,
+            "title": f"{instance_name}_{instance_id}_CPU",
+        },
+    }
+    return widget
+
+
+def baseline_iops_widget(
+    volume_id, target_region, vol_name_tag, volume_type, allocated_iops, period=300
+):
+    widget = {
+        "type": "metric",
+        "x": 0,
+        "y": 0,
+        "width": 12,
+        "height": 6,
+        "properties": {
+            "metrics": [
+                [{"expression": f"(m1+m2)/({period}-m3)", "label": "IOPS", "id": "e1"}],
+                [
+                    "AWS/EBS",
+                    "VolumeReadOps",
+                    "VolumeId",
+                    volume_id,
+                    {"id": "m1", "visible": False},
+                ],
+                [".", "VolumeWriteOps", ".", ".", {"id": "m2", "visible": False}],
+                [".", "VolumeIdleTime", ".", ".", {"id": "m3", "visible": False}],
+            ],
+            "view": "timeSeries",
+            "stacked": False,
+            "region": target_region,
+            "stat": "Sum",
+            "period": period,
+            "title": f"{vol_name_tag}_{volume_type}_IOPS",
+        },
+    }
+
+    if allocated_iops != "N/A":
+        iops_annotation = {"horizontal": [{"label": "IOPS", "value": allocated_iops}]}
+        widget["properties"]["annotations"] = iops_annotation
+
+    else:
+        widget["properties"].pop("annotations", None)
+
+    return widget
+
+
+def baseline_throughput_widget(
+    volume_id,
+    target_region,
+    vol_name_tag,
+    volume_type,
+    allocated_throughput,
+    period=300,
+):
+    widget = {
+        "type": "metric",
+        "x": 0,
+        "y": 0,
+        "width": 12,
+        "height": 6,
+        "properties": {
+            "metrics": [
+                [
+                    {
+                        "expression": f"(m1+m2)/({period}-m3)",
+                        "label": "Throughput",
+                        "id": "e1",
+                    }
+                ],
+                [
+                    "AWS/EBS",
+                    "VolumeReadBytes",
+                    "VolumeId",
+                    volume_id,
+                    {"id": "m1", "visible": False},
+                ],
+                [".", "VolumeWriteBytes", ".", ".", {"id": "m2", "visible": False}],
+                [".", "VolumeIdleTime", ".", ".", {"id": "m3", "visible": False}],
+            ],
+            "view": "timeSeries",
+            "stacked": False,
+            "region": target_region,
+            "stat": "Sum",
+            "period": period,
+            "title": f"{vol_name_tag}_{volume_type}_Throughput",
+        },
+    }
+
+    if allocated_throughput != "N/A":
+        allocated_throughput = allocated_throughput * 1000000
+        throughput_annotation = {
+            "horizontal": [{"label": "Throughput", "value": allocated_throughput}]
+        }
+        widget["properties"]["annotations"] = throughput_annotation
+    else:
+        widget["properties"].pop("annotations", None)
+    return widget
+
+
+VOLUMES = [
+    ("vol-0c491ab40b4372f34", "data_vol-0c491ab40b4372f34", "gp3", 3000, 125),
+    ("vol-1", "web-2_vol-1", "gp2", "N/A", "N/A"),
+    ("vol-2", "odd {name}_vol-2", "io2", 1520.79, 1000.5),
+]
+
+
+@pytest.mark.parametrize("volume", VOLUMES)
+@pytest.mark.parametrize("period", [60, 300, 3600])
+def test_volume_widgets_match_the_baseline_byte_for_byte(volume, period):
+    volume_id, vol_name_tag, volume_type, allocated_iops, allocated_throughput = volume
+
+    for widget, baseline in [
+        (
+            create_iops_widget(
+                volume_id,
+                "us-east-1",
+                vol_name_tag,
+                volume_type,
+                allocated_iops,
+                period,
+            ),
+            baseline_iops_widget(
+                volume_id,
+                "us-east-1",
+                vol_name_tag,
+                volume_type,
+                allocated_iops,
+                period,
+            ),
+        ),
+        (
+            create_throughput_widget(
+                volume_id,
+                "us-east-1",
+                vol_name_tag,
+                volume_type,
+                allocated_throughput,
+                period,
+            ),
+            baseline_throughput_widget(
+                volume_id,
+                "us-east-1",
+                vol_name_tag,
+                volume_type,
+                allocated_throughput,
+                period,
+            ),
+        ),
+    ]:
+        assert json.dumps(widget) == json.dumps(baseline)
+
+
+def test_cpu_widget_matches_the_baseline_byte_for_byte():
+    assert json.dumps(
+        create_cpu_widget("i-0123456789abcdef0", "eu-west-1", "web-2")
+    ) == json.dumps(baseline_cpu_widget("i-0123456789abcdef0", "eu-west-1", "web-2"))
+
+
+def test_rendered_widgets_do_not_share_their_fields():
+    first = create_iops_widget("vol-1", "us-east-1", "a", "gp3", 3000)
+    second = create_iops_widget("vol-2", "us-east-1", "b", "gp3", 4000)
+
+    assert first["properties"]["metrics"][1][3] == "vol-1"
+    assert first["properties"]["annotations"]["horizontal"][0]["value"] == 3000
+    assert second["properties"]["metrics"][1][3] == "vol-2"
+
+
+def test_fields_keep_their_type_and_literal_braces_are_kept():
+    template = WidgetTemplate(
+        {"period": "{period}", "label": "{{literal}} {volume_id}", "tag": "{tag}"}
+    )
+
+    assert template.render({"period": 60, "volume_id": "vol-1", "tag": None}) == {
+        "period": 60,
+        "label": "{literal} vol-1",
+    }
+
+
+def test_user_templates_render_per_volume(tmp_path):
+    path = tmp_path / "widgets.json"
+    path.write_text(
+        json.dumps(
+            [
+                {
+                    "type": "metric",
+                    "width": 12,
+                    "height": 6,
+                    "properties": {
+                        "metrics": [
+                            ["AWS/EBS", "VolumeQueueLength", "VolumeId", "{volume_id}"]
+                        ],
+                        "region": "{region}",
+                        "period": "{period}",
+                        "title": "{vol_name_tag}_{volume_type}_QueueLength",
+                    },
+                }
+            ]
+        )
+    )
+
+    widgets = create_template_widgets(
+        load_widget_templates(path),
+        "web",
+        "i-1",
+        "vol-1",
+        "us-east-1",
+        "data_vol-1",
+        "gp3",
+        3000,
+        125,
+        60,
+    )
+
+    assert widgets == [
+        {
+            "type": "metric",
+            "width": 12,
+            "height": 6,
+            "properties": {
+                "metrics": [["AWS/EBS", "VolumeQueueLength", "VolumeId", "vol-1"]],
+                "region": "us-east-1",
+                "period": 60,
+                "title": "data_vol-1_gp3_QueueLength",
+            },
+        }
+    ]
+
+
+def test_unknown_template_fields_are_rejected(tmp_path):
+    path = tmp_path / "widgets.json"
+    path.write_text(json.dumps([{"properties": {"title": "{hostname}"}}]))
+
+    with pytest.raises(ValueError, match="hostname"):
+        load_widget_templates(path)
@@ -0,0 +1,343 @@
+from collections import namedtuple
+
+# EC2 accepts up to 200 values per filter
+MAX_FILTER_VALUES = 200
+
+# Largest describe_instances page
+DESCRIBE_INSTANCES_PAGE_SIZE = 1000
+
+# Terminated instances keep their Name tag for a while, and would make a
+# reused name look ambiguous
+LIVE_INSTANCE_STATES = ["pending", "running", "shutting-down", "stopping", "stopped"]
+
+VolumeRecord = namedtuple(
+    "VolumeRecord",
+    [
+        "volume_id",
+        "allocated_iops",
+        "allocated_throughput",
+        "vol_name_tag",
+        "volume_type",
+    ],
+)
+
+
+def volume_record(volume_info):
+    """
+    Build a compact record from one describe_volumes entry.
+
+    Args:
+    - volume_info: A volume dictionary returned by describe_volumes.
+
+    Returns:
+    - A VolumeRecord. Iops and Throughput are "N/A" when the volume type has
+      no provisioned value.
+    """
+    vol_name_tag = None
+    for tag in volume_info.get("Tags", []):
+        if tag["Key"] == "Name":
+            vol_name_tag = tag["Value"]
+            break
+
+    return VolumeRecord(
+        volume_info["VolumeId"],
+        volume_info.get("Iops", "N/A"),
+        volume_info.get("Throughput", "N/A"),
+        vol_name_tag,
+        volume_info["VolumeType"],
+    )
+
+
+def get_instance_id_from_name(ec2, instance_name, lookup_cache=None):
+    """
+    Get the ID of the live instance with the given Name tag, with
+    resolve_instance_names.
+
+    Args:
+    - ec2: EC2 client used for the request.
+    - instance_name: The Name tag of the instance.
+    - lookup_cache: Optional LookupCache the instance ID is read through.
+
+    Returns:
+    - The instance ID, or None when no live instance has the given name. A
+      ValueError is raised when several live instances have it.
+    """
+    instance_ids = resolve_instance_names(ec2, [instance_name], lookup_cache)
+    return single_instance_id(instance_name, instance_ids[instance_name])
+
+
+def single_instance_id(instance_name, instance_ids):
+    """
+    Get the only ID of a resolved name, see get_instance_id_from_name.
+    """
+    if len(instance_ids) > 1:
+        raise ValueError(ambiguous_name_message(instance_name, instance_ids))
+    return instance_ids[0] if instance_ids else None
+
+
+def ambiguous_name_message(instance_name, instance_ids):
+    return f"The name '{instance_name}' matches {len(instance_ids)} instances ({', '.join(instance_ids)})"
+
+
+def resolve_instance_names(ec2, instance_names, lookup_cache=None):
+    """
+    Resolve many Name tags at once, with paginated describe_instances calls
+    that each filter on up to MAX_FILTER_VALUES names. Terminated instances
+    are ignored.
+
+    Args:
+    - ec2: EC2 client used for the requests.
+    - instance_names: List of Name tags.
+    - lookup_cache: Optional LookupCache the instance IDs are read through.
+      Only names that match exactly one instance are cached, in the same
+      entries as get_instance_id_from_name.
+
+    Returns:
+    - A dictionary of name to the list of IDs of the instances with that
+      Name tag, in input order. The list is empty for a missing name and
+      holds several IDs for an ambiguous one.
+    """
+    instance_ids, unresolved = cached_instance_ids(ec2, instance_names, lookup_cache)
+
+    paginator = ec2.get_paginator("describe_instances")
+    for start in range(0, len(unresolved), MAX_FILTER_VALUES):
+        pages = paginator.paginate(
+            Filters=instance_name_filters(
+                unresolved[start : start + MAX_FILTER_VALUES]
+            ),
+            PaginationConfig={"PageSize": DESCRIBE_INSTANCES_PAGE_SIZE},
+        )
+        for page in pages:
+            add_named_instances(instance_ids, page)
+
+    cache_instance_ids(ec2, instance_ids, unresolved, lookup_cache)
+    return instance_ids
+
+
+def cached_instance_ids(ec2, instance_names, lookup_cache=None):
+    """
+    Start resolving Name tags from the lookup cache.
+
+    Returns:
+    - A tuple containing a dictionary of every name to the list of its
+      cached instance ID (empty when not cached) and the list of the names
+      that are not cached.
+    """
+    instance_ids = {instance_name: [] for instance_name in instance_names}
+    unresolved = []
+    for instance_name in instance_ids:
+        instance_id = None
+        if lookup_cache:
+            instance_id = lookup_cache.get(
+                "instance_id", [ec2.meta.region_name, instance_name]
+            )
+        if instance_id:
+            instance_ids[instance_name].append(instance_id)
+        else:
+            unresolved.append(instance_name)
+    return instance_ids, unresolved
+
+
+def cache_instance_ids(ec2, instance_ids, instance_names, lookup_cache=None):
+    """
+    Cache the resolved instance ID of the names that match exactly one
+    instance.
+    """
+    if not lookup_cache:
+        return
+    for instance_name in instance_names:
+        if len(instance_ids[instance_name]) == 1:
+            lookup_cache.put(
+                "instance_id",
+                [ec2.meta.region_name, instance_name],
+                instance_ids[instance_name][0],
+            )
+
+
+def instance_name_filters(instance_names):
+    """
+    Build the describe_instances filters for the live instances with any of
+    the given Name tags.
+    """
+    return [
+        {"Name": "tag:Name", "Values": instance_names},
+        {"Name": "instance-state-name", "Values": LIVE_INSTANCE_STATES},
+    ]
+
+
+def add_named_instances(instance_ids, page):
+    """
+    Add the instances of a describe_instances page to the ID lists of the
+    names they are tagged with, for the names that are keys of instance_ids.
+    """
+    for reservation in page["Reservations"]:
+        for instance in reservation["Instances"]:
+            for tag in instance.get("Tags", []):
+                if tag["Key"] == "Name" and tag["Value"] in instance_ids:
+                    instance_ids[tag["Value"]].append(instance["InstanceId"])
+
+
+def discover_instances(ec2, tag_filters):
+    """
+    Find every live instance whose tags match all the given filters, with
+    the describe_instances paginator.
+
+    Args:
+    - ec2: EC2 client used for the requests.
+    - tag_filters: Dictionary of tag key to the list of accepted values.
+
+    Returns:
+    - A dictionary of name to the list of IDs of the instances with that
+      Name tag, in the order EC2 returns them. Instances without a Name tag
+      are keyed by their ID.
+    """
+    instance_ids = {}
+    paginator = ec2.get_paginator("describe_instances")
+    pages = paginator.paginate(
+        Filters=tag_filter_list(tag_filters),
+        PaginationConfig={"PageSize": DESCRIBE_INSTANCES_PAGE_SIZE},
+    )
+    for page in pages:
+        add_discovered_instances(instance_ids, page)
+    return instance_ids
+
+
+def tag_filter_list(tag_filters):
+    """
+    Build the describe_instances filters for the live instances whose tags
+    match all the given tag filters.
+    """
+    filters = [
+        {"Name": f"tag:{key}", "Values": values} for key, values in tag_filters.items()
+    ]
+    filters.append({"Name": "instance-state-name", "Values": LIVE_INSTANCE_STATES})
+    return filters
+
+
+def add_discovered_instances(instance_ids, page):
+    """
+    Add every instance of a describe_instances page to the ID list of its
+    Name tag, or of its ID when it has no Name tag.
+    """
+    for reservation in page["Reservations"]:
+        for instance in reservation["Instances"]:
+            instance_name = instance["InstanceId"]
+            for tag in instance.get("Tags", []):
+                if tag["Key"] == "Name":
+                    instance_name = tag["Value"]
+                    break
+            instance_ids.setdefault(instance_name, []).append(instance["InstanceId"])
+
+
+def get_volumes_by_instance(ec2, instance_ids, lookup_cache=None):
+    """
+    Get the EBS volumes of many instances with paginated describe_volumes
+    calls that each filter on up to MAX_FILTER_VALUES instances.
+
+    Args:
+    - ec2: EC2 client used for the requests.
+    - instance_ids: List of instance IDs.
+    - lookup_cache: Optional LookupCache the volumes are read through, in
+      the same entries as get_instance_volumes.
+
+    Returns:
+    - A dictionary of instance ID to its list of VolumeRecord tuples, in the
+      order EC2 returns them.
+    """
+    volumes, uncached = cached_volumes(ec2, instance_ids, lookup_cache)
+
+    paginator = ec2.get_paginator("describe_volumes")
+    for start in range(0, len(uncached), MAX_FILTER_VALUES):
+        pages = paginator.paginate(
+            Filters=[
+                {
+                    "Name": "attachment.instance-id",
+                    "Values": uncached[start : start + MAX_FILTER_VALUES],
+                }
+            ]
+        )
+        for page in pages:
+            add_attached_volumes(volumes, page)
+
+    cache_volumes(ec2, volumes, uncached, lookup_cache)
+    return volumes
+
+
+def cached_volumes(ec2, instance_ids, lookup_cache=None):
+    """
+    Start getting the volumes of many instances from the lookup cache.
+
+    Returns:
+    - A tuple containing a dictionary of every instance ID to its list of
+      cached VolumeRecord tuples (empty when not cached) and the list of the
+      instance IDs that are not cached.
+    """
+    volumes = {}
+    uncached = []
+    for instance_id in instance_ids:
+        cached = None
+        if lookup_cache:
+            cached = lookup_cache.get("volumes", [ec2.meta.region_name, instance_id])
+        if cached is None:
+            volumes[instance_id] = []
+            uncached.append(instance_id)
+        else:
+            volumes[instance_id] = [VolumeRecord(*volume) for volume in cached]
+    return volumes, uncached
+
+
+def cache_volumes(ec2, volumes, instance_ids, lookup_cache=None):
+    """
+    Cache the volumes of the given instances.
+    """
+    if not lookup_cache:
+        return
+    for instance_id in instance_ids:
+        lookup_cache.put(
+            "volumes", [ec2.meta.region_name, instance_id], volumes[instance_id]
+        )
+
+
+def add_attached_volumes(volumes, page):
+    """
+    Add the volumes of a describe_volumes page to the volume lists of the
+    instances they are attached to, for the instances that are keys of
+    volumes.
+    """
+    for volume in page["Volumes"]:
+        record = volume_record(volume)
+        # A multi-attached volume belongs to every instance it is attached to
+        for attachment in volume.get("Attachments", []):
+            if attachment["InstanceId"] in volumes:
+                volumes[attachment["InstanceId"]].append(record)
+
+
+def get_instance_volumes(ec2, instance_id, lookup_cache=None):
+    """
+    Get every EBS volume attached to an instance with paginated describe_volumes
+    calls, instead of one call per volume.
+
+    Args:
+    - ec2: EC2 client used for the requests.
+    - instance_id: The ID of the EC2 instance.
+    - lookup_cache: Optional LookupCache the volumes are read through.
+
+    Returns:
+    - A list of VolumeRecord tuples, in the order EC2 returns them.
+    """
+    if lookup_cache:
+        volumes = lookup_cache.memoize(
+            "volumes",
+            [ec2.meta.region_name, instance_id],
+            get_instance_volumes,
+            ec2,
+            instance_id,
+        )
+        return [VolumeRecord(*volume) for volume in volumes]
+
+    paginator = ec2.get_paginator("describe_volumes")
+    pages = paginator.paginate(
+        Filters=[{"Name": "attachment.instance-id", "Values": [instance_id]}]
+    )
+
+    return [volume_record(volume) for page in pages for volume in page["Volumes"]]
@@ -0,0 +1,167 @@
+import json
+import string
+
+# Fields available to the per-volume widget templates
+VOLUME_WIDGET_FIELDS = {
+    "instance_name",
+    "instance_id",
+    "volume_id",
+    "region",
+    "vol_name_tag",
+    "volume_type",
+    "allocated_iops",
+    "allocated_throughput",
+    "period",
+}
+
+
+def string_fields(text):
+    return [
+        field_name
+        for _, field_name, _, _ in string.Formatter().parse(text)
+        if field_name is not None
+    ]
+
+
+def single_field(node):
+    # The field name of a string that is exactly one field, such as "{period}"
+    if not isinstance(node, str):
+        return None
+    node_fields = string_fields(node)
+    if node_fields and node == f"{{{node_fields[0]}}}":
+        return node_fields[0]
+    return None
+
+
+def constant(value):
+    return lambda values: value
+
+
+def without_none(rendered, keys):
+    for key in keys:
+        if rendered[key] is None:
+            del rendered[key]
+    return rendered
+
+
+def compile_string(text):
+    parsed = list(string.Formatter().parse(text))
+    if any(format_spec or conversion for _, _, format_spec, conversion in parsed):
+        return lambda values: text.format_map(values)
+
+    # Concatenate the literal parts with the value of each field
+    parts = [(literal_text, field_name) for literal_text, field_name, _, _ in parsed]
+
+    def render(values):
+        pieces = []
+        for literal_text, field_name in parts:
+            pieces.append(literal_text)
+            if field_name is not None:
+                pieces.append(format(values[field_name]))
+        return "".join(pieces)
+
+    return render
+
+
+def compile_node(node, fields):
+    """
+    Compile one node of a widget skeleton into a function that builds it
+    from a dictionary of field values.
+
+    Args:
+    - node: A dictionary, list, string or other JSON value.
+    - fields: Set the names of the node's fields are added to.
+
+    Returns:
+    - A tuple containing the function and whether the node has fields. The
+      function of a node without fields returns the same value every time.
+    """
+    if isinstance(node, dict):
+        items = [(key, *compile_node(value, fields)) for key, value in node.items()]
+        if not any(dynamic for _, _, dynamic in items):
+            return constant({key: render(None) for key, render, _ in items}), False
+
+        # A field whose value is None drops its whole entry
+        optional_keys = [key for key, value in node.items() if single_field(value)]
+
+        def render_dict(values):
+            rendered = {key: render(values) for key, render, _ in items}
+            return without_none(rendered, optional_keys)
+
+        return render_dict, True
+
+    if isinstance(node, list):
+        items = [compile_node(value, fields) for value in node]
+        if not any(dynamic for _, dynamic in items):
+            return constant([render(None) for render, _ in items]), False
+        renders = [render for render, _ in items]
+        return lambda values: [render(values) for render in renders], True
+
+    if isinstance(node, str):
+        node_fields = string_fields(node)
+        if not node_fields:
+            text = node.format() if "{" in node or "}" in node else node
+            return constant(text), False
+        fields.update(node_fields)
+        field_name = single_field(node)
+        if field_name:
+            # The field's value keeps its type, such as an int period
+            return lambda values: values[field_name], True
+        return compile_string(node), True
+
+    return constant(node), False
+
+
+class WidgetTemplate:
+    """
+    A widget skeleton compiled once into nested functions that build the
+    widget, substituting its fields.
+
+    Strings of the skeleton may hold str.format fields, such as
+    "{volume_id}_IOPS", and literal braces are written "{{" and "}}". A
+    string that is exactly one field is replaced by the field's value,
+    keeping its type, and a dictionary entry whose field value is None is
+    left out. Parts of the skeleton without fields are shared by every
+    rendered widget, so rendered widgets must not be modified in place.
+
+    template.render(values) builds a widget from a dictionary of field
+    values.
+    """
+
+    def __init__(self, skeleton):
+        self.skeleton = skeleton
+        self.fields = set()
+        self.render, _ = compile_node(skeleton, self.fields)
+
+
+def load_widget_templates(path):
+    """
+    Load user-defined per-volume widget templates from a JSON file.
+
+    The file holds a list of widget skeletons that may use the
+    VOLUME_WIDGET_FIELDS, for example a VolumeQueueLength graph:
+
+        [{"type": "metric", "x": 0, "y": 0, "width": 12, "height": 6,
+          "properties": {"metrics": [["AWS/EBS", "VolumeQueueLength",
+          "VolumeId", "{volume_id}"]], "region": "{region}", "stat":
+          "Average", "period": "{period}", "title":
+          "{vol_name_tag}_{volume_type}_QueueLength"}}]
+
+    Returns:
+    - A list of WidgetTemplate.
+    """
+    with open(path) as templates_file:
+        skeletons = json.load(templates_file)
+    if not isinstance(skeletons, list):
+        raise ValueError(f"'{path}' must hold a list of widgets")
+
+    templates = []
+    for skeleton in skeletons:
+        template = WidgetTemplate(skeleton)
+        unknown_fields = template.fields - VOLUME_WIDGET_FIELDS
+        if unknown_fields:
+            raise ValueError(
+                f"Unknown widget template field(s) in '{path}': {', '.join(sorted(unknown_fields))}"
+            )
+        templates.append(template)
+    return templates